@@ -34,6 +34,78 @@ class Settings(BaseSettings):
     MAX_REQUESTS_PER_MINUTE: int = 10
     MAX_FILE_SIZE_MB: int = 50
 
+    # PDF Extraction (process pool)
+    PDF_EXTRACTION_WORKERS: int = 4      # worker processes
+    PDF_EXTRACTION_MAX_QUEUE: int = 8    # max jobs running + waiting
+    PDF_SHARD_MIN_PAGES: int = 80        # page count that switches to sharded mode
+    PDF_SHARD_WORKERS: int = 0           # parallel shards per large PDF (0/1 = disabled; enable once benchmark_pdf_extraction.py shows a speedup on the host)
+    PDF_SPECULATIVE_EXTRACTION: bool = True  # extract on idle workers while File API runs
+
+    # Extraction Cache (keyed by SHA-256 of the PDF bytes)
+    EXTRACTION_CACHE_ENTRIES: int = 128
+    EXTRACTION_CACHE_MAX_CHARS: int = 50_000_000  # total extracted text kept in memory
+    EXTRACTION_CACHE_TTL_SECONDS: int = 86400
+    EXTRACTION_CACHE_REDIS: bool = False          # share entries across workers via Redis
+
+    # Quiz response cache (keyed by module content, title and difficulty)
+    QUIZ_CACHE_ENABLED: bool = True
+    QUIZ_CACHE_ENTRIES: int = 1024
+    QUIZ_CACHE_TTL_SECONDS: int = 604800    # 7 days
+    QUIZ_CACHE_REDIS: bool = False          # share quizzes across workers via Redis
+
+    # Batch quizzes (/quiz/batch packs several modules into one model call)
+    QUIZ_BATCH_MAX_MODULES: int = 4         # modules per model call
+    QUIZ_BATCH_TOKEN_BUDGET: int = 4000     # input tokens per model call (~4 chars per token)
+    QUIZ_BATCH_CONCURRENCY: int = 4         # packed calls running at the same time
+
+    # Gemini File API reuse (processed files shared by retries, final challenge, /quiz)
+    GEMINI_FILE_TTL_SECONDS: int = 3600     # idle time before a file is deleted
+    GEMINI_FILE_SWEEP_SECONDS: int = 60
+
+    # Gemini Context Caching (shared document prefix for course/quiz/final challenge)
+    CONTEXT_CACHE_ENABLED: bool = True
+    CONTEXT_CACHE_TTL_SECONDS: int = 1800
+    CONTEXT_CACHE_MIN_TOKENS: int = 1024    # provider minimum for explicit caches
+
+    # Course generation mode
+    COURSE_GENERATION_MODE: str = "single"  # "single" (one call) or "parallel" (outline + per-module fan-out)
+    MODULE_GENERATION_CONCURRENCY: int = 4  # concurrent module calls in parallel mode
+    FINAL_CHALLENGE_MODE: str = "parallel"  # "parallel" (one call per difficulty tier) or "single"
+    GENERATION_MAX_CONTINUATIONS: int = 2   # follow-up calls when a course/final challenge stops at max_output_tokens
+    MODULE_REPAIR_MAX_MODULES: int = 3      # invalid modules regenerated one by one; more reruns the whole course
+    STRUCTURED_OUTPUT_ENABLED: bool = True  # pass response_schema (from the Pydantic models) instead of a JSON example in the prompt
+
+    # Final challenge delivery for /course
+    FINAL_CHALLENGE_DELIVERY: str = "inline"    # "inline" (in the response) or "background" (job + callback)
+    FINAL_CHALLENGE_JOB_TTL_SECONDS: int = 3600  # how long finished jobs can be polled
+    FINAL_CHALLENGE_CALLBACK_PATH: str = ""      # e.g. "/api/eduai/final-challenge" on LARAVEL_API_URL (empty = no callback)
+
+    # Async job API (local asyncio task queue)
+    TASK_QUEUE_WORKERS: int = 4             # generations running at the same time
+    TASK_QUEUE_MAX_PENDING: int = 100       # queued tasks before 503
+    TASK_RESULT_TTL_SECONDS: int = 3600     # how long finished tasks can be polled
+    SSE_KEEPALIVE_SECONDS: float = 15.0     # idle interval before a keep-alive comment on event streams
+
+    # Completion webhooks to Laravel (signed with LARAVEL_API_SECRET)
+    WEBHOOK_DEFAULT_PATH: str = ""          # callback path on LARAVEL_API_URL when a request sends none (empty = off)
+    WEBHOOK_ALLOWED_HOSTS: str = ""         # extra hosts allowed in absolute callback URLs (comma-separated)
+    WEBHOOK_OUTBOX_PATH: str = "data/webhook_outbox.db"  # SQLite outbox, survives restarts
+    WEBHOOK_MAX_ATTEMPTS: int = 8
+    WEBHOOK_INITIAL_DELAY_SECONDS: float = 2.0
+    WEBHOOK_MAX_DELAY_SECONDS: float = 300.0
+    WEBHOOK_TIMEOUT_SECONDS: float = 10.0
+    WEBHOOK_POLL_SECONDS: float = 5.0
+    WEBHOOK_DEAD_RETENTION_SECONDS: int = 604800  # keep failed ("dead") deliveries for inspection, then prune
+
+    # Duplicate request handling (/course, /final-challenge)
+    IDEMPOTENCY_TTL_SECONDS: int = 3600     # how long an Idempotency-Key replays its stored result
+    IDEMPOTENCY_MAX_ENTRIES: int = 256
+
+    # Course result store (replay after client timeouts; uses DATABASE_URL when set)
+    RESULT_STORE_ENABLED: bool = True
+    RESULT_STORE_PATH: str = "data/results.db"  # SQLite file when DATABASE_URL is empty
+    RESULT_STORE_TTL_SECONDS: int = 86400       # how long a finished course is replayed
+
     # Redis
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
@@ -114,15 +186,26 @@ RETRY_CONFIG = {
     "max_attempts": 3,
     "initial_delay": 1,  # seconds
     "max_delay": 10,     # seconds
-    "exponential_base": 2
+    "exponential_base": 2,
+    "output_format_attempts": 2,  # attempts when the model output is invalid JSON
+    "request_budget": 4,          # retries shared by all stages of one request
+    "deadline_seconds": 600       # no retry is started past this point of a request
 }
 
 # Timeout Configuration
 TIMEOUT_CONFIG = {
     "pdf_extraction": 30,      # seconds
+    "file_processing": 180,    # seconds (Gemini File API upload + PROCESSING)
     "ai_generation": 120,      # seconds
     "total_request": 180       # seconds
 }
 
+# Gemini File API polling (adaptive backoff while a file is PROCESSING)
+FILE_POLL_CONFIG = {
+    "initial_interval": 0.5,   # seconds
+    "max_interval": 5,         # seconds
+    "multiplier": 1.5
+}
+
 # Instantiate settings
 settings = Settings()
@@ -11,6 +11,17 @@ from fastapi.exceptions import RequestValidationError
 from app.config import settings
 from app.routers import generate
 from app.models.schemas import HealthCheckResponse
+from app.services.gemini_service import gemini_service
+from app.services.file_registry import file_registry
+from app.services.final_challenge_jobs import final_challenge_jobs
+from app.services.task_queue import task_queue
+from app.services.result_store import result_store
+from app.services.webhooks import webhook_outbox
+from app.utils.pdf_extractor import pdf_extractor
+from app.utils.cache import cache_registry
+from app.utils.json_repair import repair_stats
+from app.utils.single_flight import flight_registry
+from app.utils.upload import UploadSizeLimitMiddleware
 
 # Configure logging
 logging.basicConfig(
@@ -27,8 +38,19 @@ async def lifespan(app: FastAPI):
     logger.info(f"   OpenAI: {'✅ Configured' if settings.OPENAI_API_KEY else '❌ Missing'}")
     logger.info(f"   Claude: {'✅ Configured' if settings.ANTHROPIC_API_KEY else '⚠️ Optional'}")
     logger.info(f"   Gemini: {'✅ Configured' if settings.GEMINI_API_KEY else '❌ Missing'}")
+    file_registry.start()
+    webhook_outbox.start()
+    task_queue.start()
     yield
     logger.info("🛑 EduAI AI Service shutting down...")
+    await task_queue.stop()
+    await final_challenge_jobs.stop()
+    await webhook_outbox.stop()
+    await file_registry.stop()
+    await gemini_service.context_cache.clear()
+    await gemini_service.drain_cleanup()
+    pdf_extractor.shutdown()
+    result_store.close()
 
 # Create FastAPI app
 app = FastAPI(
@@ -50,6 +72,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized uploads while they stream in
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # Request timing middleware
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
@@ -73,8 +98,12 @@ async def root():
         "docs": "Swagger UI temporarily disabled - use endpoints directly",
         "endpoints": {
             "health": "/health",
+            "cache_stats": "/cache/stats",
             "test": "/api/v1/test",
-            "generate": "/api/v1/generate/course (POST)"
+            "generate": "/api/v1/generate/course (POST)",
+            "generate_stream": "/api/v1/generate/course/stream (POST, text/event-stream)",
+            "generate_async": "/api/v1/generate/course/async (POST) -> /api/v1/generate/tasks/{task_id}",
+            "results": "/api/v1/generate/results/{result_id}"
         }
     }
 
@@ -98,6 +127,17 @@ async def health_check():
         timestamp=time.time()
     )
 
+# Cache statistics
+@app.get("/cache/stats")
+async def cache_stats():
+    """Counters for the in-process, Redis and Gemini context caches, result store, request coalescing and JSON repair"""
+    stats = {name: cache.stats() for name, cache in cache_registry.items()}
+    stats["gemini_context"] = gemini_service.context_cache.stats()
+    stats["result_store"] = result_store.stats()
+    stats["json_repair"] = repair_stats.stats()
+    stats["single_flight"] = {name: flight.stats() for name, flight in flight_registry.items()}
+    return stats
+
 # Validation exception handler
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -100,6 +100,37 @@ class GenerationMetadata(BaseModel):
     generation_time_ms: int = Field(default=0, ge=0)
     confidence_score: float = Field(default=0.0, ge=0.0, le=1.0)
     routing_reason: str = ""
+    stage_timings_ms: Dict[str, int] = Field(
+        default_factory=dict,
+        description="Wall-clock duration of each pipeline stage"
+    )
+    document_id: Optional[str] = Field(
+        default=None,
+        description="Content hash of the source PDF; pass it to /quiz and /final-challenge to reuse the processed file"
+    )
+    final_challenge_generated: Optional[bool] = None
+    final_challenge_status: Optional[str] = Field(
+        default=None,
+        description="completed | failed | pending (generated in background, see final_challenge_job_id)"
+    )
+    final_challenge_job_id: Optional[str] = Field(
+        default=None,
+        description="Poll GET /api/v1/generate/final-challenge/jobs/{id} while the challenge is pending"
+    )
+    retry_count: int = Field(default=0, ge=0, description="Model/upload calls repeated for this course")
+    continuations: int = Field(
+        default=0,
+        ge=0,
+        description="Follow-up calls made because the course output reached max_output_tokens"
+    )
+    repaired_modules: List[int] = Field(
+        default_factory=list,
+        description="Modules (1-based) that failed validation and were regenerated on their own"
+    )
+    retries: List[Dict[str, Any]] = Field(
+        default_factory=list,
+        description="One entry per failed attempt: stage, attempt, category (transient | output_format | permanent), error, outcome"
+    )
 
 
 class CourseGenerationResponse(BaseModel):
@@ -128,6 +159,7 @@ class ErrorResponse(BaseModel):
 class AsyncTaskResponse(BaseModel):
     """Response for async task creation"""
     task_id: str
+    task_type: str = "course"
     status: str
     status_url: str
     estimated_time_seconds: int = 60
@@ -136,9 +168,14 @@ class AsyncTaskResponse(BaseModel):
 class TaskStatusResponse(BaseModel):
     """Response for task status check"""
     task_id: str
+    task_type: str = "course"
     status: str
     progress: int = Field(ge=0, le=100, description="Progress percentage")
-    result: Optional[CourseGenerationResponse] = None
+    stage: Optional[str] = Field(default=None, description="Pipeline stage currently running")
+    result: Optional[Union[CourseGenerationResponse, Dict[str, Any]]] = Field(
+        default=None,
+        description="CourseGenerationResponse for course tasks, the /quiz or /final-challenge body otherwise"
+    )
     error: Optional[str] = None
     created_at: datetime
     updated_at: datetime
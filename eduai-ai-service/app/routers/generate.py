@@ -1,28 +1,62 @@
 """Course Generation API Endpoints"""
+import asyncio
 import logging
+import os
 import time
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+import uuid
+from fastapi import APIRouter, File, UploadFile, Form, Header, HTTPException, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Optional, Tuple
+from pydantic import BaseModel, Field
 
+from app.config import settings
 from app.models.schemas import (
+    AsyncTaskResponse,
     CourseGenerationRequest,
     CourseGenerationResponse,
-    ErrorResponse
+    ErrorResponse,
+    TaskStatusResponse
 )
-from app.services.ai_router import router as ai_router
+from app.services.course_pipeline import course_pipeline, StageTimer
+from app.services.file_registry import file_registry
+from app.services.final_challenge_jobs import final_challenge_jobs, FinalChallengeJob
 from app.services.gemini_service import gemini_service
-from app.utils.pdf_extractor import pdf_extractor
+from app.services.result_store import result_store, StoredResult
+from app.services.task_queue import task_queue, Task, TaskQueueFullError
+from app.services.webhooks import resolve_callback_url, InvalidCallbackURLError
+from app.utils.cache import content_hash
+from app.utils.pdf_extractor import pdf_extractor, ExtractionQueueFullError
+from app.utils.retry import retry_scope
+from app.utils.single_flight import SingleFlight, IdempotencyKeyReusedError
+from app.utils.sse import sse_event, SSE_HEADERS, SSE_KEEPALIVE
+from app.utils.upload import spool_upload, too_large_detail, UploadTooLargeError
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Identical concurrent requests share one generation
+course_flight = SingleFlight("course")
+final_challenge_flight = SingleFlight("final_challenge")
+
 
 class QuizRequest(BaseModel):
     content: str
     title: str
     difficulty: str = "intermediate"
+    document_id: Optional[str] = None  # metadata.document_id from /course
+    callback_url: Optional[str] = None  # /quiz/async only: webhook on completion
+
+
+class QuizBatchModule(BaseModel):
+    title: str
+    content: str
+
+
+class QuizBatchRequest(BaseModel):
+    modules: List[QuizBatchModule] = Field(..., min_length=1, max_length=50)
+    difficulty: str = "intermediate"
+    document_id: Optional[str] = None  # metadata.document_id from /course
 
 
 class FinalChallengeRequest(BaseModel):
@@ -30,6 +64,240 @@ class FinalChallengeRequest(BaseModel):
     course_title: str
     course_content: str
     course_modules: list
+    document_id: Optional[str] = None  # metadata.document_id from /course
+    callback_url: Optional[str] = None  # /final-challenge/async only: webhook on completion
+
+
+def _course_fingerprint(
+    document_id: str,
+    title: str,
+    difficulty: str,
+    target_audience: Optional[str],
+    premium_quality: bool,
+    provider: str,
+    generation_mode: Optional[str],
+    final_challenge_mode: Optional[str]
+) -> str:
+    """Identity of a course request: same PDF content and same options"""
+    return content_hash(
+        "course", document_id, title, difficulty, target_audience, premium_quality,
+        provider, generation_mode, final_challenge_mode
+    )
+
+
+def _no_cache(cache_control: Optional[str]) -> bool:
+    """True when the client asked for a fresh generation (Cache-Control: no-cache / no-store)"""
+    directives = (cache_control or "").lower()
+    return "no-cache" in directives or "no-store" in directives
+
+
+async def _stored_course(fingerprint: str, cache_control: Optional[str]) -> Optional[StoredResult]:
+    """Finished course for this fingerprint, unless the store is off or bypassed (Cache-Control: no-cache)"""
+    if not settings.RESULT_STORE_ENABLED or _no_cache(cache_control):
+        return None
+    stored = await result_store.get(fingerprint)
+    if stored is not None:
+        logger.info(f"♻️ Replaying stored course {stored.result_id} (fingerprint {fingerprint[:12]})")
+    return stored
+
+
+async def _store_course(
+    fingerprint: str,
+    course_response: CourseGenerationResponse,
+    result_id: Optional[str] = None
+) -> Optional[str]:
+    """
+    Persist a finished course for replay and return its result id.
+
+    A course whose final challenge is still generating in the background
+    is stored only once the job finishes, with the questions merged in:
+    the job itself is dropped long before the stored result expires.
+    """
+    if not settings.RESULT_STORE_ENABLED:
+        return None
+
+    # Chosen now so a deferred save lands under the id already handed to the client
+    result_id = result_id or uuid.uuid4().hex
+    payload = course_response.model_dump(mode="json")
+    metadata = payload["metadata"]
+    if metadata.get("final_challenge_status") != "pending":
+        stored = await result_store.save("course", fingerprint, payload, result_id)
+        return stored.result_id if stored else None
+
+    async def store_when_done(job: FinalChallengeJob) -> None:
+        payload["course_data"]["final_challenge_questions"] = job.final_challenge_questions
+        metadata["final_challenge_status"] = job.status
+        metadata["final_challenge_generated"] = job.status == "completed"
+        metadata["final_challenge_job_id"] = None
+        await result_store.save("course", fingerprint, payload, result_id)
+
+    final_challenge_jobs.when_done(metadata["final_challenge_job_id"], store_when_done)
+    return result_id
+
+
+def _stored_response(stored: StoredResult, status_code: int = 200) -> Response:
+    return Response(
+        content=stored.body if status_code == 200 else None,
+        status_code=status_code,
+        media_type="application/json",
+        headers={"ETag": stored.etag, "X-Result-Id": stored.result_id}
+    )
+
+
+async def _generate_course_response(
+    pdf_path: str,
+    is_pdf: bool,
+    title: str,
+    difficulty: str,
+    target_audience: Optional[str],
+    premium_quality: bool,
+    provider: str,
+    generation_mode: Optional[str],
+    final_challenge_mode: Optional[str],
+    timer: StageTimer,
+    start_time: float,
+    document_id: Optional[str] = None
+) -> CourseGenerationResponse:
+    """Course generation shared by /course and /course/async (the caller owns pdf_path)"""
+    # Steps 1-3: estimate, route, upload + extraction in parallel, generate
+    course_data, metadata = await course_pipeline.run(
+        pdf_path=pdf_path,
+        title=title,
+        difficulty=difficulty,
+        target_audience=target_audience or "Estudantes em geral",
+        is_pdf=is_pdf,
+        premium_quality=premium_quality,
+        provider=provider if provider != "auto" else None,
+        timer=timer,
+        generation_mode=generation_mode,
+        document_id=document_id
+    )
+
+    # Step 4: Generate Final Challenge Questions (30 questions)
+    if (final_challenge_mode or settings.FINAL_CHALLENGE_DELIVERY) == "background":
+        job = final_challenge_jobs.submit(course_data, metadata, title)
+        metadata['final_challenge_status'] = 'pending'
+        metadata['final_challenge_job_id'] = job.job_id
+    else:
+        await course_pipeline.add_final_challenge(course_data, metadata, title, timer)
+
+    # Calculate total time
+    total_time_ms = int((time.time() - start_time) * 1000)
+    metadata['generation_time_ms'] = total_time_ms
+    metadata['stage_timings_ms'] = timer.timings_ms
+
+    logger.info(f"⏱️ Stages: {timer.summary()}")
+
+    # Determine if requires review (low confidence, fallback used or repaired model output)
+    warnings = metadata.pop('repair_warnings', [])
+    requires_review = metadata['confidence_score'] < 0.7 or bool(warnings)
+
+    logger.info(
+        f"✅ Course generated successfully in {total_time_ms}ms "
+        f"(cost: ${metadata['cost_usd']:.6f}, confidence: {metadata['confidence_score']:.0%})"
+    )
+
+    return CourseGenerationResponse(
+        success=True,
+        course_data=course_data,
+        metadata=metadata,
+        requires_review=requires_review,
+        warnings=warnings
+    )
+
+
+async def _generate_quiz_response(request: QuizRequest, use_cache: bool = True) -> dict:
+    """Quiz generation shared by /quiz and /quiz/async"""
+    logger.info(f"📝 Quiz generation request: '{request.title}', difficulty: {request.difficulty}")
+
+    start_time = time.time()
+
+    try:
+        quiz_data = await gemini_service.generate_quiz(
+            module_content=request.content,
+            module_title=request.title,
+            difficulty=request.difficulty,
+            uploaded_file=file_registry.get(request.document_id),
+            use_cache=use_cache
+        )
+    except Exception as e:
+        file_registry.report_failure(request.document_id, e)
+        raise
+
+    total_time_ms = int((time.time() - start_time) * 1000)
+
+    logger.info(f"✅ Quiz generated successfully in {total_time_ms}ms")
+
+    return {
+        "success": True,
+        "questions": quiz_data.get("questions", []),
+        "generation_time_ms": total_time_ms
+    }
+
+
+async def _generate_final_challenge_response(request: FinalChallengeRequest) -> dict:
+    """Final Challenge generation shared by /final-challenge and /final-challenge/async"""
+    start_time = time.time()
+
+    logger.info(f"🎯 Final Challenge generation request: Course ID {request.course_id} - '{request.course_title}'")
+    logger.info(f"📚 Course has {len(request.course_modules)} modules")
+
+    # Generate the 30 questions using Gemini (tiers share one retry budget)
+    with retry_scope() as budget:
+        try:
+            questions_data = await gemini_service.generate_final_challenge_questions(
+                course_content=request.course_content,
+                course_title=request.course_title,
+                course_modules=request.course_modules,
+                uploaded_file=file_registry.get(request.document_id)
+            )
+        except Exception as e:
+            file_registry.report_failure(request.document_id, e)
+            raise
+    retry_info: dict = {}
+    budget.annotate(retry_info)
+
+    total_time_ms = int((time.time() - start_time) * 1000)
+
+    # Validate we got exactly 10 questions per level
+    easy_count = len(questions_data.get('easy_questions', []))
+    medium_count = len(questions_data.get('medium_questions', []))
+    hard_count = len(questions_data.get('hard_questions', []))
+
+    logger.info(
+        f"✅ Final Challenge generated successfully in {total_time_ms}ms - "
+        f"Easy: {easy_count}, Medium: {medium_count}, Hard: {hard_count}"
+    )
+
+    if easy_count != 10 or medium_count != 10 or hard_count != 10:
+        logger.warning(
+            f"⚠️ Question count mismatch! Expected 10/10/10, got {easy_count}/{medium_count}/{hard_count}"
+        )
+
+    return {
+        "success": True,
+        "easy_questions": questions_data.get('easy_questions', []),
+        "medium_questions": questions_data.get('medium_questions', []),
+        "hard_questions": questions_data.get('hard_questions', []),
+        "generation_time_ms": total_time_ms,
+        "metadata": {
+            "course_id": request.course_id,
+            "course_title": request.course_title,
+            "total_questions": easy_count + medium_count + hard_count,
+            "provider": "gemini",
+            "model": "gemini-2.5-flash",
+            **retry_info
+        }
+    }
+
+
+def _idempotency_detail(error: IdempotencyKeyReusedError) -> dict:
+    return {
+        "success": False,
+        "error": str(error),
+        "error_code": "IDEMPOTENCY_KEY_REUSED",
+        "retry_possible": False
+    }
 
 
 @router.post(
@@ -39,20 +307,39 @@ class FinalChallengeRequest(BaseModel):
     description="Upload a PDF and generate a complete course structure"
 )
 async def generate_course(
+    response: Response,
     file: UploadFile = File(..., description="PDF file to process"),
     title: str = Form(..., min_length=5, max_length=200),
     difficulty: str = Form(default="intermediate", pattern="^(beginner|intermediate|advanced)$"),
     target_audience: str = Form(default=None),
     premium_quality: bool = Form(default=False),
-    provider: str = Form(default="auto")
+    provider: str = Form(default="auto"),
+    generation_mode: Optional[str] = Form(default=None, pattern="^(single|parallel)$"),
+    final_challenge_mode: Optional[str] = Form(default=None, pattern="^(inline|background)$"),
+    idempotency_key: Optional[str] = Header(default=None, max_length=255),
+    cache_control: Optional[str] = Header(default=None)
 ):
     """
     Generate a complete course from uploaded PDF
 
     **Process:**
-    1. Extract content from PDF
-    2. Generate structured course with Gemini 2.5 Flash
-    3. Return course data + metadata
+    1. Estimate content size from page count (text extraction only when needed)
+    2. Upload to Gemini File API while extracting text locally in parallel
+    3. Generate structured course with Gemini 2.5 Flash
+       (`generation_mode=parallel`: outline first, then all modules concurrently)
+    4. Generate the final challenge, or (`final_challenge_mode=background`) return
+       right away with `metadata.final_challenge_status = "pending"` and a job id
+    5. Return course data + metadata (including per-stage timings)
+
+    Identical requests (same PDF content and options) arriving while one is
+    being generated share its result (`X-Coalesced: true`). With an
+    `Idempotency-Key` header, a retry within IDEMPOTENCY_TTL_SECONDS returns
+    the stored result instead of generating again.
+
+    Finished courses are also persisted (RESULT_STORE_*), so a retry after a
+    client timeout returns the stored course right away; send
+    `Cache-Control: no-cache` to generate a fresh one. Stored courses can be
+    fetched by id (the `X-Result-Id` response header) with GET /results/{result_id}.
 
     **Success Rate:** 90%+ with predictable costs
     """
@@ -61,149 +348,74 @@ async def generate_course(
     try:
         logger.info(f"📥 Received request: '{title}', difficulty: {difficulty}")
 
-        # Step 1: Extract PDF content
-        from io import BytesIO
-        import tempfile
-        import os
-
-        pdf_content = await file.read()
-        pdf_file_obj = BytesIO(pdf_content)
-        extracted_content = await pdf_extractor.extract(pdf_file_obj)
-
-        logger.info(f"📊 Extracted: {extracted_content.char_count} chars, quality: {extracted_content.quality_score:.0%}")
+        timer = StageTimer()
+        with timer.stage("upload_receive"):
+            pdf_path = await spool_upload(file)
 
-        # Step 2: Route to best provider
-        routing_decision = ai_router.route(
-            extracted_content=extracted_content,
-            premium_quality=premium_quality,
-            preferred_provider=provider if provider != "auto" else None,
-            content_type="pdf"
+        try:
+            document_id = await pdf_extractor.content_key(pdf_path)
+        except BaseException:
+            os.unlink(pdf_path)
+            raise
+
+        fingerprint = _course_fingerprint(
+            document_id, title, difficulty, target_audience, premium_quality,
+            provider, generation_mode, final_challenge_mode
         )
-
-        logger.info(f"🧠 Routing: {routing_decision.provider.upper()} - {routing_decision.reason}")
-
-        # Step 3: Generate course with Gemini
-        is_pdf = file.content_type == "application/pdf"
-
-        if is_pdf:
-            try:
-                logger.info("📄 Using Gemini File API for native PDF processing")
-
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-                    temp_file.write(pdf_content)
-                    temp_file_path = temp_file.name
-
-                try:
-                    course_data, metadata = await gemini_service.upload_and_generate_from_pdf(
-                        pdf_path=temp_file_path,
-                        title=title,
-                        difficulty=difficulty,
-                        target_audience=target_audience or "Estudantes em geral"
-                    )
-                finally:
-                    if os.path.exists(temp_file_path):
-                        os.unlink(temp_file_path)
-
-            except Exception as e:
-                logger.warning(f"⚠️ File API failed, using text extraction fallback: {e}")
-                course_data, metadata = await gemini_service.generate_course(
-                    extracted=extracted_content,
-                    title=title,
-                    difficulty=difficulty,
-                    target_audience=target_audience or "Estudantes em geral"
-                )
-        else:
-            logger.info("✨ Using Gemini 2.5 Flash with text extraction")
-            course_data, metadata = await gemini_service.generate_course(
-                extracted=extracted_content,
+        stored = await _stored_course(fingerprint, cache_control)
+        if stored is not None:
+            os.unlink(pdf_path)
+            return _stored_response(stored)
+
+        async def generate() -> Tuple[CourseGenerationResponse, Optional[str]]:
+            course_response = await _generate_course_response(
+                pdf_path=pdf_path,
+                is_pdf=file.content_type == "application/pdf",
                 title=title,
                 difficulty=difficulty,
-                target_audience=target_audience or "Estudantes em geral"
+                target_audience=target_audience,
+                premium_quality=premium_quality,
+                provider=provider,
+                generation_mode=generation_mode,
+                final_challenge_mode=final_challenge_mode,
+                timer=timer,
+                start_time=start_time,
+                document_id=document_id
             )
-
-        # Step 4: Generate Final Challenge Questions (30 questions)
-        logger.info("🎯 Generating Final Challenge questions (30 questions)...")
-        final_challenge_start = time.time()
-
-        try:
-            # Prepare course content for final challenge generation
-            course_content_text = f"{course_data.get('title', '')}\n\n"
-            course_content_text += f"{course_data.get('description', '')}\n\n"
-
-            # Extract lessons content from modules
-            for module in course_data.get('modules', []):
-                course_content_text += f"## {module.get('title', '')}\n"
-                for activity in module.get('activities', []):
-                    if activity.get('type') == 'lesson':
-                        course_content_text += f"{activity.get('title', '')}\n"
-                        # Strip HTML for cleaner content
-                        import re
-                        clean_content = re.sub('<[^<]+?>', '', activity.get('content', ''))
-                        course_content_text += f"{clean_content[:500]}...\n\n"
-
-            # Generate the 30 questions
-            challenge_questions = await gemini_service.generate_final_challenge_questions(
-                course_content=course_content_text,
-                course_title=course_data.get('title', title),
-                course_modules=course_data.get('modules', [])
-            )
-
-            # DEBUG: Ver o que realmente foi retornado
-            logger.info(f'🔍 DEBUG: challenge_questions type = {type(challenge_questions)}')
-            logger.info(f'🔍 DEBUG: challenge_questions keys = {list(challenge_questions.keys()) if isinstance(challenge_questions, dict) else "N/A"}')
-            logger.info(f'🔍 DEBUG: easy_questions = {len(challenge_questions.get("easy_questions", []))} items')
-            logger.info(f'🔍 DEBUG: Primeiro item easy_questions = {challenge_questions.get("easy_questions", [])[0] if challenge_questions.get("easy_questions") else "VAZIO"}')
-
-            final_challenge_time_ms = int((time.time() - final_challenge_start) * 1000)
-
-            # Validate question counts
-            easy_count = len(challenge_questions.get('easy_questions', []))
-            medium_count = len(challenge_questions.get('medium_questions', []))
-            hard_count = len(challenge_questions.get('hard_questions', []))
-
-            logger.info(
-                f"✅ Final Challenge generated in {final_challenge_time_ms}ms - "
-                f"Easy: {easy_count}, Medium: {medium_count}, Hard: {hard_count}"
-            )
-
-            # Add final challenge questions to course_data
-            course_data['final_challenge_questions'] = {
-                'easy': challenge_questions.get('easy_questions', []),
-                'medium': challenge_questions.get('medium_questions', []),
-                'hard': challenge_questions.get('hard_questions', [])
+            result_id = await _store_course(fingerprint, course_response, idempotency_key)
+            return course_response, result_id
+
+        (course_response, result_id), shared = await course_flight.run(
+            fingerprint,
+            generate,
+            idempotency_key=idempotency_key,
+            cleanup=lambda: os.unlink(pdf_path)
+        )
+        if shared:
+            response.headers["X-Coalesced"] = "true"
+        if result_id:
+            response.headers["X-Result-Id"] = result_id
+        return course_response
+
+    except UploadTooLargeError as e:
+        logger.warning(f"⚠️ Upload rejected: {e}")
+        raise HTTPException(status_code=413, detail=too_large_detail())
+
+    except ExtractionQueueFullError as e:
+        logger.warning(f"⚠️ Extraction busy: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "success": False,
+                "error": str(e),
+                "error_code": "EXTRACTION_BUSY",
+                "retry_possible": True
             }
-
-            # Update metadata with final challenge info
-            metadata['final_challenge_generated'] = True
-            metadata['final_challenge_time_ms'] = final_challenge_time_ms
-            metadata['total_questions'] = easy_count + medium_count + hard_count
-
-        except Exception as e:
-            logger.error(f"⚠️ Final Challenge generation failed (non-critical): {str(e)}")
-            # Don't fail the entire course generation if final challenge fails
-            course_data['final_challenge_questions'] = None
-            metadata['final_challenge_generated'] = False
-            metadata['final_challenge_error'] = str(e)
-
-        # Calculate total time
-        total_time_ms = int((time.time() - start_time) * 1000)
-        metadata['generation_time_ms'] = total_time_ms
-
-        # Determine if requires review (low confidence or fallback used)
-        requires_review = metadata['confidence_score'] < 0.7
-
-        logger.info(
-            f"✅ Course generated successfully in {total_time_ms}ms "
-            f"(cost: ${metadata['cost_usd']:.6f}, confidence: {metadata['confidence_score']:.0%})"
         )
 
-        return CourseGenerationResponse(
-            success=True,
-            course_data=course_data,
-            metadata=metadata,
-            requires_review=requires_review,
-            warnings=[]
-        )
+    except IdempotencyKeyReusedError as e:
+        logger.warning(f"⚠️ {e}")
+        raise HTTPException(status_code=422, detail=_idempotency_detail(e))
 
     except ValueError as e:
         logger.error(f"❌ Validation error: {e}")
@@ -231,42 +443,196 @@ async def generate_course(
         )
 
 
-@router.post("/quiz", response_model=dict)
-async def generate_quiz(request: QuizRequest):
-    logger.info(f"📥 Quiz request - content: {len(request.content) if request.content else 'None'}, title: {request.title}, difficulty: {request.difficulty}")
+@router.post(
+    "/course/stream",
+    summary="Generate course from PDF (streaming)",
+    description="Same as /course, but streams each module as Server-Sent Events as soon as it is generated"
+)
+async def generate_course_stream(
+    file: UploadFile = File(..., description="PDF file to process"),
+    title: str = Form(..., min_length=5, max_length=200),
+    difficulty: str = Form(default="intermediate", pattern="^(beginner|intermediate|advanced)$"),
+    target_audience: str = Form(default=None),
+    premium_quality: bool = Form(default=False),
+    provider: str = Form(default="auto")
+):
+    """
+    Stream a course generation as Server-Sent Events
+
+    **Events:**
+    - `module`: `{"index": n, "module": {...}}` as soon as each module is complete
+    - `status`: `{"stage": "final_challenge"}` while the final challenge is generated
+    - `complete`: the same body /course returns
+    - `error`: `{"success": false, "error": ..., "error_code": ...}`
+    """
+    start_time = time.time()
+    logger.info(f"📥 Received streaming request: '{title}', difficulty: {difficulty}")
+
+    timer = StageTimer()
     try:
-        logger.info(f"📝 Quiz generation request: '{request.title}', difficulty: {request.difficulty}")
+        with timer.stage("upload_receive"):
+            pdf_path = await spool_upload(file)
+    except UploadTooLargeError as e:
+        logger.warning(f"⚠️ Upload rejected: {e}")
+        raise HTTPException(status_code=413, detail=too_large_detail())
 
-        start_time = time.time()
+    async def events():
+        try:
+            module_count = 0
+            async for event, data in course_pipeline.stream(
+                pdf_path=pdf_path,
+                title=title,
+                difficulty=difficulty,
+                target_audience=target_audience or "Estudantes em geral",
+                is_pdf=file.content_type == "application/pdf",
+                premium_quality=premium_quality,
+                provider=provider if provider != "auto" else None,
+                timer=timer
+            ):
+                if event == "module":
+                    if module_count == 0:
+                        timer.timings_ms["first_module"] = int((time.time() - start_time) * 1000)
+                    yield sse_event("module", {"index": module_count, "module": data})
+                    module_count += 1
+                else:
+                    course_data, metadata = data
+
+            yield sse_event("status", {"stage": "final_challenge"})
+            await course_pipeline.add_final_challenge(course_data, metadata, title, timer)
+
+            metadata['generation_time_ms'] = int((time.time() - start_time) * 1000)
+            metadata['stage_timings_ms'] = timer.timings_ms
+            logger.info(f"⏱️ Stages: {timer.summary()}")
+
+            warnings = metadata.pop('repair_warnings', [])
+            response = CourseGenerationResponse(
+                success=True,
+                course_data=course_data,
+                metadata=metadata,
+                requires_review=metadata['confidence_score'] < 0.7 or bool(warnings),
+                warnings=warnings
+            )
+            logger.info(f"✅ Streamed course generated in {metadata['generation_time_ms']}ms ({module_count} modules)")
+            yield sse_event("complete", response.model_dump())
 
-        quiz_data = await gemini_service.generate_quiz(
-            module_content=request.content,
-            module_title=request.title,
-            difficulty=request.difficulty
-        )
+        except ExtractionQueueFullError as e:
+            logger.warning(f"⚠️ Extraction busy: {e}")
+            yield sse_event("error", {
+                "success": False,
+                "error": str(e),
+                "error_code": "EXTRACTION_BUSY",
+                "retry_possible": True
+            })
 
-        total_time_ms = int((time.time() - start_time) * 1000)
+        except ValueError as e:
+            logger.error(f"❌ Validation error: {e}")
+            yield sse_event("error", {
+                "success": False,
+                "error": str(e),
+                "error_code": "VALIDATION_ERROR",
+                "retry_possible": False
+            })
 
-        logger.info(f"✅ Quiz generated successfully in {total_time_ms}ms")
+        except Exception as e:
+            logger.error(f"❌ Streaming generation failed: {e}", exc_info=True)
+            yield sse_event("error", {
+                "success": False,
+                "error": "Course generation failed",
+                "error_code": "GENERATION_ERROR",
+                "details": str(e),
+                "retry_possible": True
+            })
 
-        return {
-            "success": True,
-            "questions": quiz_data.get("questions", []),
-            "generation_time_ms": total_time_ms
-        }
+        finally:
+            os.unlink(pdf_path)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.post("/quiz", response_model=dict)
+async def generate_quiz(request: QuizRequest, cache_control: Optional[str] = Header(default=None)):
+    """Quizzes are cached by module content, title and difficulty; `Cache-Control: no-cache` regenerates"""
+    logger.info(f"📥 Quiz request - content: {len(request.content) if request.content else 'None'}, title: {request.title}, difficulty: {request.difficulty}")
+    try:
+        return await _generate_quiz_response(request, use_cache=not _no_cache(cache_control))
 
     except Exception as e:
         logger.error(f"❌ Quiz generation failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/quiz/batch", response_model=dict)
+async def generate_quiz_batch(request: QuizBatchRequest, cache_control: Optional[str] = Header(default=None)):
+    """
+    Generate quizzes for many modules in one request
+
+    Several modules are packed into each model call (QUIZ_BATCH_*) and the
+    calls run concurrently. `results` has one entry per module, in request
+    order; a module that failed has `success: false` and an `error` while
+    the others still return their questions.
+    """
+    logger.info(f"📥 Quiz batch request: {len(request.modules)} modules, difficulty: {request.difficulty}")
+    start_time = time.time()
+
+    try:
+        quizzes, model_calls = await gemini_service.generate_quiz_batch(
+            modules=[module.model_dump() for module in request.modules],
+            difficulty=request.difficulty,
+            uploaded_file=file_registry.get(request.document_id),
+            use_cache=not _no_cache(cache_control)
+        )
+    except Exception as e:
+        logger.error(f"❌ Quiz batch generation failed: {e}", exc_info=True)
+        file_registry.report_failure(request.document_id, e)
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "error": "Quiz batch generation failed",
+                "error_code": "QUIZ_BATCH_ERROR",
+                "details": str(e),
+                "retry_possible": True
+            }
+        )
+
+    results = [
+        {
+            "index": index,
+            "title": module.title,
+            "success": "error" not in quiz,
+            "questions": quiz.get("questions", []),
+            "error": quiz.get("error")
+        }
+        for index, (module, quiz) in enumerate(zip(request.modules, quizzes))
+    ]
+    failed = sum(1 for result in results if not result["success"])
+    total_time_ms = int((time.time() - start_time) * 1000)
+
+    logger.info(
+        f"✅ Quiz batch done in {total_time_ms}ms: {len(results) - failed}/{len(results)} modules, "
+        f"{model_calls} model calls"
+    )
+
+    return {
+        "success": failed == 0,
+        "results": results,
+        "failed_modules": failed,
+        "model_calls": model_calls,
+        "generation_time_ms": total_time_ms
+    }
+
+
 @router.post(
     "/final-challenge",
     response_model=dict,
     summary="Generate Final Challenge Questions",
     description="Generate 30 questions for Final Challenge distributed across 3 difficulty levels"
 )
-async def generate_final_challenge(request: FinalChallengeRequest):
+async def generate_final_challenge(
+    request: FinalChallengeRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(default=None, max_length=255)
+):
     """
     Generate 30 Final Challenge questions based on entire course content
 
@@ -280,51 +646,24 @@ async def generate_final_challenge(request: FinalChallengeRequest):
     - medium_questions: List of 10 medium questions
     - hard_questions: List of 10 hard questions
     - generation_time_ms: Time taken to generate
-    """
-    start_time = time.time()
 
+    Identical concurrent requests share one generation; `Idempotency-Key`
+    works as on /course.
+    """
     try:
-        logger.info(f"🎯 Final Challenge generation request: Course ID {request.course_id} - '{request.course_title}'")
-        logger.info(f"📚 Course has {len(request.course_modules)} modules")
-
-        # Generate the 30 questions using Gemini
-        questions_data = await gemini_service.generate_final_challenge_questions(
-            course_content=request.course_content,
-            course_title=request.course_title,
-            course_modules=request.course_modules
+        fingerprint = content_hash("final_challenge", request.model_dump_json(exclude={"callback_url"}))
+        result, shared = await final_challenge_flight.run(
+            fingerprint,
+            lambda: _generate_final_challenge_response(request),
+            idempotency_key=idempotency_key
         )
+        if shared:
+            response.headers["X-Coalesced"] = "true"
+        return result
 
-        total_time_ms = int((time.time() - start_time) * 1000)
-
-        # Validate we got exactly 10 questions per level
-        easy_count = len(questions_data.get('easy_questions', []))
-        medium_count = len(questions_data.get('medium_questions', []))
-        hard_count = len(questions_data.get('hard_questions', []))
-
-        logger.info(
-            f"✅ Final Challenge generated successfully in {total_time_ms}ms - "
-            f"Easy: {easy_count}, Medium: {medium_count}, Hard: {hard_count}"
-        )
-
-        if easy_count != 10 or medium_count != 10 or hard_count != 10:
-            logger.warning(
-                f"⚠️ Question count mismatch! Expected 10/10/10, got {easy_count}/{medium_count}/{hard_count}"
-            )
-
-        return {
-            "success": True,
-            "easy_questions": questions_data.get('easy_questions', []),
-            "medium_questions": questions_data.get('medium_questions', []),
-            "hard_questions": questions_data.get('hard_questions', []),
-            "generation_time_ms": total_time_ms,
-            "metadata": {
-                "course_id": request.course_id,
-                "course_title": request.course_title,
-                "total_questions": easy_count + medium_count + hard_count,
-                "provider": "gemini",
-                "model": "gemini-2.5-flash"
-            }
-        }
+    except IdempotencyKeyReusedError as e:
+        logger.warning(f"⚠️ {e}")
+        raise HTTPException(status_code=422, detail=_idempotency_detail(e))
 
     except Exception as e:
         logger.error(f"❌ Final Challenge generation failed: {str(e)}", exc_info=True)
@@ -340,6 +679,290 @@ async def generate_final_challenge(request: FinalChallengeRequest):
         )
 
 
+@router.get(
+    "/final-challenge/jobs/{job_id}",
+    response_model=dict,
+    summary="Final Challenge job status",
+    description="Status and questions of a Final Challenge generated in background by /course"
+)
+async def get_final_challenge_job(job_id: str):
+    job = final_challenge_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "success": False,
+                "error": f"Final Challenge job {job_id} not found or expired",
+                "error_code": "JOB_NOT_FOUND",
+                "retry_possible": False
+            }
+        )
+
+    return {"success": job.status != "failed", **job.to_dict()}
+
+
+def _callback_url(callback_url: Optional[str]) -> Optional[str]:
+    try:
+        return resolve_callback_url(callback_url)
+    except InvalidCallbackURLError as e:
+        logger.warning(f"⚠️ Rejected callback URL: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "success": False,
+                "error": str(e),
+                "error_code": "INVALID_CALLBACK_URL",
+                "retry_possible": False
+            }
+        )
+
+
+def _enqueue(
+    task_type: str,
+    handler,
+    estimated_time_seconds: int,
+    cleanup=None,
+    callback_url: Optional[str] = None
+) -> AsyncTaskResponse:
+    try:
+        task = task_queue.submit(task_type, handler, cleanup, callback_url)
+    except TaskQueueFullError as e:
+        if cleanup:
+            cleanup()
+        logger.warning(f"⚠️ Task queue full: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "success": False,
+                "error": str(e),
+                "error_code": "TASK_QUEUE_FULL",
+                "retry_possible": True
+            }
+        )
+
+    return AsyncTaskResponse(
+        task_id=task.task_id,
+        task_type=task_type,
+        status=task.status,
+        status_url=f"/api/v1/generate/tasks/{task.task_id}",
+        estimated_time_seconds=estimated_time_seconds
+    )
+
+
+@router.post(
+    "/course/async",
+    response_model=AsyncTaskResponse,
+    status_code=202,
+    summary="Enqueue course generation",
+    description="Same input as /course; returns a task_id at once. Poll /tasks/{task_id} for progress and result"
+)
+async def generate_course_async(
+    file: UploadFile = File(..., description="PDF file to process"),
+    title: str = Form(..., min_length=5, max_length=200),
+    difficulty: str = Form(default="intermediate", pattern="^(beginner|intermediate|advanced)$"),
+    target_audience: str = Form(default=None),
+    premium_quality: bool = Form(default=False),
+    provider: str = Form(default="auto"),
+    generation_mode: Optional[str] = Form(default=None, pattern="^(single|parallel)$"),
+    final_challenge_mode: Optional[str] = Form(default=None, pattern="^(inline|background)$"),
+    callback_url: Optional[str] = Form(default=None),
+    cache_control: Optional[str] = Header(default=None)
+):
+    """
+    Enqueue a course generation
+
+    With `callback_url` (a path on LARAVEL_API_URL or an allowed absolute URL;
+    defaults to WEBHOOK_DEFAULT_PATH) the finished task is POSTed there,
+    signed with LARAVEL_API_SECRET, so the caller does not need to poll.
+
+    A course already in the result store completes the task immediately;
+    the finished course stays available at GET /results/{task_id}.
+    """
+    logger.info(f"📥 Received async request: '{title}', difficulty: {difficulty}")
+    callback_url = _callback_url(callback_url)
+
+    # The upload is spooled now; the task owns the temp file from here on
+    timer = StageTimer()
+    try:
+        with timer.stage("upload_receive"):
+            pdf_path = await spool_upload(file)
+    except UploadTooLargeError as e:
+        logger.warning(f"⚠️ Upload rejected: {e}")
+        raise HTTPException(status_code=413, detail=too_large_detail())
+
+    is_pdf = file.content_type == "application/pdf"
+
+    async def handler(task: Task) -> CourseGenerationResponse:
+        timer.on_stage = task.on_stage
+        timer.on_estimate = task.set_estimate
+        document_id = await pdf_extractor.content_key(pdf_path)
+        fingerprint = _course_fingerprint(
+            document_id, title, difficulty, target_audience, premium_quality,
+            provider, generation_mode, final_challenge_mode
+        )
+
+        stored = await _stored_course(fingerprint, cache_control)
+        if stored is not None:
+            return CourseGenerationResponse.model_validate_json(stored.body)
+
+        course_response = await _generate_course_response(
+            pdf_path=pdf_path,
+            is_pdf=is_pdf,
+            title=title,
+            difficulty=difficulty,
+            target_audience=target_audience,
+            premium_quality=premium_quality,
+            provider=provider,
+            generation_mode=generation_mode,
+            final_challenge_mode=final_challenge_mode,
+            timer=timer,
+            start_time=time.time(),
+            document_id=document_id
+        )
+
+        await _store_course(fingerprint, course_response, task.task_id)
+        return course_response
+
+    return _enqueue(
+        "course", handler, 90, cleanup=lambda: os.unlink(pdf_path), callback_url=callback_url
+    )
+
+
+@router.post("/quiz/async", response_model=AsyncTaskResponse, status_code=202)
+async def generate_quiz_async(request: QuizRequest, cache_control: Optional[str] = Header(default=None)):
+    callback_url = _callback_url(request.callback_url)
+    use_cache = not _no_cache(cache_control)
+
+    async def handler(task: Task) -> dict:
+        task.set_progress(10, "generation")
+        return await _generate_quiz_response(request, use_cache)
+
+    return _enqueue("quiz", handler, 15, callback_url=callback_url)
+
+
+@router.post("/final-challenge/async", response_model=AsyncTaskResponse, status_code=202)
+async def generate_final_challenge_async(request: FinalChallengeRequest):
+    callback_url = _callback_url(request.callback_url)
+
+    async def handler(task: Task) -> dict:
+        task.set_progress(10, "generation")
+        return await _generate_final_challenge_response(request)
+
+    return _enqueue("final_challenge", handler, 45, callback_url=callback_url)
+
+
+@router.get(
+    "/tasks/{task_id}",
+    response_model=TaskStatusResponse,
+    summary="Task status",
+    description="Status, progress and (when completed) result of a task created by a /async endpoint"
+)
+async def get_task_status(task_id: str):
+    task = task_queue.get(task_id)
+    if task is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "success": False,
+                "error": f"Task {task_id} not found or expired",
+                "error_code": "TASK_NOT_FOUND",
+                "retry_possible": False
+            }
+        )
+
+    return TaskStatusResponse(
+        task_id=task.task_id,
+        task_type=task.task_type,
+        status=task.status,
+        progress=task.progress,
+        stage=task.stage,
+        result=task.result,
+        error=task.error,
+        created_at=task.created_at,
+        updated_at=task.updated_at
+    )
+
+
+@router.get(
+    "/results/{result_id}",
+    response_model=CourseGenerationResponse,
+    summary="Stored course result",
+    description="A finished course by task id, Idempotency-Key or request fingerprint (supports If-None-Match)"
+)
+async def get_stored_result(result_id: str, if_none_match: Optional[str] = Header(default=None)):
+    stored = await result_store.get(result_id) if settings.RESULT_STORE_ENABLED else None
+    if stored is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "success": False,
+                "error": f"Result {result_id} not found or expired",
+                "error_code": "RESULT_NOT_FOUND",
+                "retry_possible": False
+            }
+        )
+
+    if if_none_match and (
+        if_none_match.strip() == "*"
+        or stored.etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    ):
+        return _stored_response(stored, status_code=304)
+    return _stored_response(stored)
+
+
+@router.get(
+    "/tasks/{task_id}/events",
+    summary="Task progress stream",
+    description="Server-Sent Events with stage transitions, progress and ETA of a task, ending with completed/failed"
+)
+async def stream_task_events(task_id: str):
+    """
+    Stream task progress as Server-Sent Events
+
+    **Events** (each with task_id, status, stage, progress, timestamp, elapsed_ms, eta_seconds):
+    - `status`: the task started processing
+    - `estimate`: the router's time estimate is known (drives `eta_seconds`)
+    - `stage`: a pipeline stage started (estimate, routing, upload, processing, generation, final_challenge...)
+    - `completed` (with `result`) / `failed` (with `error`): last event, the stream then closes
+
+    Events already emitted are replayed first, so late subscribers miss nothing.
+    """
+    task = task_queue.get(task_id)
+    if task is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "success": False,
+                "error": f"Task {task_id} not found or expired",
+                "error_code": "TASK_NOT_FOUND",
+                "retry_possible": False
+            }
+        )
+
+    async def events():
+        history, queue = task.subscribe()
+        try:
+            for event in history:
+                yield sse_event(event["event"], event)
+                if event["event"] in ("completed", "failed"):
+                    return
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=settings.SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield SSE_KEEPALIVE
+                    continue
+
+                yield sse_event(event["event"], event)
+                if event["event"] in ("completed", "failed"):
+                    return
+        finally:
+            task.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 @router.get("/test", summary="Test endpoint")
 async def test_endpoint():
     """Simple test endpoint"""
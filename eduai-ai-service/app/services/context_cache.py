@@ -0,0 +1,119 @@
+"""Gemini context caching for large document prefixes"""
+import asyncio
+import datetime
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from google.generativeai import caching
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ContextCache:
+    """
+    Registers a large document (uploaded PDF or extracted text) once as a
+    Gemini cached-content prefix, so course, quiz and final-challenge calls
+    for the same document only send their own instructions.
+
+    When a cache cannot be created (content below the provider minimum,
+    unsupported model, API error) the key is remembered as uncacheable for
+    the TTL and callers fall back to sending the document as the first,
+    byte-identical part of every request, which still lets the provider's
+    implicit prefix caching kick in.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        ttl_seconds: int = settings.CONTEXT_CACHE_TTL_SECONDS,
+        min_tokens: int = settings.CONTEXT_CACHE_MIN_TOKENS
+    ):
+        self.model_name = model_name
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        # key -> (cached content or None when uncacheable, expires_at)
+        self._entries: Dict[str, Tuple[Optional[Any], float]] = {}
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.created = 0
+        self.fallbacks = 0
+
+    def _is_large_enough(self, document: Any) -> bool:
+        # Uploaded files have no local size; let the API decide
+        return not isinstance(document, str) or len(document) // 4 >= self.min_tokens
+
+    async def get(self, key: str, document: Any):
+        """Return the cached content for `key`, creating it from `document` if needed"""
+        if not settings.CONTEXT_CACHE_ENABLED or not self._is_large_enough(document):
+            self.fallbacks += 1
+            return None
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] <= time.time():
+                del self._entries[key]
+            else:
+                if entry[0] is None:
+                    self.fallbacks += 1
+                else:
+                    self.hits += 1
+                return entry[0]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._create(key, document))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        return await asyncio.shield(task)
+
+    def _prune(self) -> None:
+        """Drop expired entries (the provider deletes the caches themselves at their TTL)"""
+        now = time.time()
+        for key in [key for key, (_, expires_at) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+
+    async def _create(self, key: str, document: Any):
+        # Expire our reference slightly before the provider does
+        expires_at = time.time() + self.ttl_seconds - 30
+        self._prune()
+
+        try:
+            cached = await asyncio.to_thread(
+                caching.CachedContent.create,
+                model=f"models/{self.model_name}",
+                display_name=f"eduai-{key[:40]}",
+                contents=[document],
+                ttl=datetime.timedelta(seconds=self.ttl_seconds)
+            )
+        except Exception as e:
+            logger.info(f"ℹ️ Context cache unavailable for {key[:12]}, sending prefix inline: {e}")
+            self._entries[key] = (None, expires_at)
+            self.fallbacks += 1
+            return None
+
+        self._entries[key] = (cached, expires_at)
+        self.created += 1
+        logger.info(f"🗂️ Context cache created for {key[:12]}: {cached.name}")
+        return cached
+
+    async def clear(self) -> None:
+        """Delete every live cache (called on application shutdown)"""
+        entries, self._entries = self._entries, {}
+        for cached, expires_at in entries.values():
+            if cached is not None and expires_at > time.time():
+                try:
+                    await asyncio.to_thread(cached.delete)
+                except Exception as e:
+                    logger.warning(f"⚠️ Failed to delete context cache {cached.name}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "created": self.created,
+            "inline_fallbacks": self.fallbacks,
+            "entries": sum(1 for cached, _ in self._entries.values() if cached is not None)
+        }
@@ -0,0 +1,405 @@
+"""Pipelined course generation: File API upload overlapped with local extraction"""
+import asyncio
+import logging
+import re
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from app.config import settings
+from app.models.schemas import ExtractedContent
+from app.services.ai_router import router as ai_router
+from app.services.file_registry import file_registry
+from app.services.gemini_service import gemini_service
+from app.utils.pdf_extractor import pdf_extractor
+from app.utils.retry import retry_scope
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """
+    Record the wall-clock duration of named pipeline stages.
+
+    `on_stage` (optional) is called with the stage name when a stage
+    starts, and `on_estimate` with the routing estimate (seconds), e.g. to
+    report job progress.
+    """
+
+    def __init__(
+        self,
+        on_stage: Optional[Callable[[str], None]] = None,
+        on_estimate: Optional[Callable[[int], None]] = None
+    ):
+        self.timings_ms: Dict[str, int] = {}
+        self.on_stage = on_stage
+        self.on_estimate = on_estimate
+
+    def mark(self, name: str) -> None:
+        """Report that a stage started, without timing it"""
+        if self.on_stage is not None:
+            self.on_stage(name)
+
+    def estimate(self, seconds: int) -> None:
+        if self.on_estimate is not None:
+            self.on_estimate(seconds)
+
+    def _record(self, name: str, start: float) -> None:
+        self.timings_ms[name] = int((time.perf_counter() - start) * 1000)
+
+    @contextmanager
+    def stage(self, name: str):
+        self.mark(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, start)
+
+    async def timed(self, name: str, awaitable):
+        with self.stage(name):
+            return await awaitable
+
+    def track(self, name: str, task: asyncio.Task) -> asyncio.Task:
+        """Record a background task's duration when it finishes"""
+        self.mark(name)
+        start = time.perf_counter()
+        task.add_done_callback(lambda _: self._record(name, start))
+        return task
+
+    def summary(self) -> str:
+        return " | ".join(f"{name}={ms}ms" for name, ms in self.timings_ms.items())
+
+
+class CoursePipeline:
+    """
+    Runs the /course generation stages.
+
+    For PDFs the Gemini File API upload (upload + server-side PROCESSING)
+    starts immediately, while local text extraction runs concurrently on
+    an idle worker. Generation starts as soon as the upload is ready; the
+    extracted text is only awaited if the File API path fails; otherwise
+    it finishes in the background and lands in the extraction cache.
+
+    All stages read the same spooled upload by path.
+
+    In "parallel" generation mode the course is generated as an outline
+    followed by concurrent per-module calls instead of one long call.
+
+    All stages of a run share one retry budget; retries are reported in
+    metadata["retries"].
+    """
+
+    async def run(
+        self,
+        pdf_path: str,
+        title: str,
+        difficulty: str,
+        target_audience: str,
+        is_pdf: bool = True,
+        premium_quality: bool = False,
+        provider: Optional[str] = None,
+        timer: Optional[StageTimer] = None,
+        generation_mode: Optional[str] = None,
+        document_id: Optional[str] = None
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        timer = timer or StageTimer()
+        parallel = (generation_mode or settings.COURSE_GENERATION_MODE) == "parallel"
+
+        with retry_scope() as budget:
+            course_data, metadata = await self._run(
+                pdf_path, title, difficulty, target_audience, is_pdf,
+                premium_quality, provider, timer, parallel, document_id
+            )
+        budget.annotate(metadata)
+        return course_data, metadata
+
+    async def _run(
+        self,
+        pdf_path: str,
+        title: str,
+        difficulty: str,
+        target_audience: str,
+        is_pdf: bool,
+        premium_quality: bool,
+        provider: Optional[str],
+        timer: StageTimer,
+        parallel: bool,
+        document_id: Optional[str]
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+
+        # Stages 1-2: cheap size estimate, then route to best provider
+        await self._route(pdf_path, premium_quality, provider, timer)
+
+        if not is_pdf:
+            extracted_content = await timer.timed("extraction", pdf_extractor.extract(pdf_path))
+            logger.info("✨ Using Gemini 2.5 Flash with text extraction")
+            return await self._generate_from_text(
+                extracted_content, title, difficulty, target_audience, timer, parallel
+            )
+
+        # Stage 3: upload (or reuse a processed file) and local extraction in parallel
+        logger.info("📄 Using Gemini File API for native PDF processing")
+        document_id = document_id or await pdf_extractor.content_key(pdf_path)
+        upload_task = asyncio.create_task(
+            timer.timed(
+                "upload",
+                file_registry.get_or_upload(
+                    pdf_path, document_id, on_processing=lambda: timer.mark("processing")
+                )
+            )
+        )
+
+        extraction_task = pdf_extractor.start_speculative(pdf_path)
+        if extraction_task:
+            timer.track("extraction", extraction_task)
+
+        try:
+            try:
+                uploaded_file = await upload_task
+            except Exception as e:
+                logger.warning(f"⚠️ File API upload failed, using text extraction fallback: {e}")
+                return await self._fallback(
+                    extraction_task, pdf_path, title, difficulty, target_audience, timer, parallel
+                )
+
+            # Stage 4: generation from the processed file
+            # The file stays registered for the final challenge and later /quiz calls
+            if parallel:
+                generation = gemini_service.generate_course_parallel(
+                    title, difficulty, target_audience, uploaded_file=uploaded_file
+                )
+            else:
+                generation = gemini_service.generate_from_uploaded_file(
+                    uploaded_file, title, difficulty, target_audience
+                )
+
+            try:
+                course_data, metadata = await timer.timed("generation", generation)
+                metadata["document_id"] = document_id
+                return course_data, metadata
+            except Exception as e:
+                logger.warning(f"⚠️ File API failed, using text extraction fallback: {e}")
+                file_registry.report_failure(document_id, e)
+                return await self._fallback(
+                    extraction_task, pdf_path, title, difficulty, target_audience, timer, parallel
+                )
+
+        finally:
+            if not upload_task.done():
+                upload_task.cancel()
+            if extraction_task:
+                # Its pool job runs on regardless; let the result reach the extraction cache
+                pdf_extractor.finish_in_background(extraction_task)
+
+    async def stream(
+        self,
+        pdf_path: str,
+        title: str,
+        difficulty: str,
+        target_audience: str,
+        is_pdf: bool = True,
+        premium_quality: bool = False,
+        provider: Optional[str] = None,
+        timer: Optional[StageTimer] = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Streaming variant of run().
+
+        Yields ("module", module_dict) as each module is decoded, then
+        ("course", (course_data, metadata)) when the full JSON is parsed.
+        Falls back to text extraction only if the File API upload fails,
+        since modules already streamed cannot be taken back.
+        """
+        timer = timer or StageTimer()
+        await self._route(pdf_path, premium_quality, provider, timer)
+
+        uploaded_file, document_id, extracted_content = None, None, None
+        if is_pdf:
+            document_id = await pdf_extractor.content_key(pdf_path)
+            try:
+                uploaded_file = await timer.timed(
+                    "upload",
+                    file_registry.get_or_upload(
+                        pdf_path, document_id, on_processing=lambda: timer.mark("processing")
+                    )
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ File API upload failed, streaming from extracted text: {e}")
+
+        if uploaded_file is None:
+            extracted_content = await timer.timed("extraction", pdf_extractor.extract(pdf_path))
+
+        with timer.stage("generation"):
+            async for event, data in gemini_service.stream_course(
+                title,
+                difficulty,
+                target_audience,
+                uploaded_file=uploaded_file,
+                extracted=extracted_content
+            ):
+                if event == "module":
+                    yield event, data
+                else:
+                    course_data, metadata = data
+
+        if uploaded_file is not None:
+            metadata["document_id"] = document_id
+
+        yield "course", (course_data, metadata)
+
+    async def _route(
+        self,
+        pdf_path: str,
+        premium_quality: bool,
+        provider: Optional[str],
+        timer: StageTimer
+    ):
+        with timer.stage("estimate"):
+            estimated_content = await pdf_extractor.estimate(pdf_path)
+
+        timer.mark("routing")
+        routing_decision = ai_router.route(
+            extracted_content=estimated_content,
+            premium_quality=premium_quality,
+            preferred_provider=provider,
+            content_type="pdf"
+        )
+        logger.info(f"🧠 Routing: {routing_decision.provider.upper()} - {routing_decision.reason}")
+        timer.estimate(routing_decision.estimated_time_seconds)
+        return routing_decision
+
+    async def add_final_challenge(
+        self,
+        course_data: Dict[str, Any],
+        metadata: Dict[str, Any],
+        title: str,
+        timer: StageTimer
+    ) -> None:
+        """Generate the 30 Final Challenge questions into course_data (failures are non-critical)"""
+        logger.info("🎯 Generating Final Challenge questions (30 questions)...")
+        timer.mark("final_challenge")
+        final_challenge_start = time.time()
+
+        with retry_scope() as budget:
+            await self._add_final_challenge(course_data, metadata, title, timer, final_challenge_start)
+        budget.annotate(metadata)
+
+    async def _add_final_challenge(
+        self,
+        course_data: Dict[str, Any],
+        metadata: Dict[str, Any],
+        title: str,
+        timer: StageTimer,
+        final_challenge_start: float
+    ) -> None:
+        try:
+            # Prepare course content for final challenge generation
+            course_content_text = f"{course_data.get('title', '')}\n\n"
+            course_content_text += f"{course_data.get('description', '')}\n\n"
+
+            # Extract lessons content from modules
+            for module in course_data.get('modules', []):
+                course_content_text += f"## {module.get('title', '')}\n"
+                for activity in module.get('activities', []):
+                    if activity.get('type') == 'lesson':
+                        course_content_text += f"{activity.get('title', '')}\n"
+                        # Strip HTML for cleaner content
+                        clean_content = re.sub('<[^<]+?>', '', activity.get('content', ''))
+                        course_content_text += f"{clean_content[:500]}...\n\n"
+
+            # Generate the 30 questions
+            challenge_questions = await gemini_service.generate_final_challenge_questions(
+                course_content=course_content_text,
+                course_title=course_data.get('title', title),
+                course_modules=course_data.get('modules', []),
+                uploaded_file=file_registry.get(metadata.get('document_id'))
+            )
+
+            # DEBUG: Ver o que realmente foi retornado
+            logger.info(f'🔍 DEBUG: challenge_questions type = {type(challenge_questions)}')
+            logger.info(f'🔍 DEBUG: challenge_questions keys = {list(challenge_questions.keys()) if isinstance(challenge_questions, dict) else "N/A"}')
+            logger.info(f'🔍 DEBUG: easy_questions = {len(challenge_questions.get("easy_questions", []))} items')
+            logger.info(f'🔍 DEBUG: Primeiro item easy_questions = {challenge_questions.get("easy_questions", [])[0] if challenge_questions.get("easy_questions") else "VAZIO"}')
+
+            final_challenge_time_ms = int((time.time() - final_challenge_start) * 1000)
+            timer.timings_ms['final_challenge'] = final_challenge_time_ms
+
+            # Validate question counts
+            easy_count = len(challenge_questions.get('easy_questions', []))
+            medium_count = len(challenge_questions.get('medium_questions', []))
+            hard_count = len(challenge_questions.get('hard_questions', []))
+
+            logger.info(
+                f"✅ Final Challenge generated in {final_challenge_time_ms}ms - "
+                f"Easy: {easy_count}, Medium: {medium_count}, Hard: {hard_count}"
+            )
+
+            # Add final challenge questions to course_data
+            course_data['final_challenge_questions'] = {
+                'easy': challenge_questions.get('easy_questions', []),
+                'medium': challenge_questions.get('medium_questions', []),
+                'hard': challenge_questions.get('hard_questions', [])
+            }
+
+            # Update metadata with final challenge info
+            metadata['final_challenge_generated'] = True
+            metadata['final_challenge_status'] = 'completed'
+            metadata['final_challenge_time_ms'] = final_challenge_time_ms
+            metadata['total_questions'] = easy_count + medium_count + hard_count
+
+        except Exception as e:
+            logger.error(f"⚠️ Final Challenge generation failed (non-critical): {str(e)}")
+            file_registry.report_failure(metadata.get('document_id'), e)
+            # Don't fail the entire course generation if final challenge fails
+            course_data['final_challenge_questions'] = None
+            metadata['final_challenge_generated'] = False
+            metadata['final_challenge_status'] = 'failed'
+            metadata['final_challenge_error'] = str(e)
+
+    async def _fallback(
+        self,
+        extraction_task: Optional[asyncio.Task],
+        pdf_path: str,
+        title: str,
+        difficulty: str,
+        target_audience: str,
+        timer: StageTimer,
+        parallel: bool = False
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        if extraction_task:
+            extracted_content = await extraction_task
+        else:
+            extracted_content = await timer.timed("extraction", pdf_extractor.extract(pdf_path))
+
+        return await self._generate_from_text(
+            extracted_content, title, difficulty, target_audience, timer, parallel
+        )
+
+    async def _generate_from_text(
+        self,
+        extracted_content: ExtractedContent,
+        title: str,
+        difficulty: str,
+        target_audience: str,
+        timer: StageTimer,
+        parallel: bool = False
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        logger.info(f"📊 Extracted: {extracted_content.char_count} chars, quality: {extracted_content.quality_score:.0%}")
+
+        if parallel:
+            generation = gemini_service.generate_course_parallel(
+                title, difficulty, target_audience, extracted=extracted_content
+            )
+        else:
+            generation = gemini_service.generate_course(
+                extracted=extracted_content,
+                title=title,
+                difficulty=difficulty,
+                target_audience=target_audience
+            )
+
+        return await timer.timed("generation", generation)
+
+
+course_pipeline = CoursePipeline()
@@ -0,0 +1,162 @@
+"""Registry of processed Gemini File API uploads, keyed by PDF content hash"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+from app.config import settings
+from app.services.gemini_service import gemini_service
+
+logger = logging.getLogger(__name__)
+
+# Gemini deletes uploaded files after 48h; stop reusing them well before that
+MAX_FILE_AGE_SECONDS = 47 * 3600
+
+
+@dataclass
+class RegisteredFile:
+    uploaded_file: Any
+    uploaded_at: float
+    expires_at: float
+
+
+class FileRegistry:
+    """
+    Keeps processed Gemini files alive for reuse.
+
+    Retries, the final challenge and later /quiz calls for the same
+    document reference the already-processed file instead of uploading
+    the PDF again. Entries expire after GEMINI_FILE_TTL_SECONDS without
+    use, and a background sweeper deletes expired files from Gemini.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = settings.GEMINI_FILE_TTL_SECONDS,
+        sweep_interval_seconds: int = settings.GEMINI_FILE_SWEEP_SECONDS
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._files: Dict[str, RegisteredFile] = {}
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def get(self, document_id: Optional[str]):
+        """Return the processed file for a document, extending its TTL, or None"""
+        entry = self._files.get(document_id) if document_id else None
+        if entry is None:
+            return None
+
+        now = time.time()
+        if entry.expires_at <= now:
+            self._expire(document_id)
+            return None
+
+        entry.expires_at = min(now + self.ttl_seconds, entry.uploaded_at + MAX_FILE_AGE_SECONDS)
+        return entry.uploaded_file
+
+    async def get_or_upload(
+        self,
+        pdf_path: str,
+        document_id: str,
+        on_processing: Optional[Callable[[], None]] = None
+    ):
+        """
+        Return the registered file, or upload it (concurrent callers share one upload).
+
+        `on_processing` is called if this call's upload has to wait for
+        Gemini's server-side PROCESSING.
+        """
+        uploaded_file = self.get(document_id)
+        if uploaded_file is not None:
+            logger.info(f"♻️ Reusing processed Gemini file for {document_id[:12]}")
+            return uploaded_file
+
+        task = self._in_flight.get(document_id)
+        if task is None:
+            task = asyncio.create_task(self._upload(pdf_path, document_id, on_processing))
+            self._in_flight[document_id] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(document_id, None))
+
+        return await asyncio.shield(task)
+
+    async def _upload(
+        self,
+        pdf_path: str,
+        document_id: str,
+        on_processing: Optional[Callable[[], None]] = None
+    ):
+        uploaded_file = await gemini_service.upload_pdf(pdf_path, on_processing)
+
+        now = time.time()
+        self._files[document_id] = RegisteredFile(
+            uploaded_file=uploaded_file,
+            uploaded_at=now,
+            expires_at=now + self.ttl_seconds
+        )
+        logger.info(f"📌 Registered Gemini file {uploaded_file.name} for {document_id[:12]}")
+        return uploaded_file
+
+    def invalidate(self, document_id: str) -> None:
+        """Forget a document and delete its file (e.g. after a file-related failure)"""
+        if document_id in self._files:
+            self._expire(document_id)
+
+    def report_failure(self, document_id: Optional[str], error: BaseException) -> bool:
+        """
+        Invalidate a document whose Gemini file was rejected by a generation call.
+
+        Gemini answers 404/403 for files it expired or deleted; the next
+        call for the document then uploads it again instead of reusing the
+        stale handle until its TTL. Returns True when the entry was dropped.
+        """
+        if not document_id or document_id not in self._files:
+            return False
+        if not isinstance(error, (google_exceptions.NotFound, google_exceptions.PermissionDenied)):
+            return False
+
+        logger.warning(f"🗑️ Gemini file for {document_id[:12]} is no longer usable ({error}), forgetting it")
+        self.invalidate(document_id)
+        return True
+
+    def _expire(self, document_id: str) -> None:
+        entry = self._files.pop(document_id)
+        gemini_service.delete_file(entry.uploaded_file)
+
+    def sweep(self) -> int:
+        """Delete all expired files; returns how many were removed"""
+        now = time.time()
+        expired = [doc_id for doc_id, entry in self._files.items() if entry.expires_at <= now]
+        for document_id in expired:
+            self._expire(document_id)
+
+        if expired:
+            logger.info(f"🧹 Swept {len(expired)} expired Gemini file(s)")
+        return len(expired)
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval_seconds)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"⚠️ Gemini file sweep failed: {e}")
+
+    def start(self) -> None:
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        """Stop the sweeper and delete every registered file"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+        for document_id in list(self._files):
+            self._expire(document_id)
+
+
+file_registry = FileRegistry()
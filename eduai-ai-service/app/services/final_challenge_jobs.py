@@ -0,0 +1,158 @@
+"""Background final-challenge generation, off the /course critical path"""
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from app.config import settings
+from app.services.course_pipeline import course_pipeline, StageTimer
+from app.services.webhooks import webhook_outbox
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FinalChallengeJob:
+    job_id: str
+    course_title: str
+    document_id: Optional[str]
+    created_at: float
+    updated_at: float
+    status: str = "pending"  # pending | completed | failed
+    final_challenge_questions: Optional[Dict[str, List[Dict[str, Any]]]] = None
+    total_questions: int = 0
+    generation_time_ms: int = 0
+    error: Optional[str] = None
+    # Awaited once the job is completed or failed (see FinalChallengeJobs.when_done)
+    callbacks: List[Callable[["FinalChallengeJob"], Awaitable[None]]] = field(
+        default_factory=list, repr=False
+    )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "course_title": self.course_title,
+            "document_id": self.document_id,
+            "final_challenge_questions": self.final_challenge_questions,
+            "total_questions": self.total_questions,
+            "generation_time_ms": self.generation_time_ms,
+            "error": self.error
+        }
+
+
+class FinalChallengeJobs:
+    """
+    Runs final-challenge generation after /course has already responded.
+
+    Results are kept in memory for FINAL_CHALLENGE_JOB_TTL_SECONDS and can
+    be polled by job id. When FINAL_CHALLENGE_CALLBACK_PATH is set, the
+    finished job is also delivered to Laravel (LARAVEL_API_URL + path)
+    through the signed webhook outbox.
+    """
+
+    def __init__(self, ttl_seconds: int = settings.FINAL_CHALLENGE_JOB_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, FinalChallengeJob] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(
+        self,
+        course_data: Dict[str, Any],
+        metadata: Dict[str, Any],
+        title: str
+    ) -> FinalChallengeJob:
+        """Start generating the final challenge for a course; returns immediately"""
+        self._prune()
+
+        now = time.time()
+        job = FinalChallengeJob(
+            job_id=uuid.uuid4().hex,
+            course_title=course_data.get("title", title),
+            document_id=metadata.get("document_id"),
+            created_at=now,
+            updated_at=now
+        )
+        self._jobs[job.job_id] = job
+
+        # Work on copies: the caller serializes its own course_data/metadata
+        task = asyncio.create_task(
+            self._run(job, dict(course_data), {"document_id": job.document_id}, title)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        logger.info(f"⏳ Final Challenge queued in background: job {job.job_id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[FinalChallengeJob]:
+        return self._jobs.get(job_id)
+
+    def when_done(self, job_id: str, callback: Callable[[FinalChallengeJob], Awaitable[None]]) -> bool:
+        """Await `callback(job)` once the job has finished; False for unknown jobs"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+
+        if job.status == "pending":
+            job.callbacks.append(callback)
+        else:
+            task = asyncio.create_task(self._notify(job, callback))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _notify(
+        self,
+        job: FinalChallengeJob,
+        callback: Callable[[FinalChallengeJob], Awaitable[None]]
+    ) -> None:
+        try:
+            await callback(job)
+        except Exception as e:
+            logger.error(f"❌ Final Challenge job {job.job_id} callback failed: {e}")
+
+    async def _run(
+        self,
+        job: FinalChallengeJob,
+        course_data: Dict[str, Any],
+        metadata: Dict[str, Any],
+        title: str
+    ) -> None:
+        await course_pipeline.add_final_challenge(course_data, metadata, title, StageTimer())
+
+        job.status = metadata["final_challenge_status"]
+        job.final_challenge_questions = course_data.get("final_challenge_questions")
+        job.total_questions = metadata.get("total_questions", 0)
+        job.generation_time_ms = metadata.get("final_challenge_time_ms", 0)
+        job.error = metadata.get("final_challenge_error")
+        job.updated_at = time.time()
+
+        callbacks, job.callbacks = job.callbacks, []
+        for callback in callbacks:
+            await self._notify(job, callback)
+
+        if settings.FINAL_CHALLENGE_CALLBACK_PATH:
+            url = settings.LARAVEL_API_URL.rstrip("/") + settings.FINAL_CHALLENGE_CALLBACK_PATH
+            await webhook_outbox.enqueue(url, {"event": f"final_challenge.{job.status}", **job.to_dict()})
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.status != "pending" and job.updated_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def stop(self) -> None:
+        """Cancel pending jobs (called on application shutdown)"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+final_challenge_jobs = FinalChallengeJobs()
@@ -1,104 +1,163 @@
 import google.generativeai as genai
 import json
 import asyncio
-from typing import Tuple, Dict, Any
+import logging
+from typing import AsyncIterator, Callable, List, Tuple, Dict, Any, Optional, Set, Union
 from pathlib import Path
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
-from app.models.schemas import ExtractedContent
-from app.config import settings
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+from app.models.schemas import CourseDataSchema, ExtractedContent, LessonSchema, ModuleSchema, QuizSchema
+from app.config import settings, TIMEOUT_CONFIG, FILE_POLL_CONFIG
+from app.services.context_cache import ContextCache
+from app.utils.cache import TieredCache, content_hash
+from app.utils.json_repair import repair_json, repair_stats
+from app.utils.json_stream import ArrayItemStream
+from app.utils.response_schema import gemini_response_schema
+from app.utils.retry import stage_retry, TRANSIENT
+
+logger = logging.getLogger(__name__)
+
+# Configuração compartilhada pela geração de curso (texto, PDF e streaming)
+COURSE_GENERATION_CONFIG = {
+    "temperature": 0.8,  # ✅ CORREÇÃO 2/4: Aumentado para 0.8
+    "top_p": 0.85,
+    "top_k": 40,
+    "max_output_tokens": 32768,
+    "response_mime_type": "application/json"
+}
+
+# Trecho do módulo enviado no prompt do quiz (e usado na chave do cache de quiz)
+QUIZ_CONTENT_BUDGET = 2000
+
+# Vários módulos por chamada em /quiz/batch: ~5 questões (<1k tokens) por módulo
+QUIZ_BATCH_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "max_output_tokens": 8192,
+    "response_mime_type": "application/json"
+}
+
+FINAL_CHALLENGE_GENERATION_CONFIG = {
+    "temperature": 0.85,  # Criatividade para gerar questões variadas
+    "top_p": 0.9,
+    "top_k": 40,
+    "max_output_tokens": 32768,
+    "response_mime_type": "application/json"
+}
+
+# Um nível do Desafio Final por chamada: 10 questões cabem com folga em 8k
+FINAL_CHALLENGE_TIER_CONFIG = {
+    **FINAL_CHALLENGE_GENERATION_CONFIG,
+    "max_output_tokens": 8192
+}
+
+# Questões por nível do Desafio Final
+FINAL_CHALLENGE_TIER_SIZE = 10
+
+FINAL_CHALLENGE_TIERS = {
+    "easy": {
+        "label": "FÁCIL",
+        "points": 10,
+        "guidelines": '''- Conceitos básicos e definições
+- Questões diretas que testam memorização e compreensão fundamental
+- Resposta pode ser encontrada diretamente no conteúdo
+- Exemplo: "O que é X?", "Qual a definição de Y?"'''
+    },
+    "medium": {
+        "label": "MÉDIO",
+        "points": 15,
+        "guidelines": '''- Aplicação de conceitos em situações práticas
+- Requer interpretação e análise
+- Conexão entre diferentes tópicos do curso
+- Exemplo: "Como X se relaciona com Y?", "Qual a melhor abordagem para Z?"'''
+    },
+    "hard": {
+        "label": "DIFÍCIL",
+        "points": 20,
+        "guidelines": '''- Síntese de múltiplos conceitos
+- Pensamento crítico e resolução de problemas complexos
+- Cenários que exigem análise profunda
+- Exemplo: "Avalie a situação complexa...", "Compare e contraste X, Y e Z"'''
+    }
+}
 
+# Fase 1 do modo paralelo: só o esboço do curso (saída curta)
+OUTLINE_GENERATION_CONFIG = {
+    **COURSE_GENERATION_CONFIG,
+    "temperature": 0.6,
+    "max_output_tokens": 4096
+}
 
-class GeminiService:
-    def __init__(self):
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        # Use gemini-2.5-flash (rápido, estável e disponível)
-        self.model = genai.GenerativeModel("gemini-2.5-flash")
+# Fase 2 do modo paralelo: lição + quiz de um único módulo
+MODULE_GENERATION_CONFIG = {
+    **COURSE_GENERATION_CONFIG,
+    "max_output_tokens": 8192
+}
 
-    def build_prompt(
-        self,
-        title: str,
-        difficulty: str,
-        audience: str,
-        content: str
-    ) -> str:
-        # ✅ CORREÇÃO 1: Removido limite de 15000 caracteres
-        # Agora usa TODO o conteúdo extraído do PDF
-        limited_content = content  # Usa conteúdo completo
 
-        prompt = f"""Você é um especialista pedagógico criando material didático de alta qualidade.
+class UploadTimeoutError(RuntimeError):
+    """The File API upload did not return in time (permanent for the retry engine)"""
 
-DOCUMENTO ORIGINAL:
-{limited_content}
 
-Título do Curso: {title}
-Dificuldade: {difficulty}
-Público-alvo: {audience}
+# Validação de módulos reparados (modo paralelo)
+_ACTIVITIES = TypeAdapter(List[Union[LessonSchema, QuizSchema]])
+_ACTIVITY_VARIANTS = {"lesson": "LessonSchema", "quiz": "QuizSchema"}
 
-INSTRUÇÕES CRÍTICAS:
-1. **DIVISÃO DO CONTEÚDO**: Analise o documento e divida em 4-6 módulos com temas ÚNICOS e DISTINTOS
-   - Cada módulo deve cobrir um aspecto DIFERENTE do conteúdo
-   - NÃO repita o mesmo conteúdo em múltiplos módulos
-   - Organize de forma progressiva (do básico ao avançado)
 
-2. **ESTRUTURA DE CADA MÓDULO**:
-   - Cada módulo DEVE ter: 1 lição + 1 quiz correspondente
-   - A ORDEM é crítica: primeiro a lição (type: "lesson"), depois o quiz (type: "quiz")
-   - O campo "order" deve ser sequencial: 1, 2, 3, 4, 5, 6...
+class _ModuleActivities(BaseModel):
+    """Saída de uma chamada por módulo no modo paralelo"""
+    activities: List[Union[LessonSchema, QuizSchema]] = Field(..., min_length=1, max_length=20)
 
-3. **CRITICAL MICRO-LEARNING REQUIREMENTS**:
-   - Each lesson 'content' field: MINIMUM 800 characters with rich HTML structure
-   - Structure each lesson as:
-     * Title with <h2>📚 Main Topic Title</h2>
-     * Introduction paragraph with <p>Brief introduction explaining context</p>
-     * Core concepts with <h3>Key Concepts</h3> subsections
-     * Important terms: <strong>highlight with bold</strong>
-     * Technical terms: <em>mark in italics</em>
-     * Lists: use <ul> or <ol> for enumeration
-     * Tips/Warnings: <blockquote>💡 <strong>Important:</strong> Relevant information</blockquote>
-     * Tables: use <table> for comparisons and structured data
-     * Icons: use emojis for visual appeal (📊 📈 💡 ⚠️ ✅ ❌)
-     * Example structure:
 
-       <h2>📚 Lesson Topic</h2>
-       <p>Clear introduction to the concept.</p>
+class _RemainingModules(BaseModel):
+    """Saída de uma chamada de continuação do curso"""
+    modules: List[ModuleSchema]
 
-       <h3>Core Principles</h3>
-       <p>The <strong>main concept</strong> is essential because it <em>defines the foundation</em> of understanding.</p>
 
-       <blockquote>💡 <strong>Key Point:</strong> This concept appears in 90% of practical applications.</blockquote>
+# Saída estruturada: o formato JSON é imposto na decodificação (STRUCTURED_OUTPUT_ENABLED).
+# final_challenge_questions é gerado em chamadas próprias, não junto com o curso.
+COURSE_RESPONSE_SCHEMA = gemini_response_schema(CourseDataSchema, exclude={"final_challenge_questions"})
+MODULE_RESPONSE_SCHEMA = gemini_response_schema(_ModuleActivities)
+CONTINUATION_RESPONSE_SCHEMA = gemini_response_schema(_RemainingModules)
 
-       <h3>📊 Comparison Table</h3>
-       <table>
-       <thead>
-       <tr><th>Method</th><th>Advantages</th><th>Disadvantages</th></tr>
-       </thead>
-       <tbody>
-       <tr>
-       <td><strong>Method A</strong></td>
-       <td>✅ Fast<br>✅ Efficient</td>
-       <td>❌ Complex<br>❌ Expensive</td>
-       </tr>
-       </tbody>
-       </table>
 
-       <h3>Key Takeaways</h3>
-       <ul>
-       <li><strong>First important point:</strong> detailed explanation</li>
-       <li><strong>Second critical concept:</strong> practical example</li>
-       <li><strong>Third essential idea:</strong> real application</li>
-       </ul>
+def _structured(config: Dict[str, Any], schema: Dict[str, Any]) -> Dict[str, Any]:
+    """`config` with `schema` as response_schema, when structured output is enabled"""
+    if not settings.STRUCTURED_OUTPUT_ENABLED:
+        return config
+    return {**config, "response_schema": schema}
 
-       <blockquote>⚠️ <strong>Note:</strong> This concept frequently appears in assessments!</blockquote>
-   - Focus on ONE main idea per lesson with rich visual structure
-   - Be comprehensive and well-formatted with semantic HTML
 
-4. **QUIZZES**:
-   - Cada quiz deve ter 5 questões sobre a lição correspondente
-   - Questões devem testar compreensão, não memorização
-   - Incluir explicações pedagógicas
+class GeminiService:
+    def __init__(self):
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+        # Use gemini-2.5-flash (rápido, estável e disponível)
+        self.model_name = "gemini-2.5-flash"
+        self.model = genai.GenerativeModel(self.model_name)
+        # Documento grande registrado uma vez como prefixo compartilhado
+        self.context_cache = ContextCache(self.model_name)
+        # Background File API deletions (kept referenced until done)
+        self._cleanup_tasks: Set[asyncio.Task] = set()
+        # Quizzes for unchanged modules (re-published lessons, quiz resets)
+        self.quiz_cache = TieredCache(
+            name="quiz",
+            max_entries=settings.QUIZ_CACHE_ENTRIES,
+            ttl_seconds=settings.QUIZ_CACHE_TTL_SECONDS,
+            serialize=json.dumps,
+            deserialize=json.loads,
+            use_redis=settings.QUIZ_CACHE_REDIS
+        )
 
-ESTRUTURA JSON OBRIGATÓRIA:
+    def build_prompt(
+        self,
+        title: str,
+        difficulty: str,
+        audience: str
+    ) -> str:
+        # ✅ CORREÇÃO 1: Removido limite de 15000 caracteres
+        # O documento completo vai como prefixo separado (ver _document_part)
+        # Com saída estruturada o formato vem do response_schema e o exemplo JSON é omitido
+        json_structure = self._structured_output_note(title, difficulty) if settings.STRUCTURED_OUTPUT_ENABLED else f"""ESTRUTURA JSON OBRIGATÓRIA:
 {{
     "title": "{title}",
     "description": "descrição completa do curso (mínimo 80 caracteres)",
@@ -164,118 +223,26 @@ ESTRUTURA JSON OBRIGATÓRIA:
     ],
     "learning_objectives": ["objetivo1", "objetivo2", "objetivo3"],
     "prerequisites": ["prerequisito1", "prerequisito2"]
-}}
-
-REGRAS FINAIS:
-- Retorne APENAS o JSON válido, sem markdown ou código
-- A ordem (order) deve ser sequencial: 1, 2, 3, 4, 5...
-- NUNCA coloque quiz antes de sua lição
-- Cada módulo = 1 tema único diferente dos outros"""
-
-        return prompt
-
-    def _parse_json(self, text: str) -> Dict[str, Any]:
-        start = text.find('{')
-        end = text.rfind('}')
-
-        if start == -1 or end == -1:
-            raise ValueError("No JSON object found in response")
-
-        json_str = text[start:end + 1]
-        return json.loads(json_str)
-
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((Exception,)),
-        reraise=True
-    )
-    async def generate_course(
-        self,
-        extracted: ExtractedContent,
-        title: str,
-        difficulty: str,
-        target_audience: str
-    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
-        prompt = self.build_prompt(title, difficulty, target_audience, extracted.text)
-
-        response = await self.model.generate_content_async(
-            prompt,
-            generation_config={
-                "temperature": 0.8,  # ✅ CORREÇÃO 2: Aumentado de 0.7 para 0.8
-                "top_p": 0.85,
-                "top_k": 40,
-                "max_output_tokens": 32768,
-                "response_mime_type": "application/json"
-            }
-        )
+}}"""
 
-        course_dict = self._parse_json(response.text)
-
-        print("=" * 80)
-        print("DEBUG - JSON RECEBIDO DO GEMINI (generate_course):")
-        print(json.dumps(course_dict, indent=2, ensure_ascii=False))
-        print("=" * 80)
-
-        metadata_dict = {
-            "provider": "gemini",
-            "model": "gemini-2.5-flash",
-            "generation_method": "direct_json",
-            "tokens_used": {
-                "input": response.usage_metadata.prompt_token_count,
-                "output": response.usage_metadata.candidates_token_count
-            },
-            "cost_usd": 0.0,
-            "generation_time_ms": 0,
-            "confidence_score": 0.9,
-            "routing_reason": "gemini_service"
-        }
-
-        return (course_dict, metadata_dict)
-
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((Exception,)),
-        reraise=True
-    )
-    async def upload_and_generate_from_pdf(
-        self,
-        pdf_path: str,
-        title: str,
-        difficulty: str,
-        target_audience: str
-    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
-        uploaded_file = genai.upload_file(pdf_path, mime_type="application/pdf")
-
-        while uploaded_file.state.name == "PROCESSING":
-            await asyncio.sleep(1)
-            uploaded_file = genai.get_file(uploaded_file.name)
-
-        if uploaded_file.state.name == "FAILED":
-            raise ValueError(f"File processing failed: {uploaded_file.state.name}")
+        prompt = f"""Você é um especialista pedagógico criando material didático de alta qualidade.
 
-        # ✅ CORREÇÃO 3: Prompt completamente reescrito com quizzes integrados
-        prompt = f"""Você é um especialista pedagógico criando material didático de excelência a partir do PDF.
+Use o DOCUMENTO ORIGINAL fornecido acima como fonte.
 
 Título do Curso: {title}
 Dificuldade: {difficulty}
-Público-alvo: {target_audience}
-
-TAREFA: Crie um curso educacional completo baseado EXCLUSIVAMENTE no conteúdo do PDF fornecido.
+Público-alvo: {audience}
 
 INSTRUÇÕES CRÍTICAS:
-1. **DIVISÃO INTELIGENTE DO CONTEÚDO**:
-   - Analise todo o PDF e identifique 4-6 temas PRINCIPAIS e DISTINTOS
-   - Cada módulo deve cobrir um aspecto DIFERENTE do documento
-   - NÃO repita o mesmo conteúdo em vários módulos
-   - Organize progressivamente (básico → intermediário → avançado)
+1. **DIVISÃO DO CONTEÚDO**: Analise o documento e divida em 4-6 módulos com temas ÚNICOS e DISTINTOS
+   - Cada módulo deve cobrir um aspecto DIFERENTE do conteúdo
+   - NÃO repita o mesmo conteúdo em múltiplos módulos
+   - Organize de forma progressiva (do básico ao avançado)
 
-2. **ESTRUTURA DE CADA MÓDULO** (OBRIGATÓRIA):
-   Módulo = 1 Lição + 1 Quiz
-   - PRIMEIRO: Lição (type: "lesson", order: número_ímpar)
-   - DEPOIS: Quiz sobre essa lição (type: "quiz", order: número_par)
-   - Exemplo: Lição (order: 1) → Quiz (order: 2) → Lição (order: 3) → Quiz (order: 4)
+2. **ESTRUTURA DE CADA MÓDULO**:
+   - Cada módulo DEVE ter: 1 lição + 1 quiz correspondente
+   - A ORDEM é crítica: primeiro a lição (type: "lesson"), depois o quiz (type: "quiz")
+   - O campo "order" deve ser sequencial: 1, 2, 3, 4, 5, 6...
 
 3. **CRITICAL MICRO-LEARNING REQUIREMENTS**:
    - Each lesson 'content' field: MINIMUM 800 characters with rich HTML structure
@@ -323,16 +290,400 @@ INSTRUÇÕES CRÍTICAS:
        <blockquote>⚠️ <strong>Note:</strong> This concept frequently appears in assessments!</blockquote>
    - Focus on ONE main idea per lesson with rich visual structure
    - Be comprehensive and well-formatted with semantic HTML
-   - Use 100% de fidelidade ao PDF - não invente informações
-   - Seja profissional mas acessível
 
 4. **QUIZZES**:
-   - Cada quiz deve ter exatamente 5 questões
-   - Questões testam COMPREENSÃO da lição correspondente
-   - Mix: 3 múltipla escolha + 2 verdadeiro/falso
-   - Cada questão deve ter explicação pedagógica
+   - Cada quiz deve ter 5 questões sobre a lição correspondente
+   - Questões devem testar compreensão, não memorização
+   - Incluir explicações pedagógicas
 
-ESTRUTURA JSON OBRIGATÓRIA:
+{json_structure}
+
+REGRAS FINAIS:
+- Retorne APENAS o JSON válido, sem markdown ou código
+- A ordem (order) deve ser sequencial: 1, 2, 3, 4, 5...
+- NUNCA coloque quiz antes de sua lição
+- Cada módulo = 1 tema único diferente dos outros"""
+
+        return prompt
+
+    def _structured_output_note(self, title: str, difficulty: str) -> str:
+        """Curta instrução de formato que substitui o exemplo JSON quando há response_schema"""
+        return f"""FORMATO DA RESPOSTA:
+Campos, tipos e limites do JSON são definidos pelo schema estruturado da resposta.
+- "title": "{title}" e "difficulty": "{difficulty}"
+- "estimated_hours": número inteiro
+- Atividades com "type": "lesson" (com "content" em HTML) ou "quiz" (com "questions"), cada quiz logo após sua lição"""
+
+    def _document_part(self, text: str) -> str:
+        return f"DOCUMENTO ORIGINAL:\n{text}"
+
+    async def _generate(
+        self,
+        prompt: str,
+        generation_config: Dict[str, Any],
+        document: Any = None,
+        cache_key: str | None = None,
+        stream: bool = False
+    ):
+        """
+        Run a generation with `document` as a shared prefix.
+
+        With a `cache_key`, the document is registered once as Gemini cached
+        content and later calls only send `prompt`; otherwise (or when the
+        cache is unavailable) it is sent inline as the first part.
+        """
+        if document is None:
+            return await self.model.generate_content_async(
+                prompt, generation_config=generation_config, stream=stream
+            )
+
+        cached = await self.context_cache.get(cache_key, document) if cache_key else None
+        if cached is not None:
+            model = genai.GenerativeModel.from_cached_content(cached)
+            return await model.generate_content_async(
+                prompt, generation_config=generation_config, stream=stream
+            )
+
+        return await self.model.generate_content_async(
+            [document, prompt], generation_config=generation_config, stream=stream
+        )
+
+    def _token_usage(self, response) -> Dict[str, int]:
+        usage = response.usage_metadata
+        return {
+            "input": usage.prompt_token_count,
+            "output": usage.candidates_token_count,
+            "cached": getattr(usage, "cached_content_token_count", 0) or 0
+        }
+
+    def _parse_json(
+        self,
+        text: str,
+        warnings: Optional[List[str]] = None,
+        validate: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Parse model output, repairing malformed or truncated JSON locally.
+
+        A repaired result must pass `validate` (when given); otherwise a
+        ValueError is raised so the stage retry generates it again. Repair
+        notes are appended to `warnings`.
+        """
+        data, repairs = repair_json(text)
+        if repairs:
+            if validate is not None:
+                try:
+                    validate(data)
+                except ValueError as e:
+                    repair_stats.rejected += 1
+                    raise ValueError(f"Repaired output failed validation: {e}") from e
+            if warnings is not None:
+                warnings.extend(repairs)
+        return data
+
+    def _course_issues(self, course_dict: Dict[str, Any]) -> Tuple[List[str], Dict[int, List[str]]]:
+        """
+        CourseDataSchema errors: (errors needing a full rerun, activity errors per module index).
+
+        Only errors inside a module's activities are repairable by
+        _repair_modules (it regenerates activities); module fields such as
+        title or description count as course-level errors.
+        """
+        try:
+            CourseDataSchema.model_validate(course_dict)
+        except ValidationError as e:
+            course_errors: List[str] = []
+            module_errors: Dict[int, List[str]] = {}
+            for error in e.errors():
+                loc = error["loc"]
+                if len(loc) > 2 and loc[0] == "modules" and isinstance(loc[1], int) and loc[2] == "activities":
+                    if len(loc) > 4 and loc[2] == "activities" and loc[4] in _ACTIVITY_VARIANTS.values():
+                        # Union errors come once per variant: keep the one the activity's type names
+                        activity = course_dict["modules"][loc[1]]["activities"][loc[3]]
+                        kind = activity.get("type") if isinstance(activity, dict) else None
+                        if loc[4] != _ACTIVITY_VARIANTS.get(kind, "LessonSchema"):
+                            continue
+                        loc = loc[:4] + loc[5:]
+                    path = ".".join(str(part) for part in loc[2:])
+                    module_errors.setdefault(loc[1], []).append(f"{path}: {error['msg']}")
+                else:
+                    course_errors.append(f"{'.'.join(str(part) for part in loc)}: {error['msg']}")
+            return course_errors, module_errors
+        return [], {}
+
+    def _validate_course(self, course_dict: Dict[str, Any]) -> None:
+        """
+        Validator for repaired courses: trailing modules cut before any
+        activity are dropped. Course and module fields must be valid here;
+        invalid activities are left to _repair_modules.
+        """
+        modules = course_dict.get("modules") or []
+        while modules and not modules[-1].get("activities"):
+            modules.pop()
+        course_errors, _ = self._course_issues(course_dict)
+        if course_errors:
+            raise ValueError(f"Invalid course: {'; '.join(course_errors[:5])}")
+
+    def _renumber(self, modules: List[Dict[str, Any]]) -> None:
+        """Sequential module order and course-wide activity order after modules were spliced"""
+        order = 0
+        for number, module in enumerate(modules, 1):
+            module["order"] = number
+            for activity in module.get("activities") or []:
+                order += 1
+                activity["order"] = order
+
+    def _validate_module(self, module_data: Dict[str, Any]) -> None:
+        """Validator for repaired per-module output in parallel mode"""
+        activities = module_data.get("activities")
+        if not activities:
+            raise ValueError("Module has no activities")
+        _ACTIVITIES.validate_python(activities)
+
+    def _hit_token_limit(self, response) -> bool:
+        """True when generation stopped at max_output_tokens (the text is cut off)"""
+        try:
+            reason = response.candidates[0].finish_reason
+        except (AttributeError, IndexError, TypeError):
+            return False
+        return getattr(reason, "name", reason) in ("MAX_TOKENS", 2)
+
+    def _complete_items(self, text: str, key: str) -> List[Dict[str, Any]]:
+        """Objects of the `key` array that were fully written before the output was cut"""
+        return ArrayItemStream(key).feed(text)
+
+    @stage_retry("item_generation")
+    async def _generate_items(
+        self,
+        prompt: str,
+        key: str,
+        generation_config: Dict[str, Any],
+        document: Any,
+        cache_key: Optional[str],
+        required: bool = False
+    ) -> Tuple[List[Dict[str, Any]], bool, Dict[str, int], List[str]]:
+        """
+        One call for the `key` array: (items, truncated, token usage, repair warnings).
+
+        Retried on its own, so a failed call never discards the items the
+        caller already collected. A cut-off response yields its complete
+        items; with `required`, a response without any is retried.
+        """
+        response = await self._generate(
+            prompt,
+            generation_config=generation_config,
+            document=document,
+            cache_key=cache_key
+        )
+        repair_warnings: List[str] = []
+        truncated = self._hit_token_limit(response)
+        if truncated:
+            items = self._complete_items(response.text, key)
+        else:
+            items = self._parse_json(response.text, repair_warnings).get(key) or []
+        if required and not items:
+            raise ValueError(f"No {key} in response")
+        return items, truncated, self._token_usage(response), repair_warnings
+
+    def build_continuation_prompt(self, prompt: str, modules: List[Dict[str, Any]]) -> str:
+        done = "\n".join(
+            f"{number}. {module.get('title', '')}" for number, module in enumerate(modules, 1)
+        ) or "(nenhum)"
+
+        # O prompt original vem primeiro para manter o mesmo prefixo (e o cache de contexto)
+        return f"""{prompt}
+
+CONTINUAÇÃO: a resposta anterior foi interrompida pelo limite de tamanho da saída.
+Estes módulos JÁ FORAM GERADOS e NÃO devem ser repetidos:
+{done}
+
+Gere APENAS os módulos restantes do curso (a partir do módulo {len(modules) + 1}), com a mesma estrutura
+de módulo descrita acima, no formato:
+{{"modules": [ ... ]}}
+Se o curso já estiver completo, retorne {{"modules": []}}."""
+
+    async def _course_from_response(
+        self,
+        response,
+        prompt: str,
+        document: Any,
+        cache_key: Optional[str],
+        repair_warnings: List[str],
+        title: str
+    ) -> Tuple[Dict[str, Any], Dict[str, int], int]:
+        """
+        Parse a course response; (course, tokens used, continuation calls).
+
+        When the output stopped at max_output_tokens, the complete modules
+        are kept and up to GENERATION_MAX_CONTINUATIONS follow-up calls ask
+        only for the remaining modules, which are appended.
+        """
+        tokens_used = self._token_usage(response)
+        if not self._hit_token_limit(response):
+            return self._parse_json(response.text, repair_warnings, self._validate_course), tokens_used, 0
+
+        course_dict = self._parse_json(response.text)
+        # With a response_schema, fields are written in alphabetical order: "title" follows "modules"
+        course_dict.setdefault("title", title)
+        modules = self._complete_items(response.text, "modules")
+        course_dict["modules"] = modules
+
+        continuations = 0
+        while continuations < settings.GENERATION_MAX_CONTINUATIONS:
+            continuations += 1
+            logger.info(
+                f"✂️ Course output hit max_output_tokens after {len(modules)} complete modules, "
+                f"requesting the rest (continuation {continuations})"
+            )
+            new_modules, truncated, usage, warnings = await self._generate_items(
+                self.build_continuation_prompt(prompt, modules),
+                "modules",
+                generation_config=_structured(COURSE_GENERATION_CONFIG, CONTINUATION_RESPONSE_SCHEMA),
+                document=document,
+                cache_key=cache_key
+            )
+            repair_warnings.extend(warnings)
+            for key, value in usage.items():
+                tokens_used[key] = tokens_used.get(key, 0) + value
+
+            seen = {module.get("title") for module in modules}
+            modules.extend(module for module in new_modules if module.get("title") not in seen)
+            if not truncated or not new_modules:
+                break
+
+        self._renumber(modules)
+        self._validate_course(course_dict)
+        logger.info(f"🧵 Course stitched from {continuations + 1} responses ({len(modules)} modules)")
+        return course_dict, tokens_used, continuations
+
+    @stage_retry("course_generation")
+    async def generate_course(
+        self,
+        extracted: ExtractedContent,
+        title: str,
+        difficulty: str,
+        target_audience: str
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        prompt = self.build_prompt(title, difficulty, target_audience)
+
+        document = self._document_part(extracted.text)
+        cache_key = content_hash(extracted.text)
+        response = await self._generate(
+            prompt,
+            generation_config=_structured(COURSE_GENERATION_CONFIG, COURSE_RESPONSE_SCHEMA),
+            document=document,
+            cache_key=cache_key
+        )
+
+        repair_warnings: List[str] = []
+        course_dict, tokens_used, continuations = await self._course_from_response(
+            response, prompt, document, cache_key, repair_warnings, title
+        )
+        repaired_modules = await self._repair_modules(
+            course_dict, title, difficulty, target_audience, document, cache_key, tokens_used
+        )
+
+        print("=" * 80)
+        print("DEBUG - JSON RECEBIDO DO GEMINI (generate_course):")
+        print(json.dumps(course_dict, indent=2, ensure_ascii=False))
+        print("=" * 80)
+
+        metadata_dict = {
+            "provider": "gemini",
+            "model": "gemini-2.5-flash",
+            "generation_method": "direct_json",
+            "tokens_used": tokens_used,
+            "continuations": continuations,
+            "repaired_modules": repaired_modules,
+            "cost_usd": 0.0,
+            "generation_time_ms": 0,
+            "confidence_score": 0.9,
+            "routing_reason": "gemini_service",
+            "repair_warnings": repair_warnings
+        }
+
+        return (course_dict, metadata_dict)
+
+    @stage_retry("upload", retry_on=(TRANSIENT,))
+    async def _upload_file(self, pdf_path: str):
+        # Only the upload request is retried; a file stuck in PROCESSING goes to the text fallback
+        upload = asyncio.ensure_future(
+            asyncio.to_thread(genai.upload_file, pdf_path, mime_type="application/pdf")
+        )
+        try:
+            done, _ = await asyncio.wait({upload}, timeout=TIMEOUT_CONFIG["file_processing"])
+            if not done:
+                # Not retried: the upload thread cannot be stopped and would leave a second copy
+                raise UploadTimeoutError(
+                    f"Upload of {Path(pdf_path).name} took longer than {TIMEOUT_CONFIG['file_processing']}s"
+                )
+            return upload.result()
+        finally:
+            if not upload.done():
+                upload.add_done_callback(self._discard_late_upload)
+
+    def _discard_late_upload(self, upload: asyncio.Future) -> None:
+        """Delete a file whose upload finished after its caller gave up on it"""
+        if upload.cancelled() or upload.exception() is not None:
+            return
+        uploaded_file = upload.result()
+        logger.info(f"🗑️ Deleting late upload {uploaded_file.name}")
+        self.delete_file(uploaded_file)
+
+    async def upload_pdf(self, pdf_path: str, on_processing: Optional[Callable[[], None]] = None):
+        """
+        Upload a PDF to the Gemini File API and wait until it is processed.
+
+        `on_processing` is called once if the file enters PROCESSING.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + TIMEOUT_CONFIG["file_processing"]
+
+        uploaded_file = await self._upload_file(pdf_path)
+
+        if uploaded_file.state.name == "PROCESSING" and on_processing is not None:
+            on_processing()
+
+        interval = FILE_POLL_CONFIG["initial_interval"]
+        while uploaded_file.state.name == "PROCESSING":
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self.delete_file(uploaded_file)
+                raise TimeoutError(
+                    f"File {uploaded_file.name} still PROCESSING after "
+                    f"{TIMEOUT_CONFIG['file_processing']}s"
+                )
+
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * FILE_POLL_CONFIG["multiplier"], FILE_POLL_CONFIG["max_interval"])
+            uploaded_file = await asyncio.to_thread(genai.get_file, uploaded_file.name)
+
+        if uploaded_file.state.name == "FAILED":
+            self.delete_file(uploaded_file)
+            raise ValueError(f"File processing failed: {uploaded_file.state.name}")
+
+        return uploaded_file
+
+    def delete_file(self, uploaded_file) -> None:
+        """Schedule deletion of an uploaded file in the background, off the response path"""
+        task = asyncio.create_task(self._delete_file(uploaded_file.name))
+        self._cleanup_tasks.add(task)
+        task.add_done_callback(self._cleanup_tasks.discard)
+
+    async def _delete_file(self, name: str) -> None:
+        try:
+            await asyncio.to_thread(genai.delete_file, name)
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to delete Gemini file {name}: {e}")
+
+    async def drain_cleanup(self) -> None:
+        """Wait for pending background deletions (called on application shutdown)"""
+        if self._cleanup_tasks:
+            await asyncio.gather(*self._cleanup_tasks, return_exceptions=True)
+
+    def build_pdf_prompt(self, title: str, difficulty: str, target_audience: str) -> str:
+        # ✅ CORREÇÃO 3: Prompt completamente reescrito com quizzes integrados
+        json_structure = self._structured_output_note(title, difficulty) if settings.STRUCTURED_OUTPUT_ENABLED else f"""ESTRUTURA JSON OBRIGATÓRIA:
 {{
     "title": "{title}",
     "description": "descrição completa do curso (mínimo 100 caracteres)",
@@ -424,7 +775,85 @@ ESTRUTURA JSON OBRIGATÓRIA:
     ],
     "learning_objectives": ["objetivo 1 claro", "objetivo 2 mensurável", "objetivo 3 específico"],
     "prerequisites": ["prerequisito 1", "prerequisito 2"]
-}}
+}}"""
+
+        prompt = f"""Você é um especialista pedagógico criando material didático de excelência a partir do PDF.
+
+Título do Curso: {title}
+Dificuldade: {difficulty}
+Público-alvo: {target_audience}
+
+TAREFA: Crie um curso educacional completo baseado EXCLUSIVAMENTE no conteúdo do PDF fornecido.
+
+INSTRUÇÕES CRÍTICAS:
+1. **DIVISÃO INTELIGENTE DO CONTEÚDO**:
+   - Analise todo o PDF e identifique 4-6 temas PRINCIPAIS e DISTINTOS
+   - Cada módulo deve cobrir um aspecto DIFERENTE do documento
+   - NÃO repita o mesmo conteúdo em vários módulos
+   - Organize progressivamente (básico → intermediário → avançado)
+
+2. **ESTRUTURA DE CADA MÓDULO** (OBRIGATÓRIA):
+   Módulo = 1 Lição + 1 Quiz
+   - PRIMEIRO: Lição (type: "lesson", order: número_ímpar)
+   - DEPOIS: Quiz sobre essa lição (type: "quiz", order: número_par)
+   - Exemplo: Lição (order: 1) → Quiz (order: 2) → Lição (order: 3) → Quiz (order: 4)
+
+3. **CRITICAL MICRO-LEARNING REQUIREMENTS**:
+   - Each lesson 'content' field: MINIMUM 800 characters with rich HTML structure
+   - Structure each lesson as:
+     * Title with <h2>📚 Main Topic Title</h2>
+     * Introduction paragraph with <p>Brief introduction explaining context</p>
+     * Core concepts with <h3>Key Concepts</h3> subsections
+     * Important terms: <strong>highlight with bold</strong>
+     * Technical terms: <em>mark in italics</em>
+     * Lists: use <ul> or <ol> for enumeration
+     * Tips/Warnings: <blockquote>💡 <strong>Important:</strong> Relevant information</blockquote>
+     * Tables: use <table> for comparisons and structured data
+     * Icons: use emojis for visual appeal (📊 📈 💡 ⚠️ ✅ ❌)
+     * Example structure:
+
+       <h2>📚 Lesson Topic</h2>
+       <p>Clear introduction to the concept.</p>
+
+       <h3>Core Principles</h3>
+       <p>The <strong>main concept</strong> is essential because it <em>defines the foundation</em> of understanding.</p>
+
+       <blockquote>💡 <strong>Key Point:</strong> This concept appears in 90% of practical applications.</blockquote>
+
+       <h3>📊 Comparison Table</h3>
+       <table>
+       <thead>
+       <tr><th>Method</th><th>Advantages</th><th>Disadvantages</th></tr>
+       </thead>
+       <tbody>
+       <tr>
+       <td><strong>Method A</strong></td>
+       <td>✅ Fast<br>✅ Efficient</td>
+       <td>❌ Complex<br>❌ Expensive</td>
+       </tr>
+       </tbody>
+       </table>
+
+       <h3>Key Takeaways</h3>
+       <ul>
+       <li><strong>First important point:</strong> detailed explanation</li>
+       <li><strong>Second critical concept:</strong> practical example</li>
+       <li><strong>Third essential idea:</strong> real application</li>
+       </ul>
+
+       <blockquote>⚠️ <strong>Note:</strong> This concept frequently appears in assessments!</blockquote>
+   - Focus on ONE main idea per lesson with rich visual structure
+   - Be comprehensive and well-formatted with semantic HTML
+   - Use 100% de fidelidade ao PDF - não invente informações
+   - Seja profissional mas acessível
+
+4. **QUIZZES**:
+   - Cada quiz deve ter exatamente 5 questões
+   - Questões testam COMPREENSÃO da lição correspondente
+   - Mix: 3 múltipla escolha + 2 verdadeiro/falso
+   - Cada questão deve ter explicação pedagógica
+
+{json_structure}
 
 REGRAS FINAIS OBRIGATÓRIAS:
 ✅ Retorne APENAS JSON válido (sem markdown, sem blocos de código)
@@ -435,23 +864,35 @@ REGRAS FINAIS OBRIGATÓRIAS:
 ✅ Exatamente 5 questões por quiz
 ✅ Fidelidade total ao conteúdo do PDF"""
 
-        response = await self.model.generate_content_async(
-            [uploaded_file, prompt],
-            generation_config={
-                "temperature": 0.8,  # ✅ CORREÇÃO 4: Aumentado de 0.4 para 0.8
-                "top_p": 0.85,
-                "top_k": 40,
-                "max_output_tokens": 32768,
-                "response_mime_type": "application/json"
-            }
-        )
+        return prompt
 
-        genai.delete_file(uploaded_file.name)
+    @stage_retry("course_generation")
+    async def generate_from_uploaded_file(
+        self,
+        uploaded_file,
+        title: str,
+        difficulty: str,
+        target_audience: str
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        prompt = self.build_pdf_prompt(title, difficulty, target_audience)
 
-        course_dict = self._parse_json(response.text)
+        response = await self._generate(
+            prompt,
+            generation_config=_structured(COURSE_GENERATION_CONFIG, COURSE_RESPONSE_SCHEMA),
+            document=uploaded_file,
+            cache_key=uploaded_file.name
+        )
+
+        repair_warnings: List[str] = []
+        course_dict, tokens_used, continuations = await self._course_from_response(
+            response, prompt, uploaded_file, uploaded_file.name, repair_warnings, title
+        )
+        repaired_modules = await self._repair_modules(
+            course_dict, title, difficulty, target_audience, uploaded_file, uploaded_file.name, tokens_used
+        )
 
         print("=" * 80)
-        print("DEBUG - JSON RECEBIDO DO GEMINI (upload_and_generate_from_pdf):")
+        print("DEBUG - JSON RECEBIDO DO GEMINI (generate_from_uploaded_file):")
         print(json.dumps(course_dict, indent=2, ensure_ascii=False))
         print("=" * 80)
 
@@ -459,23 +900,392 @@ REGRAS FINAIS OBRIGATÓRIAS:
             "provider": "gemini",
             "model": "gemini-2.5-flash",
             "generation_method": "pdf_upload",
-            "tokens_used": {
-                "input": response.usage_metadata.prompt_token_count,
-                "output": response.usage_metadata.candidates_token_count
-            },
+            "tokens_used": tokens_used,
+            "continuations": continuations,
+            "repaired_modules": repaired_modules,
             "cost_usd": 0.0,
             "generation_time_ms": 0,
             "confidence_score": 0.95,
-            "routing_reason": "gemini_pdf_upload"
+            "routing_reason": "gemini_pdf_upload",
+            "repair_warnings": repair_warnings
+        }
+
+        return (course_dict, metadata_dict)
+
+    def _course_source(self, uploaded_file=None, extracted: Optional[ExtractedContent] = None):
+        """Document prefix and context-cache key for a course from a PDF or extracted text"""
+        if uploaded_file is not None:
+            return uploaded_file, uploaded_file.name
+        return self._document_part(extracted.text), content_hash(extracted.text)
+
+    def build_outline_prompt(self, title: str, difficulty: str, target_audience: str) -> str:
+        return f"""Você é um especialista pedagógico planejando um curso a partir do DOCUMENTO ORIGINAL fornecido.
+
+Título do Curso: {title}
+Dificuldade: {difficulty}
+Público-alvo: {target_audience}
+
+TAREFA: Crie APENAS o esboço do curso (sem lições nem quizzes).
+- Divida o documento em 4-6 módulos com temas ÚNICOS e DISTINTOS
+- Organize progressivamente (básico → intermediário → avançado)
+- Para cada módulo, liste 3-5 tópicos-chave do documento que a lição deve cobrir
+
+ESTRUTURA JSON OBRIGATÓRIA:
+{{
+    "title": "{title}",
+    "description": "descrição completa do curso (mínimo 80 caracteres)",
+    "difficulty": "{difficulty}",
+    "estimated_hours": número_inteiro,
+    "points_per_completion": 100,
+    "modules": [
+        {{
+            "title": "Módulo 1: [Tema Único]",
+            "description": "descrição do módulo (mínimo 40 caracteres)",
+            "key_topics": ["tópico 1", "tópico 2", "tópico 3"]
+        }}
+    ],
+    "learning_objectives": ["objetivo1", "objetivo2", "objetivo3"],
+    "prerequisites": ["prerequisito1", "prerequisito2"]
+}}
+
+Retorne APENAS o JSON válido, sem markdown ou código."""
+
+    def build_module_prompt(
+        self,
+        title: str,
+        difficulty: str,
+        target_audience: str,
+        module: Dict[str, Any],
+        module_titles: list
+    ) -> str:
+        other_modules = "\n".join(f"- {t}" for t in module_titles if t != module.get("title"))
+        key_topics = "\n".join(f"- {t}" for t in module.get("key_topics", []))
+        json_structure = (
+            'FORMATO: {"activities": [lição, quiz]} conforme o schema estruturado da resposta.'
+            if settings.STRUCTURED_OUTPUT_ENABLED else
+            """ESTRUTURA JSON OBRIGATÓRIA:
+{
+    "activities": [
+        {
+            "title": "Lição: [título específico do tema]",
+            "content": "RICH HTML CONTENT (MINIMUM 800 characters)",
+            "duration_minutes": número_entre_5_e_15,
+            "type": "lesson",
+            "points": 10
+        },
+        {
+            "title": "Quiz: [mesmo tema da lição]",
+            "description": "Avaliação sobre [tema da lição]",
+            "type": "quiz",
+            "points": 10,
+            "duration_minutes": 15,
+            "questions": [
+                {
+                    "question": "Pergunta clara sobre o conteúdo da lição?",
+                    "options": ["A) Opção 1", "B) Opção 2", "C) Opção 3", "D) Opção 4"],
+                    "correct_answer": "A",
+                    "explanation": "Explicação pedagógica detalhada"
+                }
+            ]
+        }
+    ]
+}"""
+        )
+
+        return f"""Você é um especialista pedagógico escrevendo UM módulo de um curso, a partir do DOCUMENTO ORIGINAL fornecido.
+
+Curso: {title}
+Dificuldade: {difficulty}
+Público-alvo: {target_audience}
+
+MÓDULO A ESCREVER: {module.get("title", "")}
+{module.get("description", "")}
+
+Tópicos-chave deste módulo:
+{key_topics}
+
+Outros módulos do curso (NÃO repita o conteúdo deles):
+{other_modules}
+
+REQUISITOS:
+1. **LIÇÃO** (type: "lesson"):
+   - Campo 'content': MÍNIMO 800 caracteres em HTML rico e semântico
+   - Use <h2>📚 Título</h2>, <p>, <h3> para subseções, <strong>, <em>, <ul>/<ol>,
+     <blockquote>💡 <strong>Importante:</strong> ...</blockquote>, <table> para comparações e emojis (📊 📈 💡 ⚠️ ✅ ❌)
+   - Uma ideia principal por lição, 100% fiel ao documento - não invente informações
+2. **QUIZ** (type: "quiz"):
+   - Exatamente 5 questões sobre a lição, testando compreensão e não memorização
+   - Cada questão com "options", "correct_answer" e "explanation" pedagógica
+
+{json_structure}
+
+Retorne APENAS o JSON válido, sem markdown ou código."""
+
+    @stage_retry("section_generation")
+    async def _generate_json(
+        self,
+        prompt: str,
+        generation_config: Dict[str, Any],
+        document: Any,
+        cache_key: str,
+        validate: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Tuple[Dict[str, Any], Dict[str, int], List[str]]:
+        """One JSON call: (parsed data, token usage, repair warnings)"""
+        response = await self._generate(
+            prompt,
+            generation_config=generation_config,
+            document=document,
+            cache_key=cache_key
+        )
+        repair_warnings: List[str] = []
+        data = self._parse_json(response.text, repair_warnings, validate)
+        return data, self._token_usage(response), repair_warnings
+
+    def build_module_repair_prompt(
+        self,
+        title: str,
+        difficulty: str,
+        target_audience: str,
+        module: Dict[str, Any],
+        module_titles: list,
+        errors: List[str]
+    ) -> str:
+        issues = "\n".join(f"- {error}" for error in errors[:10])
+
+        # Mesmo prompt do modo paralelo (e o mesmo prefixo de documento), com os erros da versão rejeitada
+        return f"""{self.build_module_prompt(title, difficulty, target_audience, module, module_titles)}
+
+CORREÇÃO: a versão anterior deste módulo foi rejeitada pela validação:
+{issues}
+Gere novamente a lição e o quiz deste módulo corrigindo esses pontos e cumprindo todos os requisitos acima."""
+
+    async def _repair_modules(
+        self,
+        course_dict: Dict[str, Any],
+        title: str,
+        difficulty: str,
+        target_audience: str,
+        document: Any,
+        cache_key: Optional[str],
+        tokens_used: Dict[str, int]
+    ) -> List[int]:
+        """
+        Regenerate only the modules whose activities fail validation and splice them back.
+
+        Each such module gets one focused call (course outline as context,
+        validation errors in the prompt) that replaces its activities.
+        Returns the repaired module numbers. Raises ValueError, so the
+        stage retry reruns the whole course, when course or module fields
+        (e.g. a module title) are invalid, more than
+        MODULE_REPAIR_MAX_MODULES modules fail, or a repair is still invalid.
+        """
+        course_errors, module_errors = self._course_issues(course_dict)
+        if course_errors:
+            raise ValueError(f"Invalid course: {'; '.join(course_errors[:5])}")
+        if not module_errors:
+            return []
+        if len(module_errors) > settings.MODULE_REPAIR_MAX_MODULES:
+            raise ValueError(f"{len(module_errors)} invalid modules, too many for targeted repair")
+
+        modules = course_dict["modules"]
+        module_titles = [module.get("title", "") for module in modules]
+        indexes = sorted(module_errors)
+        logger.warning(
+            f"🩺 Regenerating invalid module(s) {[index + 1 for index in indexes]}: "
+            + "; ".join(f"{index + 1}) {module_errors[index][0]}" for index in indexes)
+        )
+
+        async def repair(index: int):
+            return await self._generate_json(
+                self.build_module_repair_prompt(
+                    title, difficulty, target_audience, modules[index], module_titles, module_errors[index]
+                ),
+                _structured(MODULE_GENERATION_CONFIG, MODULE_RESPONSE_SCHEMA),
+                document,
+                cache_key,
+                validate=self._validate_module
+            )
+
+        results = await asyncio.gather(*(repair(index) for index in indexes))
+        for index, (module_data, usage, _) in zip(indexes, results):
+            for key, value in usage.items():
+                tokens_used[key] = tokens_used.get(key, 0) + value
+            modules[index]["activities"] = module_data.get("activities") or []
+
+        self._renumber(modules)
+        course_errors, module_errors = self._course_issues(course_dict)
+        if course_errors or module_errors:
+            raise ValueError(f"Targeted repair left invalid modules {[index + 1 for index in sorted(module_errors)]}")
+
+        logger.info(f"✅ Repaired {len(indexes)} module(s) without regenerating the course")
+        return [index + 1 for index in indexes]
+
+    async def generate_course_parallel(
+        self,
+        title: str,
+        difficulty: str,
+        target_audience: str,
+        uploaded_file=None,
+        extracted: Optional[ExtractedContent] = None
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Two-phase generation: a short outline call, then lesson + quiz for
+        every module concurrently (bounded by MODULE_GENERATION_CONCURRENCY).
+
+        Each call is retried on its own, so one failed module does not
+        regenerate the others. Every call shares the same document prefix
+        (and context cache). The result has the same shape as generate_course.
+        """
+        document, cache_key = self._course_source(uploaded_file, extracted)
+
+        outline, outline_usage, repair_warnings = await self._generate_json(
+            self.build_outline_prompt(title, difficulty, target_audience),
+            OUTLINE_GENERATION_CONFIG,
+            document,
+            cache_key
+        )
+        outline_modules = outline.get("modules") or []
+        if not outline_modules:
+            raise ValueError("Course outline has no modules")
+
+        logger.info(f"🗺️ Outline ready: {len(outline_modules)} modules, generating in parallel")
+
+        module_titles = [m.get("title", "") for m in outline_modules]
+        semaphore = asyncio.Semaphore(max(1, settings.MODULE_GENERATION_CONCURRENCY))
+
+        async def generate_module(module: Dict[str, Any]):
+            async with semaphore:
+                return await self._generate_json(
+                    self.build_module_prompt(title, difficulty, target_audience, module, module_titles),
+                    _structured(MODULE_GENERATION_CONFIG, MODULE_RESPONSE_SCHEMA),
+                    document,
+                    cache_key,
+                    validate=self._validate_module
+                )
+
+        results = await asyncio.gather(*(generate_module(m) for m in outline_modules))
+
+        tokens_used = dict(outline_usage)
+        modules = []
+        for index, (module, (module_data, usage, module_warnings)) in enumerate(zip(outline_modules, results)):
+            for key, value in usage.items():
+                tokens_used[key] = tokens_used.get(key, 0) + value
+            repair_warnings.extend(f"Module {index + 1}: {warning}" for warning in module_warnings)
+
+            modules.append({
+                "title": module.get("title", f"Módulo {index + 1}"),
+                "description": module.get("description", ""),
+                "activities": module_data.get("activities") or []
+            })
+        self._renumber(modules)
+
+        course_dict = {key: value for key, value in outline.items() if key != "modules"}
+        course_dict["modules"] = modules
+        repaired_modules = await self._repair_modules(
+            course_dict, title, difficulty, target_audience, document, cache_key, tokens_used
+        )
+
+        metadata_dict = {
+            "provider": "gemini",
+            "model": "gemini-2.5-flash",
+            "generation_method": "pdf_upload_parallel" if uploaded_file is not None else "direct_json_parallel",
+            "tokens_used": tokens_used,
+            "repaired_modules": repaired_modules,
+            "cost_usd": 0.0,
+            "generation_time_ms": 0,
+            "confidence_score": 0.95 if uploaded_file is not None else 0.9,
+            "routing_reason": "gemini_pdf_upload" if uploaded_file is not None else "gemini_service",
+            "repair_warnings": repair_warnings
         }
 
         return (course_dict, metadata_dict)
 
-    async def generate_quiz(self, module_content: str, module_title: str, difficulty: str) -> dict:
+    async def stream_course(
+        self,
+        title: str,
+        difficulty: str,
+        target_audience: str,
+        uploaded_file=None,
+        extracted: Optional[ExtractedContent] = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Stream course generation from an uploaded PDF or extracted text.
+
+        Yields ("module", module_dict) as soon as each module is complete,
+        then ("course", (course_dict, metadata_dict)) once the whole JSON
+        has arrived. There is no retry: modules may already be delivered.
+        """
+        document, cache_key = self._course_source(uploaded_file, extracted)
+        if uploaded_file is not None:
+            prompt = self.build_pdf_prompt(title, difficulty, target_audience)
+            method, confidence, reason = "pdf_upload_stream", 0.95, "gemini_pdf_upload"
+        else:
+            prompt = self.build_prompt(title, difficulty, target_audience)
+            method, confidence, reason = "direct_json_stream", 0.9, "gemini_service"
+
+        response = await self._generate(
+            prompt,
+            generation_config=_structured(COURSE_GENERATION_CONFIG, COURSE_RESPONSE_SCHEMA),
+            document=document,
+            cache_key=cache_key,
+            stream=True
+        )
+
+        modules = ArrayItemStream("modules")
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # chunk without text parts (e.g. only a finish reason)
+                continue
+            for module in modules.feed(text):
+                yield "module", module
+
+        repair_warnings: List[str] = []
+        course_dict = self._parse_json(modules.text, repair_warnings)
+
+        metadata_dict = {
+            "provider": "gemini",
+            "model": "gemini-2.5-flash",
+            "generation_method": method,
+            "tokens_used": self._token_usage(response),
+            "cost_usd": 0.0,
+            "generation_time_ms": 0,
+            "confidence_score": confidence,
+            "routing_reason": reason,
+            "repair_warnings": repair_warnings
+        }
+
+        yield "course", (course_dict, metadata_dict)
+
+    async def generate_quiz(
+        self,
+        module_content: str,
+        module_title: str,
+        difficulty: str,
+        uploaded_file=None,
+        use_cache: bool = True
+    ) -> dict:
+        """
+        Generate a 5-question quiz; `uploaded_file` adds the source PDF as context.
+
+        Results are cached by (module content as sent, title, difficulty) when
+        QUIZ_CACHE_ENABLED; `use_cache=False` regenerates and replaces the entry.
+        """
+        module_content = module_content[:QUIZ_CONTENT_BUDGET]
+        cache_key = content_hash(module_content, module_title, difficulty)
+        use_cache = use_cache and settings.QUIZ_CACHE_ENABLED
+
+        if use_cache:
+            cached = await self.quiz_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"♻️ Quiz cache hit for '{module_title}' ({difficulty})")
+                return cached
+
         prompt = f"""Você é um especialista em avaliação educacional.
 
 CONTEÚDO DO MÓDULO: {module_title}
-{module_content[:2000]}
+{module_content}
 
 TAREFA: Gere 5 questões de avaliação no formato JSON EXATO:
 
@@ -504,24 +1314,158 @@ REGRAS:
 - Explicações pedagógicas claras
 - RETORNE APENAS O JSON"""
 
-        response = await self.model.generate_content_async(
+        response = await self._generate(
             prompt,
-            generation_config={"temperature": 0.7, "response_mime_type": "application/json"}
+            generation_config={"temperature": 0.7, "response_mime_type": "application/json"},
+            document=uploaded_file,
+            cache_key=uploaded_file.name if uploaded_file else None
+        )
+
+        quiz_data = self._parse_json(response.text)
+        if settings.QUIZ_CACHE_ENABLED and quiz_data.get("questions"):
+            await self.quiz_cache.set(cache_key, quiz_data)
+        return quiz_data
+
+    def build_quiz_batch_prompt(self, modules: List[Dict[str, str]], difficulty: str) -> str:
+        sections = "\n\n".join(
+            f"MÓDULO {number}: {module['title']}\n{module['content']}"
+            for number, module in enumerate(modules)
+        )
+
+        return f"""Você é um especialista em avaliação educacional.
+
+{sections}
+
+TAREFA: Para CADA módulo acima, gere 5 questões de avaliação no formato JSON EXATO:
+
+{{
+  "quizzes": [
+    {{
+      "module": 0,
+      "questions": [
+        {{
+          "type": "multiple_choice",
+          "question": "Pergunta clara e objetiva?",
+          "options": ["A) Opção 1", "B) Opção 2", "C) Opção 3", "D) Opção 4"],
+          "correct_answer": "A",
+          "explanation": "Por que A está correta"
+        }},
+        {{
+          "type": "true_false",
+          "question": "Afirmação para julgar",
+          "correct_answer": true,
+          "explanation": "Justificativa"
+        }}
+      ]
+    }}
+  ]
+}}
+
+REGRAS:
+- Exatamente um item em "quizzes" para cada módulo, com "module" igual ao número do módulo
+- Por módulo: 3 questões multiple_choice, 2 true_false, apenas sobre o conteúdo daquele módulo
+- Dificuldade: {difficulty}
+- Questões devem testar compreensão
+- Explicações pedagógicas claras
+- RETORNE APENAS O JSON"""
+
+    async def generate_quiz_batch(
+        self,
+        modules: List[Dict[str, str]],
+        difficulty: str,
+        uploaded_file=None,
+        use_cache: bool = True
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Quizzes for many modules ({"title", "content"}) with few model calls.
+
+        Cache misses are packed into calls of up to QUIZ_BATCH_MAX_MODULES
+        modules and QUIZ_BATCH_TOKEN_BUDGET input tokens, run concurrently
+        (QUIZ_BATCH_CONCURRENCY). A module left out of a packed answer gets
+        its own generate_quiz call. Returns one {"questions"} or {"error"}
+        entry per module, in order, and the number of packed calls made.
+        """
+        use_cache = use_cache and settings.QUIZ_CACHE_ENABLED
+        results: List[Optional[Dict[str, Any]]] = [None] * len(modules)
+
+        # (position in `modules`, module as sent, cache key)
+        pending: List[Tuple[int, Dict[str, str], str]] = []
+        for index, module in enumerate(modules):
+            sent = {"title": module["title"], "content": module["content"][:QUIZ_CONTENT_BUDGET]}
+            cache_key = content_hash(sent["content"], sent["title"], difficulty)
+            cached = await self.quiz_cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                results[index] = cached
+            else:
+                pending.append((index, sent, cache_key))
+
+        packs: List[List[Tuple[int, Dict[str, str], str]]] = []
+        char_budget = settings.QUIZ_BATCH_TOKEN_BUDGET * 4
+        for item in pending:
+            size = len(item[1]["content"]) + len(item[1]["title"])
+            if (
+                not packs
+                or len(packs[-1]) >= settings.QUIZ_BATCH_MAX_MODULES
+                or sum(len(m["content"]) + len(m["title"]) for _, m, _ in packs[-1]) + size > char_budget
+            ):
+                packs.append([])
+            packs[-1].append(item)
+
+        logger.info(
+            f"📝 Quiz batch: {len(modules)} modules, {len(modules) - len(pending)} cached, "
+            f"{len(packs)} model calls"
         )
 
-        return json.loads(response.text)
+        semaphore = asyncio.Semaphore(max(1, settings.QUIZ_BATCH_CONCURRENCY))
+
+        async def generate_pack(pack: List[Tuple[int, Dict[str, str], str]]) -> None:
+            async with semaphore:
+                try:
+                    data, _, _ = await self._generate_json(
+                        self.build_quiz_batch_prompt([module for _, module, _ in pack], difficulty),
+                        QUIZ_BATCH_GENERATION_CONFIG,
+                        uploaded_file,
+                        uploaded_file.name if uploaded_file else None
+                    )
+                except Exception as e:
+                    logger.error(f"❌ Quiz batch call failed ({len(pack)} modules): {e}")
+                    for index, _, _ in pack:
+                        results[index] = {"error": str(e)}
+                    return
+
+            answered: Dict[int, list] = {}
+            for quiz in data.get("quizzes") or []:
+                try:
+                    answered[int(quiz.get("module"))] = quiz.get("questions") or []
+                except (AttributeError, TypeError, ValueError):
+                    continue
+
+            for number, (index, module, cache_key) in enumerate(pack):
+                questions = answered.get(number)
+                if questions:
+                    results[index] = {"questions": questions}
+                    if settings.QUIZ_CACHE_ENABLED:
+                        await self.quiz_cache.set(cache_key, results[index])
+                    continue
+
+                logger.warning(f"⚠️ Module '{module['title']}' missing from quiz batch, generating alone")
+                try:
+                    results[index] = await self.generate_quiz(
+                        module["content"], module["title"], difficulty, uploaded_file, use_cache=False
+                    )
+                except Exception as e:
+                    results[index] = {"error": str(e)}
+
+        await asyncio.gather(*(generate_pack(pack) for pack in packs))
+        return results, len(packs)
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((Exception,)),
-        reraise=True
-    )
     async def generate_final_challenge_questions(
         self,
         course_content: str,
         course_title: str,
-        course_modules: list
+        course_modules: list,
+        uploaded_file=None,
+        mode: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Gera 30 questões para o Desafio Final distribuídas em 3 níveis de dificuldade:
@@ -530,6 +1474,12 @@ REGRAS:
         - 10 questões difíceis (nível hard)
 
         As questões são baseadas em TODO o conteúdo do curso.
+        Se `uploaded_file` for informado, o PDF original já processado é
+        enviado junto como contexto (sem novo upload).
+
+        No modo "parallel" (padrão, FINAL_CHALLENGE_MODE) cada nível é uma
+        chamada própria e concorrente, com retry independente; no modo
+        "single" os 30 vêm de uma única chamada.
         """
 
         # Extrair conteúdo das lições para contexto
@@ -545,6 +1495,33 @@ REGRAS:
         # Limitar conteúdo para não exceder tokens
         limited_content = (course_content[:5000] + lessons_content[:5000]) if len(course_content) > 5000 else course_content + lessons_content
 
+        if (mode or settings.FINAL_CHALLENGE_MODE) == "parallel":
+            tiers = await asyncio.gather(*(
+                self._generate_final_challenge_tier(tier, course_title, limited_content, uploaded_file)
+                for tier in FINAL_CHALLENGE_TIERS
+            ))
+            questions_dict = {f"{tier}_questions": questions for tier, questions in zip(FINAL_CHALLENGE_TIERS, tiers)}
+        else:
+            questions_dict = await self._generate_final_challenge_single(
+                course_title, limited_content, uploaded_file
+            )
+
+        print("=" * 80)
+        print("DEBUG - DESAFIO FINAL GERADO (30 questões):")
+        print(f"Easy: {len(questions_dict.get('easy_questions', []))} questões")
+        print(f"Medium: {len(questions_dict.get('medium_questions', []))} questões")
+        print(f"Hard: {len(questions_dict.get('hard_questions', []))} questões")
+        print("=" * 80)
+
+        return questions_dict
+
+    @stage_retry("final_challenge")
+    async def _generate_final_challenge_single(
+        self,
+        course_title: str,
+        limited_content: str,
+        uploaded_file=None
+    ) -> Dict[str, Any]:
         prompt = f"""Você é um especialista pedagógico criando o DESAFIO FINAL de um curso educacional.
 
 TÍTULO DO CURSO: {course_title}
@@ -641,27 +1618,123 @@ IMPORTANTE: As questões devem seguir uma progressão pedagógica clara:
 - Medium: "COMO aplicar?" (compreensão/aplicação)
 - Hard: "POR QUE e QUANDO?" (análise/síntese/avaliação)"""
 
-        response = await self.model.generate_content_async(
+        response = await self._generate(
             prompt,
-            generation_config={
-                "temperature": 0.85,  # Criatividade para gerar questões variadas
-                "top_p": 0.9,
-                "top_k": 40,
-                "max_output_tokens": 32768,
-                "response_mime_type": "application/json"
-            }
+            generation_config=FINAL_CHALLENGE_GENERATION_CONFIG,
+            document=uploaded_file,
+            cache_key=uploaded_file.name if uploaded_file else None
         )
 
-        questions_dict = self._parse_json(response.text)
+        if not self._hit_token_limit(response):
+            return self._parse_json(response.text)
 
-        print("=" * 80)
-        print("DEBUG - DESAFIO FINAL GERADO (30 questões):")
-        print(f"Easy: {len(questions_dict.get('easy_questions', []))} questões")
-        print(f"Medium: {len(questions_dict.get('medium_questions', []))} questões")
-        print(f"Hard: {len(questions_dict.get('hard_questions', []))} questões")
-        print("=" * 80)
+        # Saída cortada: mantém as questões completas e completa cada nível separadamente
+        partial = {
+            tier: self._complete_items(response.text, f"{tier}_questions") for tier in FINAL_CHALLENGE_TIERS
+        }
+        logger.info(
+            "✂️ Final challenge output hit max_output_tokens "
+            f"({', '.join(f'{tier}={len(questions)}' for tier, questions in partial.items())}), completing tiers"
+        )
+        tiers = await asyncio.gather(*(
+            self._generate_final_challenge_tier(tier, course_title, limited_content, uploaded_file, existing=questions)
+            for tier, questions in partial.items()
+        ))
+        return {f"{tier}_questions": questions for tier, questions in zip(FINAL_CHALLENGE_TIERS, tiers)}
 
-        return questions_dict
+    async def _generate_final_challenge_tier(
+        self,
+        tier: str,
+        course_title: str,
+        limited_content: str,
+        uploaded_file=None,
+        existing: Optional[list] = None
+    ) -> list:
+        """
+        Generate the 10 questions of one difficulty tier.
+
+        `existing` questions are kept and only the missing ones are requested;
+        output cut at max_output_tokens is continued the same way. Each call
+        is retried on its own, so a failure keeps the questions already made.
+        """
+        spec = FINAL_CHALLENGE_TIERS[tier]
+
+        # Parte comum primeiro, para que as 3 chamadas compartilhem o mesmo prefixo
+        prompt = f"""Você é um especialista pedagógico criando o DESAFIO FINAL de um curso educacional.
+
+TÍTULO DO CURSO: {course_title}
+
+CONTEÚDO COMPLETO DO CURSO:
+{limited_content}
+
+TAREFA CRÍTICA:
+O Desafio Final tem 30 questões em 3 níveis (fácil, médio, difícil).
+Crie AGORA APENAS as 10 questões do nível {spec["label"]}:
+{spec["guidelines"]}
+
+FORMATO JSON OBRIGATÓRIO:
+{{
+    "questions": [
+        {{
+            "question": "Pergunta do nível {spec["label"].lower()}?",
+            "options": [
+                "A) ...",
+                "B) ...",
+                "C) ...",
+                "D) ..."
+            ],
+            "correct_answer": "A",
+            "explanation": "Explicação pedagógica detalhada referenciando o conteúdo do curso",
+            "points": {spec["points"]}
+        }}
+        // ... total de 10 questões
+    ]
+}}
 
+REGRAS CRÍTICAS:
+✅ EXATAMENTE 10 questões
+✅ Todas as questões devem ter 4 opções (A, B, C, D)
+✅ Cada questão deve ter explicação pedagógica DETALHADA (mínimo 100 caracteres)
+✅ As questões devem cobrir TODOS os módulos do curso de forma equilibrada
+✅ Evite questões muito similares - cada uma deve testar um aspecto diferente
+✅ As opções incorretas devem ser plausíveis (não obviamente erradas)
+✅ Pontos: {spec["points"]} por questão
+✅ Retorne APENAS o JSON válido (sem markdown, sem blocos de código)"""
+
+        questions = list(existing or [])
+        for continuation in range(settings.GENERATION_MAX_CONTINUATIONS + 1):
+            missing = FINAL_CHALLENGE_TIER_SIZE - len(questions)
+            if missing <= 0:
+                break
+
+            request = prompt
+            if questions:
+                done = "\n".join(f"- {question.get('question', '')}" for question in questions)
+                request += f"""
+
+CONTINUAÇÃO: estas {len(questions)} questões JÁ FORAM CRIADAS e NÃO devem ser repetidas:
+{done}
+
+Crie APENAS as {missing} questões restantes deste nível, no mesmo formato JSON."""
+
+            new_questions, truncated, _, _ = await self._generate_items(
+                request,
+                "questions",
+                generation_config=FINAL_CHALLENGE_TIER_CONFIG,
+                document=uploaded_file,
+                cache_key=uploaded_file.name if uploaded_file else None,
+                required=True
+            )
+            if truncated:
+                logger.info(f"✂️ {tier} questions hit max_output_tokens with {len(new_questions)} complete")
+
+            seen = {question.get("question") for question in questions}
+            questions.extend([q for q in new_questions if q.get("question") not in seen][:missing])
+            if not truncated or not new_questions:
+                break
+
+        if not questions:
+            raise ValueError(f"No {tier} questions in final challenge response")
+        return questions
 
 gemini_service = GeminiService()
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""Persistent store of completed course generations, for replay after client timeouts"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import sqlalchemy as sa
+
+from app.config import settings
+from app.utils.cache import content_hash
+
+logger = logging.getLogger(__name__)
+
+_metadata = sa.MetaData()
+
+generation_results = sa.Table(
+    "generation_results",
+    _metadata,
+    sa.Column("result_id", sa.String(255), primary_key=True),  # task id, Idempotency-Key or random id
+    sa.Column("fingerprint", sa.String(64), nullable=False, index=True),
+    sa.Column("kind", sa.String(32), nullable=False),
+    sa.Column("etag", sa.String(80), nullable=False),
+    sa.Column("body", sa.Text, nullable=False),
+    sa.Column("created_at", sa.Float, nullable=False, index=True)
+)
+
+
+@dataclass
+class StoredResult:
+    result_id: str
+    fingerprint: str
+    kind: str
+    etag: str
+    body: str  # serialized response, served as-is
+    created_at: float
+
+    def payload(self) -> Dict[str, Any]:
+        return json.loads(self.body)
+
+
+class ResultStore:
+    """
+    Completed CourseGenerationResponse payloads, kept for RESULT_STORE_TTL_SECONDS.
+
+    Laravel's HTTP client gives up after 300 s while the generation here
+    usually still finishes; storing the response lets the retry (same
+    fingerprint) or a GET by job id return it instead of generating again.
+    Uses DATABASE_URL when set, otherwise a SQLite file at RESULT_STORE_PATH.
+    Store errors are logged and never fail a generation.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        ttl_seconds: int = settings.RESULT_STORE_TTL_SECONDS
+    ):
+        self.url = url or settings.DATABASE_URL or f"sqlite:///{settings.RESULT_STORE_PATH}"
+        self.ttl_seconds = ttl_seconds
+        self._engine: Optional[sa.engine.Engine] = None
+        self._engine_lock = threading.Lock()
+        self.saved = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sa.engine.Engine:
+        with self._engine_lock:
+            if self._engine is None:
+                url = sa.engine.make_url(self.url)
+                connect_args = {}
+                if url.get_backend_name() == "sqlite":
+                    directory = os.path.dirname(url.database or "")
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    connect_args["check_same_thread"] = False
+                self._engine = sa.create_engine(url, pool_pre_ping=True, connect_args=connect_args)
+                _metadata.create_all(self._engine)
+            return self._engine
+
+    async def save(
+        self,
+        kind: str,
+        fingerprint: str,
+        payload: Dict[str, Any],
+        result_id: Optional[str] = None
+    ) -> Optional[StoredResult]:
+        """Store a finished response under `result_id` (random when omitted) and its fingerprint"""
+        body = json.dumps(payload, ensure_ascii=False, default=str)
+        result = StoredResult(
+            result_id=result_id or uuid.uuid4().hex,
+            fingerprint=fingerprint,
+            kind=kind,
+            etag=f'"{content_hash(body)[:32]}"',
+            body=body,
+            created_at=time.time()
+        )
+
+        def write():
+            with self._connect().begin() as connection:
+                connection.execute(
+                    generation_results.delete().where(
+                        (generation_results.c.result_id == result.result_id)
+                        | (generation_results.c.created_at < result.created_at - self.ttl_seconds)
+                    )
+                )
+                connection.execute(generation_results.insert().values(**result.__dict__))
+
+        try:
+            await asyncio.to_thread(write)
+        except Exception as e:
+            logger.error(f"❌ Could not store {kind} result {result.result_id}: {e}")
+            return None
+
+        self.saved += 1
+        logger.info(f"💾 Stored {kind} result {result.result_id} ({len(body) / 1024:.0f} KB)")
+        return result
+
+    async def get(self, key: str) -> Optional[StoredResult]:
+        """Latest unexpired result whose id or fingerprint is `key`"""
+        def read():
+            query = (
+                sa.select(generation_results)
+                .where(
+                    (generation_results.c.result_id == key) | (generation_results.c.fingerprint == key),
+                    generation_results.c.created_at >= time.time() - self.ttl_seconds
+                )
+                .order_by(generation_results.c.created_at.desc())
+                .limit(1)
+            )
+            with self._connect().connect() as connection:
+                return connection.execute(query).first()
+
+        try:
+            row = await asyncio.to_thread(read)
+        except Exception as e:
+            logger.error(f"❌ Result store lookup failed: {e}")
+            return None
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return StoredResult(**row._asdict())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": sa.engine.make_url(self.url).get_backend_name(),
+            "saved": self.saved,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def close(self) -> None:
+        with self._engine_lock:
+            if self._engine is not None:
+                self._engine.dispose()
+                self._engine = None
+
+
+result_store = ResultStore()
@@ -0,0 +1,284 @@
+"""Local asyncio task queue for long-running generations"""
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.config import settings
+from app.services.webhooks import webhook_outbox
+
+logger = logging.getLogger(__name__)
+
+# Progress reported when a course pipeline stage starts
+STAGE_PROGRESS = {
+    "estimate": 5,
+    "routing": 8,
+    "upload": 10,
+    "extraction": 12,
+    "processing": 18,
+    "generation": 25,
+    "final_challenge": 80
+}
+
+# Events kept per task for subscribers that connect late
+MAX_TASK_EVENTS = 100
+
+
+class TaskQueueFullError(RuntimeError):
+    """Raised when TASK_QUEUE_MAX_PENDING tasks are already queued"""
+
+
+@dataclass
+class Task:
+    task_id: str
+    task_type: str  # course | quiz | final_challenge
+    created_at: datetime
+    updated_at: datetime
+    status: str = "queued"  # queued | processing | completed | failed
+    progress: int = 0
+    stage: Optional[str] = None
+    result: Any = None
+    error: Optional[str] = None
+    callback_url: Optional[str] = None  # completion webhook target, if any
+    estimated_seconds: Optional[int] = None  # RoutingDecision.estimated_time_seconds
+    started_at: Optional[float] = None
+    events: List[Dict[str, Any]] = field(default_factory=list, repr=False)
+    _subscribers: List[asyncio.Queue] = field(default_factory=list, repr=False)
+
+    def set_progress(self, progress: int, stage: Optional[str] = None) -> None:
+        """Move progress forward (never backwards) and record the current stage"""
+        self.progress = max(self.progress, min(progress, 99))
+        self.updated_at = datetime.utcnow()
+        if stage is not None and stage != self.stage:
+            self.stage = stage
+            self.publish("stage")
+
+    def set_estimate(self, seconds: int) -> None:
+        """StageTimer hook: total duration estimated by the router"""
+        self.estimated_seconds = seconds
+        self.publish("estimate")
+
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self.started_at if self.started_at else 0.0
+
+    def eta_seconds(self) -> Optional[int]:
+        if self.status in ("completed", "failed"):
+            return 0
+        if self.estimated_seconds is None:
+            return None
+        return max(0, round(self.estimated_seconds - self.elapsed_seconds()))
+
+    def publish(self, event: str, **data: Any) -> None:
+        """Record an event and push it to every live subscriber"""
+        payload = {
+            "event": event,
+            "task_id": self.task_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "timestamp": datetime.utcnow().isoformat(),
+            "elapsed_ms": int(self.elapsed_seconds() * 1000),
+            "eta_seconds": self.eta_seconds(),
+            **data
+        }
+        self.events.append(payload)
+        del self.events[:-MAX_TASK_EVENTS]
+        for queue in self._subscribers:
+            queue.put_nowait(payload)
+
+    def subscribe(self):
+        """Return (events so far, queue of future events); call unsubscribe when done"""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        return list(self.events), queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def on_stage(self, stage: str) -> None:
+        """StageTimer hook: map pipeline stages to progress"""
+        self.set_progress(STAGE_PROGRESS.get(stage, self.progress), stage)
+
+    def to_payload(self) -> Dict[str, Any]:
+        """Webhook body (same fields as TaskStatusResponse, plus the event name)"""
+        result = self.result.model_dump() if hasattr(self.result, "model_dump") else self.result
+        return {
+            "event": f"task.{self.status}",
+            "task_id": self.task_id,
+            "task_type": self.task_type,
+            "status": self.status,
+            "progress": self.progress,
+            "result": result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat()
+        }
+
+
+TaskHandler = Callable[[Task], Awaitable[Any]]
+
+
+@dataclass
+class _QueuedTask:
+    task: Task
+    handler: TaskHandler
+    cleanup: List[Callable[[], None]] = field(default_factory=list)
+
+
+class TaskQueue:
+    """
+    In-process job queue served by TASK_QUEUE_WORKERS asyncio workers.
+
+    Generation is I/O bound (LLM and File API calls) and PDF extraction
+    already runs in its own process pool, so workers are coroutines on the
+    service's event loop: they share the file registry, context cache and
+    extraction pool with the synchronous endpoints, and an HTTP request
+    only lives as long as it takes to enqueue.
+    """
+
+    def __init__(
+        self,
+        workers: int = settings.TASK_QUEUE_WORKERS,
+        max_pending: int = settings.TASK_QUEUE_MAX_PENDING,
+        ttl_seconds: int = settings.TASK_RESULT_TTL_SECONDS
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._tasks: Dict[str, Task] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    def submit(
+        self,
+        task_type: str,
+        handler: TaskHandler,
+        cleanup: Optional[Callable[[], None]] = None,
+        callback_url: Optional[str] = None
+    ) -> Task:
+        """
+        Enqueue `handler(task)`; its return value becomes the task result.
+
+        `cleanup` always runs once the task is finished (or discarded).
+        With a `callback_url`, the final status is delivered as a webhook.
+        """
+        if self._queue is None:
+            raise RuntimeError("Task queue is not running")
+        if self._queue.qsize() >= self.max_pending:
+            raise TaskQueueFullError(f"{self._queue.qsize()} tasks already queued")
+
+        self._prune()
+
+        now = datetime.utcnow()
+        task = Task(
+            task_id=uuid.uuid4().hex,
+            task_type=task_type,
+            created_at=now,
+            updated_at=now,
+            callback_url=callback_url
+        )
+        self._tasks[task.task_id] = task
+        self._queue.put_nowait(_QueuedTask(task, handler, [cleanup] if cleanup else []))
+
+        logger.info(f"📋 Task {task.task_id} queued ({task_type}, {self._queue.qsize()} waiting)")
+        return task
+
+    def get(self, task_id: str) -> Optional[Task]:
+        return self._tasks.get(task_id)
+
+    async def _worker(self, number: int) -> None:
+        while True:
+            queued = await self._queue.get()
+            try:
+                await self._execute(queued)
+            finally:
+                self._queue.task_done()
+
+    async def _execute(self, queued: _QueuedTask) -> None:
+        task = queued.task
+        task.status = "processing"
+        task.started_at = time.monotonic()
+        task.set_progress(1)
+        task.publish("status")
+        logger.info(f"⚙️ Task {task.task_id} started ({task.task_type})")
+
+        try:
+            task.result = await queued.handler(task)
+            task.status = "completed"
+            task.progress = 100
+            logger.info(f"✅ Task {task.task_id} completed")
+        except asyncio.CancelledError:
+            task.status = "failed"
+            task.error = "Task cancelled (service shutting down)"
+            task.publish("failed", error=task.error)
+            raise
+        except Exception as e:
+            task.status = "failed"
+            task.error = str(e)
+            logger.error(f"❌ Task {task.task_id} failed: {e}")
+        finally:
+            task.updated_at = datetime.utcnow()
+            self._cleanup(queued)
+
+        if task.status == "completed":
+            task.publish("completed", result=task.to_payload()["result"])
+        else:
+            task.publish("failed", error=task.error)
+
+        await self._notify(task)
+
+    async def _notify(self, task: Task) -> None:
+        if task.callback_url:
+            try:
+                await webhook_outbox.enqueue(task.callback_url, task.to_payload())
+            except Exception as e:
+                logger.error(f"❌ Could not queue webhook for task {task.task_id}: {e}")
+
+    def _cleanup(self, queued: _QueuedTask) -> None:
+        for cleanup in queued.cleanup:
+            try:
+                cleanup()
+            except Exception as e:
+                logger.warning(f"⚠️ Task {queued.task.task_id} cleanup failed: {e}")
+
+    def _prune(self) -> None:
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        expired = [
+            task_id for task_id, task in self._tasks.items()
+            if task.status in ("completed", "failed") and task.updated_at < cutoff
+        ]
+        for task_id in expired:
+            del self._tasks[task_id]
+
+    def start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._workers = [
+                asyncio.create_task(self._worker(number)) for number in range(max(1, self.workers))
+            ]
+
+    async def stop(self) -> None:
+        """Cancel running tasks and drop queued ones (called on application shutdown)"""
+        if self._queue is None:
+            return
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+        while not self._queue.empty():
+            queued = self._queue.get_nowait()
+            queued.task.status = "failed"
+            queued.task.error = "Task cancelled (service shutting down)"
+            queued.task.publish("failed", error=queued.task.error)
+            self._cleanup(queued)
+
+        self._queue = None
+        self._workers = []
+
+
+task_queue = TaskQueue()
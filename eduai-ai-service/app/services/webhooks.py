@@ -0,0 +1,268 @@
+"""Signed completion webhooks to Laravel with a persistent outbox"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-EduAI-Signature"
+TIMESTAMP_HEADER = "X-EduAI-Timestamp"
+DELIVERY_HEADER = "X-EduAI-Delivery"
+
+
+class InvalidCallbackURLError(ValueError):
+    """Raised for callback URLs outside LARAVEL_API_URL / WEBHOOK_ALLOWED_HOSTS"""
+
+
+def resolve_callback_url(callback_url: Optional[str]) -> Optional[str]:
+    """
+    Turn a request's callback_url into the URL to deliver to.
+
+    Paths ("/api/...") are joined to LARAVEL_API_URL; without a callback_url
+    WEBHOOK_DEFAULT_PATH is used (empty = no webhook). Absolute URLs must
+    point to the Laravel host or one of WEBHOOK_ALLOWED_HOSTS.
+    """
+    callback_url = callback_url or settings.WEBHOOK_DEFAULT_PATH
+    if not callback_url:
+        return None
+
+    if callback_url.startswith("/"):
+        return settings.LARAVEL_API_URL.rstrip("/") + callback_url
+
+    parsed = urlparse(callback_url)
+    allowed = {urlparse(settings.LARAVEL_API_URL).hostname}
+    allowed.update(host.strip() for host in settings.WEBHOOK_ALLOWED_HOSTS.split(",") if host.strip())
+    if parsed.scheme not in ("http", "https") or parsed.hostname not in allowed:
+        raise InvalidCallbackURLError(f"Callback host not allowed: {parsed.hostname or callback_url}")
+    return callback_url
+
+
+def sign(body: bytes, timestamp: str, secret: str) -> str:
+    """HMAC-SHA256 over "<timestamp>.<body>"; Laravel recomputes it with LARAVEL_API_SECRET"""
+    message = timestamp.encode("utf-8") + b"." + body
+    return "sha256=" + hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+class WebhookOutbox:
+    """
+    At-least-once webhook delivery.
+
+    Every webhook is written to a SQLite outbox before delivery is
+    attempted, so pending deliveries survive restarts. A background loop
+    claims due entries (a lease, so several workers sharing the outbox
+    never send the same row at once), POSTs them signed with
+    LARAVEL_API_SECRET, and reschedules failures with exponential backoff
+    and jitter until WEBHOOK_MAX_ATTEMPTS is reached. Delivered rows are
+    deleted; dead ones are pruned after WEBHOOK_DEAD_RETENTION_SECONDS.
+    Receivers should deduplicate on the X-EduAI-Delivery id.
+    """
+
+    def __init__(
+        self,
+        path: str = settings.WEBHOOK_OUTBOX_PATH,
+        max_attempts: int = settings.WEBHOOK_MAX_ATTEMPTS,
+        initial_delay: float = settings.WEBHOOK_INITIAL_DELAY_SECONDS,
+        max_delay: float = settings.WEBHOOK_MAX_DELAY_SECONDS
+    ):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        # A claimed row is sent by nobody else until its lease runs out (e.g. the worker died)
+        self.lease_seconds = settings.WEBHOOK_TIMEOUT_SECONDS * 3
+        self._worker_id = uuid.uuid4().hex
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS webhook_outbox (
+                    id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_error TEXT,
+                    claimed_by TEXT,
+                    lease_until REAL
+                )"""
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(webhook_outbox)")}
+            for column, kind in (("claimed_by", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    # outbox files created before leases were added
+                    self._db.execute(f"ALTER TABLE webhook_outbox ADD COLUMN {column} {kind}")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_webhook_outbox_due ON webhook_outbox (status, next_attempt_at)"
+            )
+        return self._db
+
+    async def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        def run():
+            with self._db_lock:
+                return self._connect().execute(sql, params).fetchall()
+        return await asyncio.to_thread(run)
+
+    async def enqueue(self, url: str, payload: Dict[str, Any]) -> str:
+        """Persist a webhook and wake the delivery loop; returns the delivery id"""
+        delivery_id = uuid.uuid4().hex
+        body = json.dumps(payload, ensure_ascii=False, default=str)
+        now = time.time()
+
+        await self._execute(
+            "INSERT INTO webhook_outbox (id, url, body, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+            (delivery_id, url, body, now, now)
+        )
+        self._wakeup.set()
+
+        logger.info(f"📮 Webhook {delivery_id} queued for {url}")
+        return delivery_id
+
+    async def _deliver(self, client: httpx.AsyncClient, row: tuple) -> None:
+        delivery_id, url, body, attempts = row
+        body_bytes = body.encode("utf-8")
+        timestamp = str(int(time.time()))
+
+        headers = {
+            "Content-Type": "application/json",
+            DELIVERY_HEADER: delivery_id,
+            TIMESTAMP_HEADER: timestamp
+        }
+        if settings.LARAVEL_API_SECRET:
+            headers[SIGNATURE_HEADER] = sign(body_bytes, timestamp, settings.LARAVEL_API_SECRET)
+        else:
+            logger.warning(f"⚠️ Sending webhook {delivery_id} UNSIGNED: LARAVEL_API_SECRET is not set")
+
+        try:
+            response = await client.post(url, content=body_bytes, headers=headers)
+            response.raise_for_status()
+        except Exception as e:
+            attempts += 1
+            if attempts >= self.max_attempts:
+                logger.error(f"❌ Webhook {delivery_id} gave up after {attempts} attempts: {e}")
+                await self._execute(
+                    "UPDATE webhook_outbox SET status = 'dead', attempts = ?, next_attempt_at = ?, "
+                    "last_error = ?, claimed_by = NULL WHERE id = ?",
+                    (attempts, time.time(), str(e)[:500], delivery_id)
+                )
+                return
+
+            delay = min(self.initial_delay * 2 ** (attempts - 1), self.max_delay)
+            delay *= random.uniform(0.8, 1.2)
+            logger.warning(f"⚠️ Webhook {delivery_id} attempt {attempts} failed, retrying in {delay:.0f}s: {e}")
+            await self._execute(
+                "UPDATE webhook_outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, "
+                "last_error = ?, claimed_by = NULL WHERE id = ?",
+                (attempts, time.time() + delay, str(e)[:500], delivery_id)
+            )
+            return
+
+        logger.info(f"📨 Webhook {delivery_id} delivered to {url}")
+        await self._execute("DELETE FROM webhook_outbox WHERE id = ?", (delivery_id,))
+
+    async def _claim(self) -> List[tuple]:
+        """Atomically take up to 20 due rows (or rows whose lease expired) for this worker"""
+        now = time.time()
+        claim = f"{self._worker_id}:{uuid.uuid4().hex}"
+
+        def run():
+            with self._db_lock:
+                db = self._connect()
+                db.execute(
+                    "UPDATE webhook_outbox SET status = 'sending', claimed_by = ?, lease_until = ? "
+                    "WHERE id IN (SELECT id FROM webhook_outbox "
+                    "WHERE (status = 'pending' AND next_attempt_at <= ?) "
+                    "OR (status = 'sending' AND lease_until <= ?) "
+                    "ORDER BY next_attempt_at LIMIT 20)",
+                    (claim, now + self.lease_seconds, now, now)
+                )
+                return db.execute(
+                    "SELECT id, url, body, attempts FROM webhook_outbox WHERE claimed_by = ?", (claim,)
+                ).fetchall()
+        return await asyncio.to_thread(run)
+
+    async def prune(self) -> int:
+        """Delete dead deliveries older than WEBHOOK_DEAD_RETENTION_SECONDS"""
+        def run():
+            with self._db_lock:
+                return self._connect().execute(
+                    "DELETE FROM webhook_outbox WHERE status = 'dead' AND next_attempt_at < ?",
+                    (time.time() - settings.WEBHOOK_DEAD_RETENTION_SECONDS,)
+                ).rowcount
+        pruned = await asyncio.to_thread(run)
+        if pruned:
+            logger.info(f"🧹 Pruned {pruned} dead webhook(s)")
+        return pruned
+
+    async def _run(self) -> None:
+        last_prune = 0.0
+        async with httpx.AsyncClient(timeout=settings.WEBHOOK_TIMEOUT_SECONDS) as client:
+            while True:
+                self._wakeup.clear()
+                try:
+                    if time.time() - last_prune >= 3600:
+                        last_prune = time.time()
+                        await self.prune()
+
+                    due = await self._claim()
+                    if due:
+                        await asyncio.gather(*(self._deliver(client, row) for row in due))
+                        continue
+
+                    upcoming = await self._execute(
+                        "SELECT MIN(next_attempt_at) FROM webhook_outbox WHERE status = 'pending'"
+                    )
+                except Exception as e:
+                    logger.error(f"❌ Webhook outbox error: {e}")
+                    upcoming = [(None,)]
+
+                next_at = upcoming[0][0]
+                timeout = settings.WEBHOOK_POLL_SECONDS if next_at is None else max(0.0, next_at - time.time())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(timeout, settings.WEBHOOK_POLL_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+
+    def start(self) -> None:
+        """Start delivering (including entries left over from a previous run)"""
+        if self._loop_task is None:
+            if not settings.LARAVEL_API_SECRET:
+                logger.warning("⚠️ LARAVEL_API_SECRET is not set: webhooks will be sent unsigned")
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+webhook_outbox = WebhookOutbox()
@@ -0,0 +1,203 @@
+"""In-process LRU/TTL cache with an optional shared Redis tier"""
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# All named caches, for the /cache/stats endpoint
+cache_registry: Dict[str, "TieredCache"] = {}
+
+
+def content_hash(*parts: Any) -> str:
+    """SHA-256 over the given parts (bytes-like parts are hashed raw, anything else as str)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            digest.update(part)
+        else:
+            digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Least-recently-used cache bounded by entry count, total weight and TTL"""
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        max_weight: int = 0,
+        weigher: Optional[Callable[[Any], int]] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_weight = max_weight
+        self.weigher = weigher or (lambda value: 1)
+        self.evictions = 0
+        self._weight = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        value, weight, expires_at = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        weight = self.weigher(value)
+        if self.max_weight and weight > self.max_weight:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (value, weight, time.monotonic() + self.ttl_seconds)
+        self._weight += weight
+
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_weight and self._weight > self.max_weight)
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        if key in self._entries:
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        _, weight, _ = self._entries.pop(key)
+        self._weight -= weight
+
+
+class RedisTier:
+    """Shared cache tier on the configured Redis instance (shared by all workers)"""
+
+    def __init__(self, namespace: str, ttl_seconds: int):
+        self.namespace = namespace
+        self.ttl_seconds = int(ttl_seconds)
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+
+            self._client = redis.Redis(
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT,
+                db=settings.REDIS_DB,
+                password=settings.REDIS_PASSWORD or None
+            )
+        return self._client
+
+    def _key(self, key: str) -> str:
+        return f"eduai:{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            return await self._get_client().get(self._key(key))
+        except Exception as e:
+            logger.warning(f"⚠️ Redis cache read failed ({self.namespace}): {e}")
+            return None
+
+    async def set(self, key: str, value: str) -> None:
+        try:
+            await self._get_client().set(self._key(key), value, ex=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"⚠️ Redis cache write failed ({self.namespace}): {e}")
+
+    async def delete(self, key: str) -> None:
+        try:
+            await self._get_client().delete(self._key(key))
+        except Exception as e:
+            logger.warning(f"⚠️ Redis cache delete failed ({self.namespace}): {e}")
+
+
+class TieredCache:
+    """
+    Two-tier cache: a per-process LRU in front of an optional Redis tier.
+
+    Values are serialized to strings only for the Redis tier; Redis hits
+    are promoted into the local LRU.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int,
+        ttl_seconds: int,
+        serialize: Callable[[Any], str],
+        deserialize: Callable[[bytes], Any],
+        use_redis: bool = False,
+        max_weight: int = 0,
+        weigher: Optional[Callable[[Any], int]] = None
+    ):
+        self.name = name
+        self.local = LRUCache(max_entries, ttl_seconds, max_weight, weigher)
+        self.redis = RedisTier(name, ttl_seconds) if use_redis else None
+        self.serialize = serialize
+        self.deserialize = deserialize
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        cache_registry[name] = self
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.redis is not None:
+            raw = await self.redis.get(key)
+            if raw is not None:
+                try:
+                    value = self.deserialize(raw)
+                except Exception as e:
+                    logger.warning(f"⚠️ Discarding corrupt cache entry ({self.name}): {e}")
+                else:
+                    self.redis_hits += 1
+                    self.local.set(key, value)
+                    return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any) -> None:
+        self.local.set(key, value)
+        if self.redis is not None:
+            await self.redis.set(key, self.serialize(value))
+
+    async def delete(self, key: str) -> None:
+        self.local.delete(key)
+        if self.redis is not None:
+            await self.redis.delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.redis_hits) / lookups, 4) if lookups else 0.0,
+            "entries": len(self.local),
+            "evictions": self.local.evictions,
+            "redis_enabled": self.redis is not None
+        }
@@ -0,0 +1,174 @@
+"""Tolerant parsing of malformed or truncated JSON model output"""
+import json
+import logging
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+_VALID_ESCAPES = set('"\\/bfnrtu')
+_CLOSERS = {"{": "}", "[": "]"}
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+class RepairStats:
+    """How often model output needed repair and how often the repair was usable"""
+
+    def __init__(self):
+        self.clean = 0          # parsed as-is
+        self.repaired = 0       # parsed after repair
+        self.rejected = 0       # repaired, but failed the caller's validation
+        self.unsalvageable = 0  # could not be parsed even after repair
+
+    def stats(self) -> Dict[str, Any]:
+        attempts = self.repaired + self.unsalvageable
+        return {
+            "clean": self.clean,
+            "repaired": self.repaired,
+            "rejected": self.rejected,
+            "unsalvageable": self.unsalvageable,
+            "repair_success_rate": round((self.repaired - self.rejected) / attempts, 4) if attempts else 0.0
+        }
+
+
+repair_stats = RepairStats()
+
+
+def _next_significant(text: str, index: int) -> str:
+    while index < len(text) and text[index] in " \t\r\n":
+        index += 1
+    return text[index] if index < len(text) else ""
+
+
+def _strip_trailing_comma(out: List[str]) -> bool:
+    index = len(out) - 1
+    while index >= 0 and out[index] in " \t\r\n":
+        index -= 1
+    if index >= 0 and out[index] == ",":
+        del out[index:]
+        return True
+    return False
+
+
+def _repair(text: str) -> Tuple[str, List[str]]:
+    """
+    Rewrite `text` (starting at its first "{") into parseable JSON.
+
+    One pass with a container stack: trailing commas are dropped, invalid
+    escapes and raw control characters inside strings are escaped, and a
+    quote inside a string that is not followed by , : } ] is treated as
+    part of the string. If the text ends early, it is cut back to the last
+    complete array element (or top-level field) and the open containers
+    are closed, so a half-written trailing item is dropped entirely.
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    # (output length, open containers) where cutting leaves only complete items
+    safe_point: Tuple[int, Tuple[str, ...]] = (0, ())
+    in_string = False
+    fixes = {"escapes": 0, "quotes": 0, "control": 0, "commas": 0}
+
+    def mark_safe() -> None:
+        nonlocal safe_point
+        if stack and (stack[-1] == "[" or len(stack) == 1):
+            safe_point = (len(out), tuple(stack))
+
+    index = 0
+    while index < len(text):
+        char = text[index]
+
+        if in_string:
+            if char == "\\":
+                following = text[index + 1] if index + 1 < len(text) else ""
+                if following in _VALID_ESCAPES and following:
+                    out.append(char + following)
+                    index += 2
+                    continue
+                out.append("\\\\")
+                fixes["escapes"] += 1
+            elif char == '"':
+                if _next_significant(text, index + 1) in ("", ",", ":", "}", "]"):
+                    in_string = False
+                    out.append(char)
+                else:
+                    out.append('\\"')
+                    fixes["quotes"] += 1
+            elif char in _CONTROL_ESCAPES:
+                out.append(_CONTROL_ESCAPES[char])
+                fixes["control"] += 1
+            else:
+                out.append(char)
+            index += 1
+            continue
+
+        if char == '"':
+            in_string = True
+            out.append(char)
+        elif char in "{[":
+            stack.append(char)
+            out.append(char)
+            mark_safe()
+        elif char in "}]":
+            if not stack:
+                break
+            if _strip_trailing_comma(out):
+                fixes["commas"] += 1
+            out.append(_CLOSERS[stack.pop()])
+            if not stack:
+                break
+            mark_safe()
+        elif char == ",":
+            mark_safe()
+            out.append(char)
+        else:
+            out.append(char)
+        index += 1
+
+    warnings = []
+    if fixes["commas"]:
+        warnings.append(f"Removed {fixes['commas']} trailing comma(s)")
+    if fixes["escapes"] or fixes["control"]:
+        warnings.append(f"Escaped {fixes['escapes'] + fixes['control']} invalid character(s) in strings")
+    if fixes["quotes"]:
+        warnings.append(f"Escaped {fixes['quotes']} unescaped quote(s) in strings")
+
+    if stack:
+        length, open_containers = safe_point
+        del out[length:]
+        _strip_trailing_comma(out)
+        out.extend(_CLOSERS[container] for container in reversed(open_containers))
+        warnings.append("Output was truncated: closed open structures and dropped the incomplete trailing item")
+
+    return "".join(out), warnings
+
+
+def repair_json(text: str) -> Tuple[Any, List[str]]:
+    """
+    Parse a JSON object from model output, repairing it if needed.
+
+    Returns (data, warnings); warnings is empty when the text parsed as-is.
+    Raises ValueError when no usable object can be recovered.
+    """
+    start = text.find("{")
+    if start == -1:
+        repair_stats.unsalvageable += 1
+        raise ValueError("No JSON object found in response")
+
+    end = text.rfind("}")
+    if end > start:
+        try:
+            data = json.loads(text[start:end + 1])
+            repair_stats.clean += 1
+            return data, []
+        except json.JSONDecodeError:
+            pass
+
+    repaired, warnings = _repair(text[start:])
+    try:
+        data = json.loads(repaired)
+    except json.JSONDecodeError as e:
+        repair_stats.unsalvageable += 1
+        raise ValueError(f"Model output is not valid JSON and could not be repaired: {e}") from e
+
+    repair_stats.repaired += 1
+    logger.warning(f"🩹 Repaired model JSON: {'; '.join(warnings) or 'minor syntax fixes'}")
+    return data, warnings or ["Repaired malformed JSON output"]
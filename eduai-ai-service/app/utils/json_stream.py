@@ -0,0 +1,88 @@
+"""Incremental parsing of streamed JSON model output"""
+import json
+import logging
+import re
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class ArrayItemStream:
+    """
+    Yield the objects of one JSON array (e.g. "modules") as soon as each
+    object is complete, while the surrounding document is still streaming.
+
+    Feed text chunks in order; `feed` returns the items completed by that
+    chunk. The scanner keeps its string/escape/depth state between chunks,
+    so every character is looked at once.
+    """
+
+    def __init__(self, key: str):
+        self._key_pattern = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+        self._buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start = -1
+        self.items: List[Dict[str, Any]] = []
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self._buffer += chunk
+        completed: List[Dict[str, Any]] = []
+
+        if self._done:
+            return completed
+
+        if not self._in_array:
+            match = self._key_pattern.search(self._buffer)
+            if not match:
+                return completed
+            self._in_array = True
+            self._pos = match.end()
+
+        buffer = self._buffer
+        for i in range(self._pos, len(buffer)):
+            char = buffer[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0:
+                    self._item_start = i
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # closing bracket of the array itself
+                    self._done = True
+                    self._pos = i + 1
+                    return completed
+                self._depth -= 1
+                if self._depth == 0:
+                    raw = buffer[self._item_start:i + 1]
+                    try:
+                        item = json.loads(raw)
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"⚠️ Skipping unparseable streamed item: {e}")
+                    else:
+                        self.items.append(item)
+                        completed.append(item)
+
+        self._pos = len(buffer)
+        return completed
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far"""
+        return self._buffer
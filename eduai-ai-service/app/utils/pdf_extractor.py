@@ -1,35 +1,372 @@
 """Robust PDF Content Extraction"""
+import asyncio
 import logging
-from typing import BinaryIO
+import mmap
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import BytesIO
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple, Union
 import pdfplumber
+from pypdf import PdfReader
 from app.models.schemas import ExtractedContent
+from app.config import settings, TIMEOUT_CONFIG
+from app.utils.cache import TieredCache, content_hash
 
 logger = logging.getLogger(__name__)
 
+# Either raw PDF bytes or a filesystem path that worker processes can open
+PDFSource = Union[bytes, str]
+
+# Rough text density used when estimating content size without extraction
+AVG_CHARS_PER_PAGE = 2000
+AVG_BYTES_PER_PAGE = 50_000
+
+
+class ExtractionQueueFullError(RuntimeError):
+    """Raised when the extraction pool already has too many pending jobs"""
+
+
+def _open_pdf(source: PDFSource):
+    return pdfplumber.open(BytesIO(source) if isinstance(source, bytes) else source)
+
+
+def _extract_text(
+    source: PDFSource,
+    shard_min_pages: Optional[int] = None
+) -> Tuple[Optional[str], int]:
+    """
+    Extract text serially (runs inside a worker process).
+
+    Returns (None, page_count) without extracting when the document has at
+    least `shard_min_pages` pages, so the caller can switch to sharded mode.
+    """
+    text_parts = []
+
+    with _open_pdf(source) as pdf:
+        page_count = len(pdf.pages)
+
+        if shard_min_pages and page_count >= shard_min_pages:
+            return None, page_count
+
+        for page_num, page in enumerate(pdf.pages, 1):
+            page_text = page.extract_text()
+            if page_text:
+                text_parts.append(page_text)
+
+            if page_num % 10 == 0:
+                logger.info(f"   Processed {page_num}/{page_count} pages")
+
+    return "\n\n".join(text_parts), page_count
+
+
+def _source_size(source: PDFSource) -> int:
+    return len(source) if isinstance(source, bytes) else os.path.getsize(source)
+
+
+def _count_pages(source: PDFSource) -> int:
+    """Read the page tree only, without parsing page content"""
+    try:
+        return len(PdfReader(BytesIO(source) if isinstance(source, bytes) else source).pages)
+    except Exception:
+        return max(1, _source_size(source) // AVG_BYTES_PER_PAGE)
+
+
+def _hash_source(source: PDFSource) -> str:
+    if isinstance(source, bytes) or os.path.getsize(source) == 0:
+        return content_hash(source if isinstance(source, bytes) else b"")
+
+    # Hash the file through a memory map instead of reading it into memory
+    with open(source, "rb") as pdf_file:
+        with mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return content_hash(memoryview(mapped))
+
+
+def _spill_to_temp(pdf_bytes: bytes) -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
+        temp_file.write(pdf_bytes)
+        return temp_file.name
+
+
+def _extract_page_range(path: str, start: int, end: int) -> List[str]:
+    """Extract non-empty page texts for pages [start, end) (runs inside a worker process)"""
+    text_parts = []
+
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages[start:end]:
+            page_text = page.extract_text()
+            if page_text:
+                text_parts.append(page_text)
+
+    logger.info(f"   Processed pages {start + 1}-{end}")
+    return text_parts
+
 
 class PDFExtractor:
     """Extract and analyze content from PDF files"""
 
-    async def extract(self, pdf_file: BinaryIO) -> ExtractedContent:
-        """Extract content from PDF"""
-        logger.info("📄 Extracting PDF content...")
+    def __init__(
+        self,
+        max_workers: int = settings.PDF_EXTRACTION_WORKERS,
+        max_queue: int = settings.PDF_EXTRACTION_MAX_QUEUE,
+        timeout_seconds: float = TIMEOUT_CONFIG["pdf_extraction"],
+        shard_min_pages: int = settings.PDF_SHARD_MIN_PAGES,
+        shard_workers: int = settings.PDF_SHARD_WORKERS
+    ):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(self.max_workers, max_queue)
+        self.timeout_seconds = timeout_seconds
+        self.shard_min_pages = shard_min_pages
+        # More shards than cores only adds process overhead
+        self.shard_workers = min(shard_workers, self.max_workers, os.cpu_count() or 1)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # Pool jobs not finished yet, with the pool that runs them. A job keeps
+        # its slot until the worker is done, even if its request was cancelled
+        self._jobs: Dict[Future, ProcessPoolExecutor] = {}
+        self._jobs_lock = threading.Lock()
+        # Requests admitted but without a pool job yet (hashing, cache lookup);
+        # reserved synchronously so a burst cannot all pass the queue check
+        self._reserved = 0
+        # Background kills of retired pools (kept referenced until done)
+        self._retire_tasks: Set[asyncio.Task] = set()
+        # Extractions nobody awaits anymore, left to finish into the cache
+        self._background: Set[asyncio.Task] = set()
+        self.cache = TieredCache(
+            name="pdf_extraction",
+            max_entries=settings.EXTRACTION_CACHE_ENTRIES,
+            ttl_seconds=settings.EXTRACTION_CACHE_TTL_SECONDS,
+            serialize=lambda content: content.model_dump_json(),
+            deserialize=ExtractedContent.model_validate_json,
+            use_redis=settings.EXTRACTION_CACHE_REDIS,
+            max_weight=settings.EXTRACTION_CACHE_MAX_CHARS,
+            weigher=lambda content: content.char_count
+        )
+
+    @property
+    def in_flight(self) -> int:
+        """Pool jobs not finished (running or waiting for a worker) plus admitted requests without one yet"""
+        with self._jobs_lock:
+            return len(self._jobs) + self._reserved
+
+    def _admit(self, limit: int) -> bool:
+        """Reserve a slot for a new request, before any await, if fewer than `limit` are taken"""
+        if self.in_flight >= limit:
+            return False
+        self._reserved += 1
+        return True
+
+    @property
+    def sharding_enabled(self) -> bool:
+        return self.shard_workers > 1 and self.shard_min_pages > 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    def _job_done(self, future: Future) -> None:
+        with self._jobs_lock:
+            self._jobs.pop(future, None)
+
+    def _retire_pool(self, stuck: List[Future]) -> None:
+        """
+        Replace the pool after a request timed out on `stuck` jobs.
+
+        New jobs go to a fresh pool right away. The old workers are killed
+        once the other requests' jobs on them have finished (each is bounded
+        by its own request timeout), so only the timed-out request fails.
+        """
+        for future in stuck:
+            future.cancel()  # shards not started yet
+        with self._jobs_lock:
+            owners = {self._jobs[future] for future in stuck if future in self._jobs}
+        pool = self._pool
+        if pool is None or pool not in owners:
+            # nothing left running, or the pool is already being retired
+            return
+
+        self._pool = None
+        with self._jobs_lock:
+            others = [
+                future for future, owner in self._jobs.items()
+                if owner is pool and future not in stuck
+            ]
+        processes = list(getattr(pool, "_processes", {}).values())
+        pool.shutdown(wait=False)
+
+        async def terminate_when_drained():
+            if others:
+                await asyncio.wait(
+                    [asyncio.wrap_future(future) for future in others],
+                    timeout=self.timeout_seconds
+                )
+            for process in processes:
+                process.terminate()
+            logger.info(f"♻️ Retired extraction pool ({len(processes)} workers) after timeout")
+
+        task = asyncio.create_task(terminate_when_drained())
+        self._retire_tasks.add(task)
+        task.add_done_callback(self._retire_tasks.discard)
+
+    def shutdown(self) -> None:
+        """Release worker processes (called on application shutdown)"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def _run(self, fn, *args, jobs: Optional[List[Future]] = None):
+        """
+        Run `fn` in the pool; its future is appended to `jobs` (the request's jobs).
+
+        The request's first job takes over the slot reserved by _admit.
+        """
+        pool = self._get_pool()
+        future = pool.submit(fn, *args)
+        with self._jobs_lock:
+            self._jobs[future] = pool
+            if jobs is not None and not jobs:
+                self._reserved -= 1
+        future.add_done_callback(self._job_done)
+        if jobs is not None:
+            jobs.append(future)
+        return await asyncio.wrap_future(future)
+
+    async def _extract_sharded(
+        self,
+        source: PDFSource,
+        page_count: int,
+        jobs: Optional[List[Future]] = None
+    ) -> str:
+        """
+        Split the page range into chunks and extract them in parallel workers.
+
+        Every chunk is a pool job counted against max_queue, so under load
+        the document is split into fewer chunks instead of overrunning it.
+        """
+        shards = max(1, min(self.shard_workers, self.max_queue - self.in_flight))
+        chunk_size = -(-page_count // shards)
+        ranges = [
+            (start, min(start + chunk_size, page_count))
+            for start in range(0, page_count, chunk_size)
+        ]
+        logger.info(f"   Sharding {page_count} pages into {len(ranges)} chunks")
+
+        temp_path = None
+        if isinstance(source, bytes):
+            # Workers open the document by path, so spill in-memory uploads once
+            temp_path = await asyncio.to_thread(_spill_to_temp, source)
+        path = temp_path or source
 
         try:
-            text_parts = []
-            page_count = 0
+            chunks = await asyncio.gather(
+                *(self._run(_extract_page_range, path, start, end, jobs=jobs) for start, end in ranges)
+            )
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+        return "\n\n".join(text for chunk in chunks for text in chunk)
+
+    async def _extract_text_from_source(
+        self,
+        source: PDFSource,
+        jobs: Optional[List[Future]] = None
+    ) -> Tuple[str, int]:
+        shard_min_pages = self.shard_min_pages if self.sharding_enabled else None
+        full_text, page_count = await self._run(_extract_text, source, shard_min_pages, jobs=jobs)
+
+        if full_text is None:
+            full_text = await self._extract_sharded(source, page_count, jobs)
+
+        return full_text, page_count
+
+    async def content_key(self, source: PDFSource) -> str:
+        """SHA-256 of the PDF bytes (cache key and document id)"""
+        return await asyncio.to_thread(_hash_source, source)
+
+    async def estimate(self, source: PDFSource) -> ExtractedContent:
+        """
+        Estimate content size from cheap signals (page count, file size).
+
+        Used for routing when the full text is not needed up front; the
+        returned content has an empty `text`.
+        """
+        page_count = await asyncio.to_thread(_count_pages, source)
+        char_count = page_count * AVG_CHARS_PER_PAGE
 
-            with pdfplumber.open(pdf_file) as pdf:
-                page_count = len(pdf.pages)
+        logger.info(
+            f"📏 Estimated: {page_count} pages, ~{char_count} chars "
+            f"({_source_size(source) / 1024:.0f} KB)"
+        )
 
-                for page_num, page in enumerate(pdf.pages, 1):
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_parts.append(page_text)
+        return ExtractedContent(
+            text="",
+            char_count=char_count,
+            word_count=char_count // 6,
+            page_count=page_count,
+            quality_score=self._calculate_quality("", page_count)
+        )
 
-                    if page_num % 10 == 0:
-                        logger.info(f"   Processed {page_num}/{page_count} pages")
+    def start_speculative(self, source: PDFSource) -> Optional[asyncio.Task]:
+        """Start a background extraction only if the pool has idle workers"""
+        if not settings.PDF_SPECULATIVE_EXTRACTION or not self._admit(self.max_workers):
+            return None
+
+        logger.info("🔮 Starting speculative PDF extraction on idle worker")
+        return asyncio.create_task(
+            self._extract(BytesIO(source) if isinstance(source, bytes) else source, [])
+        )
+
+    def finish_in_background(self, task: asyncio.Task) -> None:
+        """
+        Let an extraction whose caller no longer needs it run to completion.
+
+        Cancelling the task would not stop its pool job anyway; finishing
+        it stores the text in the extraction cache for later fallbacks,
+        retries and /quiz calls on the same document.
+        """
+        if task.done():
+            return
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        if not task.cancelled():
+            task.exception()  # already logged by _extract
+
+    async def extract(self, pdf_file: Union[BinaryIO, str]) -> ExtractedContent:
+        """Extract content from a PDF file object or path (paths are never read into memory)"""
+        if not self._admit(self.max_queue):
+            logger.warning(f"⚠️ PDF extraction queue full ({self.in_flight}/{self.max_queue})")
+            raise ExtractionQueueFullError(
+                f"PDF extraction queue is full ({self.max_queue} jobs pending)"
+            )
+        return await self._extract(pdf_file, [])
+
+    async def _extract(self, pdf_file: Union[BinaryIO, str], jobs: List[Future]) -> ExtractedContent:
+        """extract() for an admitted request; `jobs` collects its pool futures"""
+        logger.info("📄 Extracting PDF content...")
+
+        try:
+            if isinstance(pdf_file, str):
+                source = pdf_file
+            else:
+                name = getattr(pdf_file, "name", None)
+                source = name if isinstance(name, str) and os.path.isfile(name) else pdf_file.read()
+
+            cache_key = await self.content_key(source)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"♻️ Extraction cache hit ({cache_key[:12]}): {cached.page_count} pages")
+                return cached
+
+            full_text, page_count = await asyncio.wait_for(
+                self._extract_text_from_source(source, jobs),
+                timeout=self.timeout_seconds
+            )
 
-            full_text = "\n\n".join(text_parts)
             char_count = len(full_text)
             word_count = len(full_text.split())
 
@@ -41,18 +378,33 @@ class PDFExtractor:
                 f"{word_count} words, quality: {quality_score:.0%}"
             )
 
-            return ExtractedContent(
+            extracted = ExtractedContent(
                 text=full_text,
                 char_count=char_count,
                 word_count=word_count,
                 page_count=page_count,
                 quality_score=quality_score
             )
+            await self.cache.set(cache_key, extracted)
+
+            return extracted
+
+        except asyncio.TimeoutError:
+            logger.error(f"❌ PDF extraction timed out after {self.timeout_seconds}s")
+            self._retire_pool(jobs)
+            raise ValueError(
+                f"Failed to extract PDF content: timed out after {self.timeout_seconds}s"
+            )
 
         except Exception as e:
             logger.error(f"❌ PDF extraction failed: {e}")
             raise ValueError(f"Failed to extract PDF content: {str(e)}")
 
+        finally:
+            if not jobs:
+                # cache hit or failure before any pool job: give the reserved slot back
+                self._reserved -= 1
+
     def _calculate_quality(self, text: str, page_count: int) -> float:
         """Calculate content quality score"""
         score = 0.5  # Base score
@@ -0,0 +1,144 @@
+"""Gemini structured-output schemas derived from the Pydantic models"""
+from typing import Any, Dict, Iterable, List, Optional, Type
+
+from pydantic import BaseModel
+
+# JSON Schema keywords Gemini's Schema cannot express, turned into description hints
+_HINTS = {
+    "minLength": "at least {} characters",
+    "maxLength": "at most {} characters",
+    "minimum": "minimum {}",
+    "maximum": "maximum {}"
+}
+
+
+def _resolve(schema: Dict[str, Any], defs: Dict[str, Any]) -> Dict[str, Any]:
+    while "$ref" in schema:
+        schema = defs[schema["$ref"].rsplit("/", 1)[-1]]
+    return schema
+
+
+def _merge_objects(variants: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    One object schema for a union of objects (Gemini has no anyOf here).
+
+    Properties are the union of all variants; a property every variant has
+    with a different string default (e.g. activity "type") becomes a
+    required enum, so the model still says which variant it produced.
+    Only fields every variant requires stay required: per-variant required
+    fields (lesson "content", quiz "questions") cannot be enforced while
+    decoding, so they get a "required when ..." description hint and are
+    still checked by Pydantic validation afterwards.
+    """
+    properties: Dict[str, Any] = {}
+    for variant in variants:
+        for name, prop in variant.get("properties", {}).items():
+            properties.setdefault(name, prop)
+
+    required = set.intersection(*(set(v.get("required", [])) for v in variants))
+    tags: List[Optional[str]] = [None] * len(variants)
+    for name in properties:
+        defaults = [v.get("properties", {}).get(name, {}).get("default") for v in variants]
+        if all(isinstance(d, str) for d in defaults) and len(set(defaults)) == len(defaults):
+            properties[name] = {**properties[name], "enum": defaults}
+            required.add(name)
+            tags = [f'{name} is "{default}"' for default in defaults]
+
+    for name in properties:
+        if name in required:
+            continue
+        when = [tag for tag, v in zip(tags, variants) if tag and name in v.get("required", [])]
+        if when:
+            hint = f"(required when {' or '.join(when)})"
+            description = properties[name].get("description")
+            properties[name] = {**properties[name], "description": f"{description} {hint}" if description else hint}
+
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": [name for name in properties if name in required]
+    }
+
+
+def _convert(schema: Dict[str, Any], defs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    schema = _resolve(schema, defs)
+
+    if "anyOf" in schema:
+        variants = [_resolve(v, defs) for v in schema["anyOf"]]
+        nullable = any(v.get("type") == "null" for v in variants)
+        variants = [v for v in variants if v.get("type") != "null"]
+        if len(variants) == 1:
+            merged = {**variants[0], **{k: v for k, v in schema.items() if k != "anyOf"}}
+        elif all(v.get("type") == "object" for v in variants):
+            merged = _merge_objects(variants)
+        else:
+            return None
+        converted = _convert(merged, defs)
+        if converted is not None and nullable:
+            converted["nullable"] = True
+        return converted
+
+    kind = schema.get("type")
+    converted: Dict[str, Any] = {"type": kind}
+
+    hints = [hint.format(schema[key]) for key, hint in _HINTS.items() if key in schema]
+    description = " ".join(filter(None, [schema.get("description"), f"({', '.join(hints)})" if hints else ""]))
+    if description:
+        converted["description"] = description
+    if "enum" in schema:
+        converted["enum"] = [str(value) for value in schema["enum"]]
+
+    if kind == "array":
+        items = _convert(schema.get("items", {"type": "string"}), defs)
+        if items is None:
+            return None
+        converted["items"] = items
+        if "minItems" in schema:
+            converted["min_items"] = schema["minItems"]
+        if "maxItems" in schema:
+            converted["max_items"] = schema["maxItems"]
+
+    elif kind == "object":
+        properties = {}
+        for name, prop in schema.get("properties", {}).items():
+            prop = _convert(prop, defs)
+            if prop is not None:
+                properties[name] = prop
+        if not properties:
+            # free-form dicts cannot be described to Gemini
+            return None
+        converted["properties"] = properties
+        required = [name for name in schema.get("required", []) if name in properties]
+        if required:
+            converted["required"] = required
+
+    elif kind not in ("string", "integer", "number", "boolean"):
+        return None
+
+    return converted
+
+
+def gemini_response_schema(model: Type[BaseModel], exclude: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    `response_schema` for generation_config, built from a Pydantic model.
+
+    Types, required fields, enums and list sizes are enforced while
+    decoding; string lengths and numeric ranges are not supported by the
+    API and are added to the field descriptions instead. Unions of objects
+    are merged (see _merge_objects), so fields required by only one
+    variant are not enforced while decoding. Free-form dict fields and
+    `exclude`d top-level fields are left out. Whatever the schema cannot
+    express is still enforced by validating the parsed output.
+    """
+    json_schema = model.model_json_schema()
+    defs = json_schema.get("$defs", {})
+    excluded = set(exclude)
+    json_schema = {
+        **json_schema,
+        "properties": {k: v for k, v in json_schema["properties"].items() if k not in excluded},
+        "required": [k for k in json_schema.get("required", []) if k not in excluded]
+    }
+    schema = _convert(json_schema, defs)
+    if schema is None:
+        raise ValueError(f"{model.__name__} cannot be expressed as a Gemini response schema")
+    return schema
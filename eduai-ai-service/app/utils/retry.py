@@ -0,0 +1,152 @@
+"""Stage-aware retries for model calls, with a per-request budget and deadline"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.types import BlockedPromptException, StopCandidateException
+
+from app.config import RETRY_CONFIG
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT = "transient"          # 429, 5xx, timeouts, dropped connections: retry with backoff
+OUTPUT_FORMAT = "output_format"  # unparseable / invalid model output: retry right away
+PERMANENT = "permanent"          # bad input, auth, blocked prompt: never retry
+
+# Attempts per stage call (first try included) for each retryable category
+MAX_ATTEMPTS = {
+    TRANSIENT: RETRY_CONFIG["max_attempts"],
+    OUTPUT_FORMAT: RETRY_CONFIG["output_format_attempts"],
+    PERMANENT: 1
+}
+
+
+def classify_error(error: BaseException) -> str:
+    """Sort an exception into TRANSIENT, OUTPUT_FORMAT or PERMANENT"""
+    if isinstance(error, google_exceptions.GoogleAPICallError):
+        code = error.code or 0
+        return TRANSIENT if code in (408, 429) or code >= 500 else PERMANENT
+    if isinstance(error, google_exceptions.RetryError):
+        return TRANSIENT
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError, httpx.TransportError)):
+        return TRANSIENT
+    if isinstance(error, BlockedPromptException):
+        return PERMANENT
+    if isinstance(error, (StopCandidateException, json.JSONDecodeError, ValueError, KeyError, TypeError)):
+        # ValueError also covers pydantic validation and response.text without parts
+        return OUTPUT_FORMAT
+    return PERMANENT
+
+
+class RetryBudget:
+    """
+    Retries shared by every stage of one request.
+
+    At most RETRY_CONFIG["request_budget"] retries are spent in total, and
+    none is started if its backoff would end past the request deadline.
+    Every retry (and every give-up) is recorded for GenerationMetadata.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = RETRY_CONFIG["request_budget"],
+        deadline_seconds: float = RETRY_CONFIG["deadline_seconds"]
+    ):
+        self.max_retries = max_retries
+        self.deadline = time.monotonic() + deadline_seconds
+        self.retries = 0
+        self.records: List[Dict[str, Any]] = []
+
+    def allow(self, delay: float) -> Optional[str]:
+        """None when a retry after `delay` seconds is allowed, otherwise the reason it is not"""
+        if self.retries >= self.max_retries:
+            return "retry budget exhausted"
+        if time.monotonic() + delay > self.deadline:
+            return "request deadline reached"
+        return None
+
+    def record(self, stage: str, category: str, attempt: int, error: BaseException, outcome: str) -> None:
+        if outcome == "retried":
+            self.retries += 1
+        self.records.append({
+            "stage": stage,
+            "attempt": attempt,
+            "category": category,
+            "error": f"{type(error).__name__}: {error}"[:300],
+            "outcome": outcome
+        })
+
+    def annotate(self, metadata: Dict[str, Any]) -> None:
+        """Add this budget's records to a generation's metadata"""
+        metadata.setdefault("retries", []).extend(self.records)
+        metadata["retry_count"] = sum(1 for record in metadata["retries"] if record["outcome"] == "retried")
+
+
+_current_budget: contextvars.ContextVar[Optional[RetryBudget]] = contextvars.ContextVar(
+    "retry_budget", default=None
+)
+
+
+@contextmanager
+def retry_scope(budget: Optional[RetryBudget] = None) -> Iterator[RetryBudget]:
+    """Share one RetryBudget among all stage calls (and tasks they start) inside the block"""
+    budget = budget or RetryBudget()
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+
+def _backoff(attempt: int) -> float:
+    delay = RETRY_CONFIG["initial_delay"] * RETRY_CONFIG["exponential_base"] ** (attempt - 1)
+    return min(delay, RETRY_CONFIG["max_delay"]) * random.uniform(0.8, 1.2)
+
+
+def stage_retry(stage: str, retry_on: Tuple[str, ...] = (TRANSIENT, OUTPUT_FORMAT)):
+    """
+    Retry an async stage call according to the error category.
+
+    Only the decorated call is repeated (never the stages before it).
+    Transient errors back off exponentially (RETRY_CONFIG), output-format
+    errors are retried right away, permanent errors fail immediately.
+    Outside a retry_scope each call gets its own budget.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            budget = _current_budget.get() or RetryBudget()
+            attempt = 1
+            while True:
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    category = classify_error(e)
+                    if category not in retry_on or attempt >= MAX_ATTEMPTS[category]:
+                        budget.record(stage, category, attempt, e, "failed")
+                        raise
+
+                    delay = _backoff(attempt) if category == TRANSIENT else 0.0
+                    refused = budget.allow(delay)
+                    if refused:
+                        logger.warning(f"⚠️ {stage} failed ({category}), not retrying: {refused}")
+                        budget.record(stage, category, attempt, e, "failed")
+                        raise
+
+                    budget.record(stage, category, attempt, e, "retried")
+                    logger.warning(
+                        f"🔁 {stage} attempt {attempt} failed ({category}: {e}), retrying in {delay:.1f}s"
+                    )
+                    await asyncio.sleep(delay)
+                    attempt += 1
+
+        return wrapper
+    return decorator
@@ -0,0 +1,107 @@
+"""Coalescing of identical concurrent requests, with optional idempotency keys"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import settings
+from app.utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# All single-flight groups, for the /cache/stats endpoint
+flight_registry: Dict[str, "SingleFlight"] = {}
+
+
+class IdempotencyKeyReusedError(ValueError):
+    """Raised when an Idempotency-Key is sent again with a different request"""
+
+
+class SingleFlight:
+    """
+    Run at most one generation per request fingerprint at a time.
+
+    Concurrent callers with the same fingerprint await the in-flight task
+    instead of starting their own. The task is shielded, so it finishes
+    (and its result is kept) even if the caller that started it goes away.
+
+    Callers that also send an Idempotency-Key get the stored result of an
+    earlier successful call with that key for IDEMPOTENCY_TTL_SECONDS.
+    Failures are not stored, so a retry runs again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: int = settings.IDEMPOTENCY_TTL_SECONDS,
+        max_entries: int = settings.IDEMPOTENCY_MAX_ENTRIES
+    ):
+        self.name = name
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        # idempotency key -> (fingerprint, result)
+        self._results = LRUCache(max_entries, ttl_seconds)
+        self.started = 0
+        self.coalesced = 0
+        self.replayed = 0
+        flight_registry[name] = self
+
+    async def run(
+        self,
+        fingerprint: str,
+        factory: Callable[[], Awaitable[Any]],
+        idempotency_key: Optional[str] = None,
+        cleanup: Optional[Callable[[], None]] = None
+    ) -> Tuple[Any, bool]:
+        """
+        Return (result, shared) where `shared` is True when the result came
+        from another caller's run or from the idempotency store.
+
+        `cleanup` releases this caller's inputs (e.g. its spooled upload):
+        after the generation when this call started it, right away otherwise.
+        """
+        if idempotency_key:
+            stored = self._results.get(idempotency_key)
+            if stored is not None:
+                if cleanup:
+                    cleanup()
+                stored_fingerprint, result = stored
+                if stored_fingerprint != fingerprint:
+                    raise IdempotencyKeyReusedError(
+                        "Idempotency-Key was already used for a different request"
+                    )
+                self.replayed += 1
+                logger.info(f"♻️ Idempotent replay ({self.name}) for key {idempotency_key[:16]}")
+                return result, True
+
+        task = self._in_flight.get(fingerprint)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+            logger.info(f"🔗 Joined in-flight {self.name} generation {fingerprint[:12]}")
+            if cleanup:
+                cleanup()
+        else:
+            self.started += 1
+            task = asyncio.create_task(factory())
+            self._in_flight[fingerprint] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(fingerprint, None))
+            if cleanup:
+                task.add_done_callback(lambda _: cleanup())
+
+        if idempotency_key:
+            # Stored from the task itself, so a caller that disconnected still gets it on retry
+            task.add_done_callback(lambda done: self._remember(idempotency_key, fingerprint, done))
+
+        return await asyncio.shield(task), shared
+
+    def _remember(self, idempotency_key: str, fingerprint: str, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is None:
+            self._results.set(idempotency_key, (fingerprint, task.result()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "idempotent_replays": self.replayed,
+            "in_flight": len(self._in_flight),
+            "stored_results": len(self._results)
+        }
@@ -0,0 +1,18 @@
+"""Server-Sent Events helpers"""
+import json
+from typing import Any
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one SSE message with a JSON payload"""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+# Comment line that keeps idle connections open through proxies
+SSE_KEEPALIVE = ": keep-alive\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # disable proxy buffering (nginx)
+}
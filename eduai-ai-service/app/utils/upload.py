@@ -0,0 +1,103 @@
+"""Streaming upload handling with early size rejection"""
+import asyncio
+import logging
+import os
+import tempfile
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+# Allowance for multipart boundaries and the other form fields
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised as soon as an upload crosses MAX_FILE_SIZE_MB"""
+
+
+def max_upload_bytes() -> int:
+    return settings.MAX_FILE_SIZE_MB * 1024 * 1024
+
+
+def too_large_detail() -> dict:
+    return {
+        "success": False,
+        "error": f"File exceeds the {settings.MAX_FILE_SIZE_MB} MB limit",
+        "error_code": "FILE_TOO_LARGE",
+        "retry_possible": False
+    }
+
+
+async def spool_upload(file: UploadFile, max_bytes: int = 0, suffix: str = ".pdf") -> str:
+    """
+    Copy an upload to a named temp file in fixed-size chunks.
+
+    Only one chunk is held in memory at a time. The caller owns the
+    returned path and must delete it.
+    """
+    max_bytes = max_bytes or max_upload_bytes()
+    written = 0
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        temp_path = temp_file.name
+        try:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLargeError(
+                        f"File exceeds the {settings.MAX_FILE_SIZE_MB} MB limit"
+                    )
+                await asyncio.to_thread(temp_file.write, chunk)
+        except BaseException:
+            temp_file.close()
+            os.unlink(temp_path)
+            raise
+
+    logger.info(f"📥 Upload spooled: {written / 1024:.0f} KB")
+    return temp_path
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject oversized request bodies while they are still being received.
+
+    Requests that declare a Content-Length over the limit are answered with
+    413 before any body is read. Chunked bodies are counted as they stream
+    in, and the request is aborted once the limit is crossed.
+    """
+
+    def __init__(self, app, max_bytes: int = 0):
+        self.app = app
+        self.max_bytes = (max_bytes or max_upload_bytes()) + MULTIPART_OVERHEAD_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            logger.warning(f"⚠️ Rejected upload: Content-Length {int(content_length)} bytes")
+            response = JSONResponse(status_code=413, content={"detail": too_large_detail()})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # HTTPException survives FastAPI's body-parsing error wrapper
+                    raise HTTPException(status_code=413, detail=too_large_detail())
+            return message
+
+        await self.app(scope, limited_receive, send)